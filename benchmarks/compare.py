@@ -0,0 +1,41 @@
+from typing import Dict, Any
+import argparse
+import json
+import sys
+
+# Compares two result files written by benchmarks/run.py, e.g. from the commit before and after a change.
+#   python -m benchmarks.compare <baseline.json> <candidate.json> [--threshold 0.1]
+# Exits with 1 when any benchmark got slower by more than the threshold, so it can gate CI.
+
+def load_results(filepath: str) -> Dict[str, Any]:
+    with open(filepath) as f:
+        return json.load(f)
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Compare two benchmark result files")
+    parser.add_argument("baseline")
+    parser.add_argument("candidate")
+    parser.add_argument("--threshold", type=float, default=0.1, help="relative slowdown counted as a regression (default 0.1 = 10%%)")
+    args = parser.parse_args()
+
+    baseline, candidate = load_results(args.baseline), load_results(args.candidate)
+    if baseline['meta']['config'] != candidate['meta']['config']:
+        print(f"Warning: configs differ, {baseline['meta']['config']} vs {candidate['meta']['config']}", file=sys.stderr)
+
+    regressions = 0
+    print(f"{'benchmark':40} {'baseline':>12} {'candidate':>12} {'change':>8}")
+    for name, result in candidate['results'].items():
+        if name not in baseline['results']:
+            print(f"{name:40} {'-':>12} {result['median_s']*1000:10.3f}ms {'new':>8}")
+            continue
+        before, after = baseline['results'][name]['median_s'], result['median_s']
+        change = (after - before) / before if before > 0 else 0.0
+        flag = ""
+        if change > args.threshold:
+            flag = " REGRESSION"
+            regressions += 1
+        print(f"{name:40} {before*1000:10.3f}ms {after*1000:10.3f}ms {change:+8.1%}{flag}")
+    return 1 if regressions else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
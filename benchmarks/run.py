@@ -0,0 +1,408 @@
+from typing import Dict, List, Tuple, Type, Callable, Any, Optional
+import subprocess
+import statistics
+import tracemalloc
+import argparse
+import platform
+import tempfile
+import datetime
+import random
+import shutil
+import json
+import time
+import sys
+import os
+
+from core.components.world import World, load_world
+from core.components.node import Node, NodeCache, CachePolicy
+from core.components.executor import create_executor
+from core.components.storage import StorageBackend, open_storage
+from core.components.packfile import repack
+from core.globals import STRUCT_DIRNAME, INSTANCES_DIRNAME, STORAGE_MODES, STORAGE_MODE_FILES, NODE_ENCODINGS, NODE_ENCODING_JSON, MAX_SHARD_DEPTH
+from benchmarks.synthetic_world import build_world, load_node_classes, struct_name, param_name, random_value
+
+# Runs the core benchmarks against synthetic worlds and writes the results as JSON, compare two result
+# files from different commits with benchmarks/compare.py.
+#   python -m benchmarks.run [--quick] [--only NAME ...] [--output results.json]
+
+class BenchContext:
+    # shared by every benchmark of a run, the worlds are built once up front
+    args: argparse.Namespace
+    world: World
+    world_dirpath: str
+    scratch_dirpath: str
+
+    def __init__(self, args: argparse.Namespace, tmp_dirpath: str):
+        self.args = args
+        self.tmp_dirpath = tmp_dirpath
+        self.world_dirpath = os.path.join(tmp_dirpath, "world")
+        self.world = build_world(self.world_dirpath, args.structs, args.params, args.instances, args.value_size, args.seed, args.storage, args.encoding, args.shard_depth)
+        self.class_name = struct_name(0)
+        self.classes = load_node_classes(self.world_dirpath, [self.class_name])
+
+    def instance_paths(self) -> List[str]:
+        # node keys, the backend decides where they actually live
+        struct_dirpath = f"{self.world_dirpath}/{STRUCT_DIRNAME}/{self.class_name}"
+        return sorted(f"{struct_dirpath}/{INSTANCES_DIRNAME}/{node_id}.json" for node_id in self.storage(self.world_dirpath).list(struct_dirpath))
+
+    def storage(self, world_dirpath: str) -> StorageBackend:
+        return open_storage(world_dirpath, self.args.storage, encoding=self.args.encoding)
+
+    def new_cache(self, policy: CachePolicy=CachePolicy.LRU, world_dirpath: Optional[str]=None) -> NodeCache:
+        cache = NodeCache(max(1, self.args.instances * 2), policy=policy)
+        cache.storage = self.storage(world_dirpath or self.world_dirpath)
+        return cache
+
+BenchFunction = Callable[[BenchContext], Dict[str, Any]]
+BENCHMARKS: Dict[str, BenchFunction] = {}
+
+def benchmark(name: str) -> Callable[[BenchFunction], BenchFunction]:
+    def _register(function: BenchFunction) -> BenchFunction:
+        BENCHMARKS[name] = function
+        return function
+    return _register
+
+def measure(repeats: int, run: Callable[[], Any], setup: Optional[Callable[[], Any]]=None) -> List[float]:
+    # setup runs before every repeat and is not timed, its return value is passed to run
+    times = []
+    for _ in range(repeats):
+        state = setup() if setup else None
+        start = time.perf_counter()
+        run(state) if setup else run() # type: ignore
+        times.append(time.perf_counter() - start)
+    return times
+
+######################
+#    Benchmarks      #
+######################
+
+@benchmark("load_world")
+def bench_load_world(ctx: BenchContext) -> Dict[str, Any]:
+    return { 'times': measure(ctx.args.repeats, lambda: load_world(ctx.world_dirpath)), 'ops': 1 }
+
+@benchmark("load_world_lazy")
+def bench_load_world_lazy(ctx: BenchContext) -> Dict[str, Any]:
+    return { 'times': measure(ctx.args.repeats, lambda: load_world(ctx.world_dirpath, lazy=True)), 'ops': 1 }
+
+@benchmark("executor_startup")
+def bench_executor_startup(ctx: BenchContext) -> Dict[str, Any]:
+    # loading usercode, the generator module and building the generator, the thread is never started
+    def _run():
+        thread, _ = create_executor(1, ctx.world, "bench_throughput", {}, ctx.new_cache())
+        if not thread:
+            raise RuntimeError("create_executor failed")
+    return { 'times': measure(ctx.args.repeats, _run), 'ops': 1 }
+
+@benchmark("node_load_cold")
+def bench_node_load_cold(ctx: BenchContext) -> Dict[str, Any]:
+    cls, paths = ctx.classes[ctx.class_name], ctx.instance_paths()
+    def _run(cache: NodeCache):
+        for path in paths:
+            cls(path, cache).load_all()
+    return { 'times': measure(ctx.args.repeats, _run, ctx.new_cache), 'ops': len(paths) }
+
+@benchmark("node_load_cold_packed")
+def bench_node_load_cold_packed(ctx: BenchContext) -> Dict[str, Any]:
+    # same reads as node_load_cold from a repacked copy of the struct, pack files only exist for file based storage
+    dirpath = os.path.join(ctx.tmp_dirpath, "packed_world")
+    build_world(dirpath, 1, ctx.args.params, ctx.args.instances, ctx.args.value_size, ctx.args.seed, STORAGE_MODE_FILES, ctx.args.encoding, ctx.args.shard_depth)
+    struct_dirpath = f"{dirpath}/{STRUCT_DIRNAME}/{struct_name(0)}"
+    repack(struct_dirpath)
+    cls = load_node_classes(dirpath, [struct_name(0)])[struct_name(0)]
+    paths = [f"{struct_dirpath}/{INSTANCES_DIRNAME}/{node_id}.json" for node_id in open_storage(dirpath, STORAGE_MODE_FILES, encoding=ctx.args.encoding).list(struct_dirpath)]
+    def _setup() -> NodeCache:
+        cache = NodeCache(max(1, ctx.args.instances * 2))
+        cache.storage = open_storage(dirpath, STORAGE_MODE_FILES, encoding=ctx.args.encoding)
+        return cache
+    def _run(cache: NodeCache):
+        for path in paths:
+            cls(path, cache).load_all()
+    return { 'times': measure(ctx.args.repeats, _run, _setup), 'ops': len(paths) }
+
+@benchmark("node_load_warm")
+def bench_node_load_warm(ctx: BenchContext) -> Dict[str, Any]:
+    cls, paths = ctx.classes[ctx.class_name], ctx.instance_paths()
+    cache = ctx.new_cache()
+    for path in paths:
+        cls(path, cache).load_all()
+    def _run():
+        for path in paths:
+            cls(path, cache).load_all()
+    return { 'times': measure(ctx.args.repeats, _run), 'ops': len(paths) }
+
+@benchmark("node_attr_access")
+def bench_node_attr_access(ctx: BenchContext) -> Dict[str, Any]:
+    # generated getters on nodes that already hold their attributes, what generators do in inner loops
+    cls, paths = ctx.classes[ctx.class_name], ctx.instance_paths()
+    getters = [getattr(cls, f"get_{param_name(i)}") for i in range(ctx.args.params)]
+    cache = ctx.new_cache()
+    nodes = [cls(path, cache) for path in paths]
+    for node in nodes:
+        node.load_all()
+    def _run():
+        for node in nodes:
+            for getter in getters:
+                getter(node)
+    return { 'times': measure(ctx.args.repeats, _run), 'ops': len(nodes) * len(getters) }
+
+@benchmark("node_memory")
+def bench_node_memory(ctx: BenchContext) -> Dict[str, Any]:
+    # a whole struct held as live nodes, the cache is warmed first so only the nodes themselves are traced
+    cls, paths = ctx.classes[ctx.class_name], ctx.instance_paths()
+    cache = ctx.new_cache()
+    for path in paths:
+        cls(path, cache).load_all()
+    sizes = []
+    def _run():
+        tracemalloc.start()
+        nodes = [cls(path, cache) for path in paths]
+        for node in nodes:
+            node.load_all()
+        sizes.append(tracemalloc.get_traced_memory()[0])
+        tracemalloc.stop()
+    return { 'times': measure(ctx.args.repeats, _run), 'ops': len(paths), 'bytes_per_node': statistics.median(sizes) / max(1, len(paths)) }
+
+@benchmark("node_save_write_through")
+def bench_node_save(ctx: BenchContext) -> Dict[str, Any]:
+    cls, paths, attr = ctx.classes[ctx.class_name], ctx.instance_paths(), param_name(0)
+    rng = random.Random(ctx.args.seed)
+    cache = ctx.new_cache()
+    def _run():
+        for path in paths:
+            cls(path, cache)._save(attr, random_value(rng, str, ctx.args.value_size))
+    return { 'times': measure(ctx.args.repeats, _run), 'ops': len(paths) }
+
+@benchmark("node_save_write_back")
+def bench_node_save_write_back(ctx: BenchContext) -> Dict[str, Any]:
+    # what the executor does, every setter is buffered and written once by flush()
+    cls, paths, attrs = ctx.classes[ctx.class_name], ctx.instance_paths(), [param_name(i) for i in range(ctx.args.params)]
+    rng = random.Random(ctx.args.seed)
+    cache = ctx.new_cache()
+    def _run():
+        cache.write_back = True
+        for path in paths:
+            node = cls(path, cache)
+            for attr in attrs:
+                node._save(attr, node._load(attr))
+        cache.flush()
+        cache.write_back = False
+    return { 'times': measure(ctx.args.repeats, _run), 'ops': len(paths) }
+
+def _create_world(ctx: BenchContext, name: str) -> Tuple[Type[Node], Dict[str, Any]]:
+    # creates go into their own world so the instance counts of the other benchmarks stay the same
+    dirpath = os.path.join(ctx.tmp_dirpath, name)
+    build_world(dirpath, 1, ctx.args.params, 0, ctx.args.value_size, ctx.args.seed, ctx.args.storage, ctx.args.encoding, ctx.args.shard_depth)
+    cls = load_node_classes(dirpath, [struct_name(0)])[struct_name(0)]
+    return cls, { 'world_dirpath': dirpath, 'global_cache': ctx.new_cache(world_dirpath=dirpath) }
+
+def _create_rows(ctx: BenchContext, cls: Type[Node], count: int) -> List[Dict[str, Any]]:
+    rng = random.Random(ctx.args.seed)
+    return [{ attr: random_value(rng, type_, ctx.args.value_size) for attr, type_ in cls.CODEC.fields } for _ in range(count)] # type: ignore
+
+@benchmark("node_create")
+def bench_node_create(ctx: BenchContext) -> Dict[str, Any]:
+    count = max(1, ctx.args.instances // 10)
+    cls, create_args = _create_world(ctx, "create_world")
+    def _run():
+        for _ in range(count):
+            cls.create(create_args)
+    return { 'times': measure(ctx.args.repeats, _run), 'ops': count }
+
+@benchmark("node_create_populated")
+def bench_node_create_populated(ctx: BenchContext) -> Dict[str, Any]:
+    # create followed by a setter per parameter, batched into one write per node
+    count = max(1, ctx.args.instances // 10)
+    cls, create_args = _create_world(ctx, "create_populated_world")
+    rows = _create_rows(ctx, cls, count)
+    def _run():
+        for row in rows:
+            node = cls.create(create_args)
+            with node.batch():
+                for attr, value in row.items():
+                    node._save(attr, value)
+    return { 'times': measure(ctx.args.repeats, _run), 'ops': count }
+
+@benchmark("node_create_many")
+def bench_node_create_many(ctx: BenchContext) -> Dict[str, Any]:
+    # the same rows as node_create_populated in one create_many call
+    count = max(1, ctx.args.instances // 10)
+    cls, create_args = _create_world(ctx, "create_many_world")
+    rows = _create_rows(ctx, cls, count)
+    return { 'times': measure(ctx.args.repeats, lambda: cls.create_many(create_args, rows)), 'ops': count }
+
+def _codec_samples(ctx: BenchContext) -> List[Dict[str, Any]]:
+    # node data as generators see it, read through the world's backend
+    storage = ctx.storage(ctx.world_dirpath)
+    return [storage.get(path)[0] for path in ctx.instance_paths()] # type: ignore
+
+@benchmark("encode_json_generic")
+def bench_encode_json_generic(ctx: BenchContext) -> Dict[str, Any]:
+    # the baseline the codec benchmarks compare against, what FileStorage writes for the json node_encoding
+    samples = _codec_samples(ctx)
+    def _run():
+        for data in samples:
+            json.dumps(data).encode()
+    return { 'times': measure(ctx.args.repeats, _run), 'ops': len(samples), 'bytes': sum(len(json.dumps(d).encode()) for d in samples) }
+
+@benchmark("encode_binary_codec")
+def bench_encode_binary_codec(ctx: BenchContext) -> Dict[str, Any]:
+    samples, codec = _codec_samples(ctx), ctx.classes[ctx.class_name].CODEC
+    def _run():
+        for data in samples:
+            codec.encode_binary(data) # type: ignore
+    return { 'times': measure(ctx.args.repeats, _run), 'ops': len(samples), 'bytes': sum(len(codec.encode_binary(d)) for d in samples) } # type: ignore
+
+@benchmark("decode_json_generic")
+def bench_decode_json_generic(ctx: BenchContext) -> Dict[str, Any]:
+    encoded = [json.dumps(data).encode() for data in _codec_samples(ctx)]
+    def _run():
+        for raw in encoded:
+            json.loads(raw)
+    return { 'times': measure(ctx.args.repeats, _run), 'ops': len(encoded), 'bytes': sum(len(raw) for raw in encoded) }
+
+@benchmark("decode_binary_codec")
+def bench_decode_binary_codec(ctx: BenchContext) -> Dict[str, Any]:
+    codec = ctx.classes[ctx.class_name].CODEC
+    encoded = [codec.encode_binary(data) for data in _codec_samples(ctx)] # type: ignore
+    def _run():
+        for raw in encoded:
+            codec.decode_binary(raw) # type: ignore
+    return { 'times': measure(ctx.args.repeats, _run), 'ops': len(encoded), 'bytes': sum(len(raw) for raw in encoded) }
+
+def _cache_pattern(name: str, key_count: int, access_count: int, rng: random.Random) -> List[int]:
+    if name == "sequential":
+        return [i % key_count for i in range(access_count)]
+    if name == "uniform":
+        return [rng.randrange(key_count) for _ in range(access_count)]
+    if name == "zipf":
+        weights = [1 / (rank + 1) ** 1.1 for rank in range(key_count)]
+        return rng.choices(range(key_count), weights=weights, k=access_count)
+    if name == "hot_set":
+        # 90% of accesses go to 10% of the keys
+        hot = max(1, key_count // 10)
+        return [rng.randrange(hot) if rng.random() < 0.9 else rng.randrange(key_count) for _ in range(access_count)]
+    raise ValueError(f"Unknown cache access pattern '{name}'")
+
+CACHE_PATTERNS = ["sequential", "uniform", "zipf", "hot_set"]
+
+def _make_cache_bench(pattern: str, policy: CachePolicy) -> BenchFunction:
+    def _bench(ctx: BenchContext) -> Dict[str, Any]:
+        # in-memory only, the cache holds a quarter of the keys so every pattern has to evict
+        key_count = max(4, ctx.args.instances)
+        capacity = key_count // 4
+        accesses = _cache_pattern(pattern, key_count, key_count * 10, random.Random(ctx.args.seed))
+        keys = [f"node_{i}" for i in range(key_count)]
+        data = { 'value': "x" * ctx.args.value_size }
+        hit_rates = []
+        def _setup() -> NodeCache:
+            return NodeCache(capacity, policy=policy)
+        def _run(cache: NodeCache):
+            for i in accesses:
+                if cache.get(keys[i]) is None:
+                    cache.store(keys[i], data, ctx.args.value_size)
+            hit_rates.append(cache.stats()['hit_rate'])
+        return { 'times': measure(ctx.args.repeats, _run, _setup), 'ops': len(accesses), 'hit_rate': statistics.mean(hit_rates) }
+    return _bench
+
+for _pattern in CACHE_PATTERNS:
+    for _policy in CachePolicy:
+        benchmark(f"node_cache_{_pattern}_{_policy.value}")(_make_cache_bench(_pattern, _policy))
+
+@benchmark("end_to_end_throughput")
+def bench_end_to_end(ctx: BenchContext) -> Dict[str, Any]:
+    # one step per instance of the first struct, every step loads the node and writes one parameter
+    yields = []
+    def _run():
+        count = 0
+        def _on_update(_: float) -> None:
+            nonlocal count
+            count += 1
+        thread, _ = create_executor(-1, ctx.world, "bench_throughput", {}, ctx.new_cache(), _on_update)
+        if not thread:
+            raise RuntimeError("create_executor failed")
+        thread.start()
+        thread.join()
+        yields.append(count)
+    times = measure(ctx.args.repeats, _run)
+    return { 'times': times, 'ops': max(yields) }
+
+######################
+#      Runner        #
+######################
+
+def summarize(result: Dict[str, Any]) -> Dict[str, Any]:
+    times = result.pop('times')
+    median = statistics.median(times)
+    return {
+        'median_s': median, 'min_s': min(times), 'max_s': max(times),
+        'stdev_s': statistics.stdev(times) if len(times) > 1 else 0.0,
+        'repeats': len(times), 'ops': result['ops'],
+        'ops_per_sec': result['ops'] / median if median > 0 else 0.0,
+        **{ k: v for k, v in result.items() if k != 'ops' },
+    }
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True, cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Run the World Controller core benchmarks")
+    parser.add_argument("--structs", type=int, default=4, help="number of structs in the synthetic world")
+    parser.add_argument("--params", type=int, default=8, help="number of parameters per struct")
+    parser.add_argument("--instances", type=int, default=2000, help="number of instances per struct")
+    parser.add_argument("--value-size", type=int, default=64, help="length of generated string values")
+    parser.add_argument("--repeats", type=int, default=5, help="timed repeats per benchmark, the median is reported")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--storage", choices=STORAGE_MODES, default=STORAGE_MODE_FILES, help="storage backend of the synthetic world, run once per backend to compare them")
+    parser.add_argument("--encoding", choices=NODE_ENCODINGS, default=NODE_ENCODING_JSON, help="node_encoding of the synthetic world, only the files storage mode uses it")
+    parser.add_argument("--shard-depth", type=int, default=0, choices=range(MAX_SHARD_DEPTH + 1), help="shard_depth of every struct, only the files and journal storage modes use it")
+    parser.add_argument("--quick", action="store_true", help="small world and few repeats, for smoke testing")
+    parser.add_argument("--only", nargs="+", metavar="NAME", help=f"only run these benchmarks, any of {list(BENCHMARKS)}")
+    parser.add_argument("--output", help="write the results to this file instead of stdout")
+    args = parser.parse_args()
+    if args.quick:
+        args.structs, args.instances, args.repeats = 2, 200, 2
+    return args
+
+def main() -> int:
+    args = parse_args()
+    names = args.only or list(BENCHMARKS)
+    unknown = [n for n in names if n not in BENCHMARKS]
+    if unknown:
+        print(f"Unknown benchmarks {unknown}, expected any of {list(BENCHMARKS)}", file=sys.stderr)
+        return 2
+
+    tmp_dirpath = tempfile.mkdtemp(prefix="wc_bench_")
+    try:
+        build_start = time.perf_counter()
+        ctx = BenchContext(args, tmp_dirpath)
+        print(f"Built synthetic world in {time.perf_counter() - build_start:.2f}s", file=sys.stderr)
+        results = {}
+        for name in names:
+            results[name] = summarize(BENCHMARKS[name](ctx))
+            print(f"{name:40} {results[name]['median_s']*1000:10.3f}ms {results[name]['ops_per_sec']:14.1f} ops/s", file=sys.stderr)
+    finally:
+        shutil.rmtree(tmp_dirpath, ignore_errors=True)
+
+    report = {
+        'meta': {
+            'timestamp': datetime.datetime.now().isoformat(timespec="seconds"),
+            'commit': git_commit(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'config': { k: getattr(args, k) for k in ["structs", "params", "instances", "value_size", "repeats", "seed", "storage", "encoding", "shard_depth"] },
+        },
+        'results': results,
+    }
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text)
+    else:
+        print(text)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
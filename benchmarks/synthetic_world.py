@@ -0,0 +1,101 @@
+from typing import List, Dict, Type, Any
+import random
+import string
+import sys
+import os
+
+from core.components.world import World
+from core.components.struct import Struct
+from core.components.generator_info import GeneratorInfo
+from core.components.export_info import Parameter
+from core.components.node import Node, NodeCache
+from core.components.storage import open_storage
+from core.components.shards import write_shard_settings
+from core.components.executor import _load_usercode
+from core.utils import file_to_class_name
+from core.globals import STRUCT_DIRNAME, INSTANCES_DIRNAME, USERCODE_DIRNAME, USERCODE_SUBDIRS, USERCODE_TYPES_DIRNAME, STORAGE_MODE_FILES
+from core.globals import NODE_ENCODING_JSON
+
+# Builds worlds for the benchmarks through the same paths the GUI uses to create them:
+# World.empty_world, Struct.save and GeneratorInfo.create_file. Instances are created with Node.create.
+
+# touches every instance of the first struct once per step and rewrites its first parameter
+THROUGHPUT_GENERATOR = """
+from usercode.types.<file_name> import <class_name>
+
+def generate(create_args, <file_name>s):
+    count = len(<file_name>s)
+    for index, node in enumerate(<file_name>s):
+        node.load_all()
+        node.set_<param>(node.get_<param>())
+        yield (index + 1) / count
+    yield None
+""".lstrip()
+
+def struct_name(index: int) -> str:
+    return f"bench_struct_{index}"
+
+def param_name(index: int) -> str:
+    return f"param_{index}"
+
+def random_value(rng: random.Random, type_: type, value_size: int) -> Any:
+    if type_ is int:
+        return rng.randrange(1 << 31)
+    return "".join(rng.choices(string.ascii_letters, k=value_size))
+
+def build_world(dirpath: str, struct_count: int=4, param_count: int=8, instance_count: int=1000, value_size: int=32, seed: int=0, storage_mode: str=STORAGE_MODE_FILES, node_encoding: str=NODE_ENCODING_JSON, shard_depth: int=0) -> World:
+    # dirpath has to be missing or empty, like a world created from the GUI
+    if os.path.exists(dirpath) and os.listdir(dirpath):
+        raise ValueError(f"Synthetic worlds need an empty directory, {dirpath} is not empty")
+    if struct_count < 1 or param_count < 1:
+        raise ValueError(f"Synthetic worlds need at least one struct and one parameter, got {struct_count} structs and {param_count} parameters")
+    rng = random.Random(seed)
+    world = World.empty_world(dirpath)
+    world.storage_mode = storage_mode
+    world.node_encoding = node_encoding
+    os.makedirs(f"{dirpath}/{STRUCT_DIRNAME}", exist_ok=True)
+    for dirname in USERCODE_SUBDIRS:
+        os.makedirs(f"{dirpath}/{USERCODE_DIRNAME}/{dirname}")
+
+    # alternate str and int parameters, the only parameter types structs support
+    parameters = [Parameter(param_name(i), str if i % 2 == 0 else int) for i in range(param_count)]
+    world.structs = []
+    for s in range(struct_count):
+        struct = Struct.empty_object(world_dirpath=dirpath)
+        struct.name = struct_name(s)
+        struct.dirpath = f"{dirpath}/{STRUCT_DIRNAME}/{struct.name}"
+        struct.parameters = parameters
+        os.makedirs(f"{struct.dirpath}/{INSTANCES_DIRNAME}")
+        struct.save()
+        if shard_depth:
+            write_shard_settings(struct.dirpath, { "shard_depth": shard_depth })
+        world.structs.append(struct)
+        world.struct_paths.append(struct.dirpath)
+
+    generator = GeneratorInfo.empty_object()
+    generator.filename = "bench_throughput"
+    generator.input_struct_names = [struct_name(0)]
+    generator.create_file(dirpath)
+    with open(generator.get_filepath(dirpath), "w") as f:
+        f.write(THROUGHPUT_GENERATOR.replace("<file_name>", struct_name(0)).replace("<class_name>", file_to_class_name(struct_name(0))).replace("<param>", param_name(0)))
+    world.generators.append(generator)
+    world.save()
+
+    node_cache = NodeCache(max(1, instance_count))
+    node_cache.storage = open_storage(dirpath, storage_mode, world.journal_fsync_interval, node_encoding)
+    create_args = { 'world_dirpath': dirpath, 'global_cache': node_cache }
+    for cls in load_node_classes(dirpath, [s.name for s in world.structs]).values():
+        # what the executor does on prepare, the storage instance is shared so later caches keep the codecs
+        node_cache.storage.set_codec(f"{dirpath}/{STRUCT_DIRNAME}/{cls.NAME}", cls.CODEC) # type: ignore
+        for _ in range(instance_count):
+            node = cls.create(create_args)
+            with node.batch():
+                for p in parameters:
+                    node._save(p.name, random_value(rng, p.type_, value_size))
+    node_cache.storage.checkpoint()
+    return world
+
+def load_node_classes(dirpath: str, names: List[str]) -> Dict[str, Type[Node]]:
+    if not _load_usercode(dirpath):
+        raise RuntimeError(f"Failed to load the usercode of {dirpath}")
+    return { name: getattr(sys.modules[f"{USERCODE_DIRNAME}.{USERCODE_TYPES_DIRNAME}.{name}"], file_to_class_name(name)) for name in names }
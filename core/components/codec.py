@@ -0,0 +1,168 @@
+from typing import Dict, List, Tuple, Optional, Callable, Any, Set
+import threading
+import struct
+import json
+import zlib
+import os
+
+from core.components.export_info import type_to_int, int_to_type
+from core.logger import warning, error
+from core.globals import NODE_ENCODINGS, CODECS_FILENAME
+
+# Binary node encoding compiled from a struct's parameters. Generated type files build their codec with
+# compile_codec, FileStorage picks it up through set_codec when the world's node_encoding is binary:
+#   BINARY_MAGIC, u32 schema stamp, then per parameter in schema order a tag byte (0 unset, 1 set) and the value
+#   (int as i64, str as u32 length + utf-8), then u32 length + json of everything else.
+# Values that do not match their parameter's type are never dropped, they go to the trailing json.
+# json never starts with a NUL byte, so readers tell the two apart and worlds can hold both.
+
+BINARY_MAGIC = b"\x00\x01"
+HEADER = struct.Struct("<2sI")
+U32 = struct.Struct("<I")
+I64 = struct.Struct("<q")
+I64_MIN, I64_MAX = -(1 << 63), (1 << 63) - 1
+
+def _mismatch(name: str, attr: str, expected: type, value: Any, warned: Set[str]) -> None:
+    # once per attribute, a generator that sets the wrong type usually does it for every node
+    if attr not in warned:
+        warned.add(attr)
+        warning(f"{name}.{attr} is declared {expected.__name__} but got {type(value).__name__}, storing it as json")
+
+def schema_stamp(name: str, fields: List[Tuple[str, type]]) -> int:
+    return zlib.crc32(json.dumps([name, [(n, type_to_int[t]) for n, t in fields]]).encode())
+
+class NodeCodec:
+    name: str
+    fields: List[Tuple[str, type]]
+    stamp: int
+    source: str     # the generated functions, kept for debugging
+    encode_binary: Callable[[Dict], bytes]
+    decode_binary: Callable[[bytes], Dict]
+
+def _generate_source(fields: List[Tuple[str, type]]) -> str:
+    # straight-line code per parameter, no loops or lookups over the schema at run time
+    lines = ["def encode_binary(data):", "    extra = {}", "    parts = [HEADER_BYTES]"]
+    for attr, type_ in fields:
+        lines += [f"    v = data.get({attr!r})", "    if v is None:", "        parts.append(UNSET)"]
+        if type_ is int:
+            lines += [
+                f"    elif type(v) is int and I64_MIN <= v <= I64_MAX:",
+                f"        parts.append(SET + I64.pack(v))",
+            ]
+        else:
+            lines += [
+                f"    elif type(v) is str:",
+                f"        b = v.encode()",
+                f"        parts.append(SET + U32.pack(len(b)) + b)",
+            ]
+        lines += [
+            "    else:",
+            f"        if type(v) is not {type_.__name__}: _mismatch(NAME, {attr!r}, {type_.__name__}, v, WARNED)",
+            "        parts.append(UNSET)",
+            f"        extra[{attr!r}] = v",
+        ]
+    lines += [
+        "    unknown = data.keys() - FIELD_SET",
+        "    if unknown:",
+        "        extra.update((k, data[k]) for k in unknown)",
+        "    if extra:",
+        "        b = dumps(extra).encode()",
+        "        parts.append(U32.pack(len(b)) + b)",
+        "    else:",
+        "        parts.append(EMPTY)",
+        "    return b''.join(parts)",
+        "",
+        "def decode_binary(buf):",
+        "    data = {}",
+        f"    pos = {HEADER.size}",
+    ]
+    for attr, type_ in fields:
+        lines += ["    if buf[pos]:"]
+        if type_ is int:
+            lines += [f"        data[{attr!r}] = I64.unpack_from(buf, pos + 1)[0]", "        pos += 9"]
+        else:
+            lines += [
+                "        n = U32.unpack_from(buf, pos + 1)[0]",
+                f"        data[{attr!r}] = buf[pos + 5:pos + 5 + n].decode()",
+                "        pos += 5 + n",
+            ]
+        lines += ["    else:", "        pos += 1"]
+    lines += [
+        "    n = U32.unpack_from(buf, pos)[0]",
+        "    if n:",
+        "        data.update(loads(buf[pos + 4:pos + 4 + n]))",
+        "    return data",
+    ]
+    return "\n".join(lines) + "\n"
+
+compiled_codecs: Dict[int, NodeCodec] = {}      # schema stamp -> codec, every schema seen by this process
+compiled_codecs_lock = threading.Lock()
+
+def compile_codec(name: str, fields: List[Tuple[str, type]]) -> NodeCodec:
+    for attr, type_ in fields:
+        if type_ not in (str, int) or not attr.isidentifier():
+            raise ValueError(error(f"Can not compile a codec for {name}.{attr} of type {type_.__name__}, parameters must be str or int"))
+    stamp = schema_stamp(name, fields)
+    with compiled_codecs_lock:
+        if stamp in compiled_codecs:
+            return compiled_codecs[stamp]
+        codec = NodeCodec()
+        codec.name = name
+        codec.fields = list(fields)
+        codec.stamp = stamp
+        codec.source = _generate_source(fields)
+        namespace: Dict[str, Any] = {
+            'NAME': name, 'WARNED': set(), 'FIELD_SET': frozenset(a for a, _ in fields),
+            'HEADER_BYTES': HEADER.pack(BINARY_MAGIC, stamp), 'UNSET': b"\x00", 'SET': b"\x01", 'EMPTY': U32.pack(0),
+            'U32': U32, 'I64': I64, 'I64_MIN': I64_MIN, 'I64_MAX': I64_MAX,
+            'dumps': json.dumps, 'loads': json.loads, '_mismatch': _mismatch,
+        }
+        exec(compile(codec.source, f"<codec {name}>", "exec"), namespace)
+        codec.encode_binary = namespace['encode_binary']
+        codec.decode_binary = namespace['decode_binary']
+        compiled_codecs[stamp] = codec
+        return codec
+
+def codecs_filepath(struct_dirpath: str) -> str:
+    return f"{struct_dirpath}/{CODECS_FILENAME}"
+
+def remember_codec(struct_dirpath: str, codec: NodeCodec) -> None:
+    # every schema that ever wrote binary nodes is kept, so they still decode after the struct changes
+    filepath = codecs_filepath(struct_dirpath)
+    schemas: Dict[str, Any] = {}
+    if os.path.exists(filepath):
+        with open(filepath) as f:
+            schemas = json.load(f)
+    if str(codec.stamp) in schemas:
+        return
+    schemas[str(codec.stamp)] = { 'name': codec.name, 'fields': [(n, type_to_int[t]) for n, t in codec.fields] }
+    tmp_filepath = f"{filepath}.{os.getpid()}.tmp"
+    with open(tmp_filepath, "w") as f:
+        json.dump(schemas, f)
+    os.replace(tmp_filepath, filepath)
+
+def find_codec(struct_dirpath: str, stamp: int) -> Optional[NodeCodec]:
+    codec = compiled_codecs.get(stamp)
+    if codec is not None:
+        return codec
+    filepath = codecs_filepath(struct_dirpath)
+    if not os.path.exists(filepath):
+        return None
+    with open(filepath) as f:
+        schema = json.load(f).get(str(stamp))
+    if schema is None:
+        return None
+    return compile_codec(schema['name'], [(n, int_to_type[t]) for n, t in schema['fields']])
+
+def decode_node(raw: bytes, struct_dirpath: str) -> Dict:
+    if raw[:1] != BINARY_MAGIC[:1]:
+        return json.loads(raw)
+    magic, stamp = HEADER.unpack_from(raw)
+    codec = find_codec(struct_dirpath, stamp) if magic == BINARY_MAGIC else None
+    if codec is None:
+        raise ValueError(error(f"Found binary node data with unknown schema {stamp} in {struct_dirpath}, missing from {CODECS_FILENAME}"))
+    return codec.decode_binary(raw)
+
+def check_encoding(encoding: str) -> None:
+    if encoding not in NODE_ENCODINGS:
+        raise ValueError(error(f"Unknown node encoding '{encoding}', expected one of {NODE_ENCODINGS}"))
@@ -0,0 +1,145 @@
+from typing import Dict, Any, Optional, Callable, Awaitable
+from collections import OrderedDict
+import threading
+import hashlib
+import json
+import os
+
+from core.logger import debug
+from core.globals import CACHE_DIRNAME, COMPLETIONS_DIRNAME, COMPLETION_CACHE_MAX_BYTES
+
+_NOT_CACHED = object()       # a cached completion may itself be None
+
+class CompletionCache:
+    # Content-addressed store for LLM completions, handed to generators as create_args['completion_cache'].
+    # Entries are keyed by a hash of (model, params, prompt) and live under <world>/cache/completions/,
+    # so they survive reloading the generator. The least recently used entries are evicted past max_bytes.
+    dirpath: str
+    max_bytes: int
+    __entries: 'OrderedDict[str, int]'     # key -> size on disk, least recently used first
+    __bytes: int
+    __lock: threading.RLock
+    hits: int
+    misses: int
+    evictions: int
+
+    def __init__(self, dirpath: str, max_bytes: int=COMPLETION_CACHE_MAX_BYTES):
+        self.dirpath = dirpath
+        self.max_bytes = max_bytes
+        self.__lock = threading.RLock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.__load_entries()
+
+    def __load_entries(self) -> None:
+        found = []
+        if os.path.isdir(self.dirpath):
+            for prefix in os.scandir(self.dirpath):
+                if not prefix.is_dir():
+                    continue
+                for entry in os.scandir(prefix.path):
+                    if entry.name.endswith(".json"):
+                        stat = entry.stat()
+                        found.append((stat.st_mtime_ns, entry.name[:-len(".json")], stat.st_size))
+        found.sort()
+        self.__entries = OrderedDict((key, size) for _, key, size in found)
+        self.__bytes = sum(self.__entries.values())
+
+    @staticmethod
+    def make_key(model: str, prompt: Any, params: Dict[str, Any]) -> str:
+        encoded = json.dumps({ 'model': model, 'params': params, 'prompt': prompt }, sort_keys=True, separators=(",", ":"))
+        return hashlib.sha256(encoded.encode()).hexdigest()
+
+    def __filepath(self, key: str) -> str:
+        return f"{self.dirpath}/{key[:2]}/{key}.json"
+
+    def get(self, model: str, prompt: Any, **params) -> Optional[Any]:
+        completion = self.__lookup(model, prompt, params)
+        return None if completion is _NOT_CACHED else completion
+
+    def __lookup(self, model: str, prompt: Any, params: Dict[str, Any]) -> Any:
+        key = self.make_key(model, prompt, params)
+        with self.__lock:
+            if key not in self.__entries:
+                self.misses += 1
+                return _NOT_CACHED
+            try:
+                with open(self.__filepath(key)) as f:
+                    completion = json.load(f)['completion']
+            except (OSError, ValueError, KeyError):
+                # removed or corrupted behind our back, treat it as a miss
+                self.__forget(key)
+                self.misses += 1
+                return _NOT_CACHED
+            self.hits += 1
+            self.__entries.move_to_end(key)
+            os.utime(self.__filepath(key))
+            return completion
+
+    def put(self, model: str, prompt: Any, completion: Any, **params) -> None:
+        key = self.make_key(model, prompt, params)
+        text = json.dumps({ 'model': model, 'params': params, 'prompt': prompt, 'completion': completion })
+        filepath = self.__filepath(key)
+        with self.__lock:
+            os.makedirs(os.path.dirname(filepath), exist_ok=True)
+            # other processes and caches opened on the same directory may write the same key
+            tmp_filepath = f"{filepath}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp_filepath, "w") as f:
+                f.write(text)
+            os.replace(tmp_filepath, filepath)
+            if key in self.__entries:
+                self.__bytes -= self.__entries.pop(key)
+            self.__entries[key] = len(text)
+            self.__bytes += len(text)
+            while self.__bytes > self.max_bytes and len(self.__entries) > 1:
+                oldest = next(iter(self.__entries))
+                self.__forget(oldest)
+                self.evictions += 1
+
+    def __forget(self, key: str) -> None:
+        self.__bytes -= self.__entries.pop(key, 0)
+        try:
+            os.remove(self.__filepath(key))
+        except FileNotFoundError:
+            pass
+
+    def complete(self, model: str, prompt: Any, compute: Callable[[], Any], **params) -> Any:
+        # compute is only called on a miss, and its result is stored before being returned
+        completion = self.__lookup(model, prompt, params)
+        if completion is _NOT_CACHED:
+            completion = compute()
+            self.put(model, prompt, completion, **params)
+        return completion
+
+    async def complete_async(self, model: str, prompt: Any, compute: Callable[[], Awaitable[Any]], **params) -> Any:
+        completion = self.__lookup(model, prompt, params)
+        if completion is _NOT_CACHED:
+            completion = await compute()
+            self.put(model, prompt, completion, **params)
+        return completion
+
+    def clear(self) -> None:
+        with self.__lock:
+            for key in list(self.__entries):
+                self.__forget(key)
+
+    def stats(self) -> Dict[str, Any]:
+        with self.__lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self.__entries), 'bytes': self.__bytes, 'max_bytes': self.max_bytes,
+                'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+            }
+
+completion_caches: Dict[str, CompletionCache] = {}
+completion_caches_lock = threading.Lock()
+
+def open_completion_cache(world_dirpath: str) -> CompletionCache:
+    key = os.path.abspath(world_dirpath)
+    with completion_caches_lock:
+        if key not in completion_caches:
+            completion_caches[key] = CompletionCache(f"{world_dirpath}/{CACHE_DIRNAME}/{COMPLETIONS_DIRNAME}")
+            debug(f"Opened completion cache for {world_dirpath}, {completion_caches[key].stats()['entries']} entries")
+        return completion_caches[key]
@@ -1,106 +1,300 @@
-from typing import Iterator, Optional, Dict, Callable, Type, Tuple
+from typing import Iterator, AsyncIterator, Optional, Dict, List, Callable, Type, Tuple, Any
 from types import ModuleType
-import importlib.util
 import threading
+import asyncio
+import inspect
+import time
 import sys
-import os
 
 from core.components.world import World
 from core.components.node import Node, NodeCache
+from core.components.node_collection import NodeCollection
+from core.components.storage import StorageBackend, open_storage
+from core.components.index import persist_indexes
+from core.components.metrics import RunMetrics
+from core.components.profiler import RunProfiler
+from core.components.usercode_loader import get_usercode_loader, load_module
+from core.components.completion_cache import open_completion_cache
+from core.components.llm_client import open_llm_client
 from core.utils import file_to_class_name
-from core.logger import critical
+from core.logger import error, critical
 from core.globals import (
-    STRUCT_DIRNAME, INSTANCES_DIRNAME,
-    USERCODE_DIRNAME, USERCODE_GENERATORS_DIRNAME, USERCODE_TYPES_DIRNAME, USERCODE_COMMON_DIRNAME,
+    STRUCT_DIRNAME, USERCODE_DIRNAME, USERCODE_GENERATORS_DIRNAME, USERCODE_TYPES_DIRNAME,
 )
 
-def _executor_thread(generator_call: Iterator[Optional[float]], max_count: int, exit_event: threading.Event, on_update: Optional[Callable[[float], None]], on_end: Optional[Callable[[], None]]):
-    for index, value in enumerate(generator_call):
-        if exit_event.is_set() or not value:
-            break
+def _begin_run(node_cache: NodeCache, metrics: Optional[RunMetrics]=None) -> None:
+    # node setters are written back once per step instead of once per attribute
+    node_cache.write_back = True
+    if metrics:
+        metrics.start(node_cache)
 
-        if on_update:
-            on_update(value)
+def _end_run(node_cache: NodeCache, persist: bool=True, metrics: Optional[RunMetrics]=None) -> None:
+    node_cache.flush()
+    node_cache.write_back = False
+    if metrics:
+        metrics.finish()
+    if persist:
+        persist_indexes()
+    node_cache.storage.checkpoint()
+
+def _run_generator(
+    generator_call: Iterator[Optional[float]], max_count: int, node_cache: NodeCache, exit_event: Any,
+    on_update: Optional[Callable[[float], None]], metrics: Optional[RunMetrics]=None, profiler: Optional[RunProfiler]=None
+) -> None:
+    if profiler:
+        profiler.attach()
+    try:
+        step_start = time.perf_counter()
+        for index, value in enumerate(generator_call):
+            node_cache.flush()
+            if metrics:
+                metrics.step(time.perf_counter() - step_start)
+            if exit_event.is_set() or not value:
+                break
+
+            if on_update:
+                on_update(value)
+
+            if max_count > 0 and index + 1 >= max_count:
+                break
+            if profiler:
+                profiler.mark_step(index + 1)
+            step_start = time.perf_counter()
+    finally:
+        if profiler:
+            profiler.detach()
+
+def _executor_thread(
+    generator_call: Iterator[Optional[float]], max_count: int, node_cache: NodeCache, exit_event: threading.Event,
+    on_update: Optional[Callable[[float], None]], on_end: Optional[Callable[[], None]],
+    metrics: Optional[RunMetrics]=None, profiler: Optional[RunProfiler]=None
+):
+    _begin_run(node_cache, metrics)
+    try:
+        _run_generator(generator_call, max_count, node_cache, exit_event, on_update, metrics, profiler)
+    except Exception as ex:
+        error(f"Exception occured running generator -> {ex}")
+    finally:
+        _end_run(node_cache, metrics=metrics)
 
-        if max_count > 0 and index + 1 >= max_count:
-            break
-    
     if on_end:
         on_end()
 
-def _load_module(module_name, module_path) -> Optional[ModuleType]:
-    spec = importlib.util.spec_from_file_location(module_name, module_path)
-    if spec is None or spec.loader is None:
-        critical(f"Failed to load module, name={module_name}, path={module_path}, spec={spec}, loader={None if not spec else spec.loader}")
-        return None
-    module = importlib.util.module_from_spec(spec)
-    spec.loader.exec_module(module)
+class AsyncGeneratorRun:
+    # K copies of an async generator, each on its own shard of the inputs, driven by one event loop.
+    # Kept in the module cache like a sync generator so Start continues where the last run stopped.
+    loop: asyncio.AbstractEventLoop
+    generators: List[AsyncIterator[Optional[float]]]
+    finished: List[bool]
+    progress: List[float]
+
+    def __init__(self, loop: asyncio.AbstractEventLoop, generators: List[AsyncIterator[Optional[float]]]):
+        self.loop = loop
+        self.generators = generators
+        self.finished = [False] * len(generators)
+        self.progress = [0.0] * len(generators)
+
+    def total_progress(self) -> float:
+        return -1 if any(p == -1 for p in self.progress) else sum(self.progress) / len(self.progress)
+
+async def _drive_async(
+    run: AsyncGeneratorRun, max_count: int, node_cache: NodeCache, exit_event: threading.Event,
+    on_update: Optional[Callable[[float], None]], metrics: Optional[RunMetrics]=None, profiler: Optional[RunProfiler]=None
+) -> None:
+    # every copy stops at its next yield once exit_event is set, same as the sync executor
+    # copies interleave on one thread, so profiled steps are numbered by yields across all copies
+    # max_count is shared by all copies: a copy only starts a step while completed and in-flight steps are below it,
+    # and a step that ends its copy does not count, like the last yield of a sync generator
+    total_steps = 0
+    completed = 0
+    in_flight = 0
+    budget = asyncio.Condition()
+
+    async def _end_step(counted: bool) -> None:
+        nonlocal completed, in_flight
+        in_flight -= 1
+        if counted:
+            completed += 1
+        async with budget:
+            budget.notify_all()
 
-    return module
+    async def _step_copy(index: int, generator: AsyncIterator[Optional[float]]) -> None:
+        nonlocal total_steps, in_flight
+        while not run.finished[index] and not exit_event.is_set():
+            if max_count > 0:
+                async with budget:
+                    # a step still in flight may end its copy and leave room for another one
+                    await budget.wait_for(lambda: completed + in_flight < max_count or in_flight == 0)
+                if completed + in_flight >= max_count:
+                    break
+            in_flight += 1
+            counted = False
+            try:
+                step_start = time.perf_counter()
+                try:
+                    value = await generator.__anext__()
+                except StopAsyncIteration:
+                    run.finished[index] = True
+                    break
+                node_cache.flush()
+                if metrics:
+                    metrics.step(time.perf_counter() - step_start)
+                if profiler:
+                    total_steps += 1
+                    profiler.mark_step(total_steps)
+                if exit_event.is_set():
+                    break
+                if not value:
+                    run.finished[index] = True
+                    break
+
+                counted = True
+                run.progress[index] = value
+                if on_update:
+                    on_update(run.total_progress())
+            finally:
+                await _end_step(counted)
+
+    if profiler:
+        profiler.attach()
+    try:
+        await asyncio.gather(*[_step_copy(i, g) for i, g in enumerate(run.generators) if not run.finished[i]])
+    finally:
+        if profiler:
+            profiler.detach()
+
+def _async_executor_thread(
+    run: AsyncGeneratorRun, max_count: int, node_cache: NodeCache, exit_event: threading.Event,
+    on_update: Optional[Callable[[float], None]], on_end: Optional[Callable[[], None]],
+    metrics: Optional[RunMetrics]=None, profiler: Optional[RunProfiler]=None
+):
+    _begin_run(node_cache, metrics)
+    try:
+        run.loop.run_until_complete(_drive_async(run, max_count, node_cache, exit_event, on_update, metrics, profiler))
+    except Exception as ex:
+        error(f"Exception occured running async generator -> {ex}")
+    finally:
+        _end_run(node_cache, metrics=metrics)
+
+    if on_end:
+        on_end()
 
 def _load_usercode(world_dirpath: str) -> bool:
-    for dirname in [USERCODE_TYPES_DIRNAME, USERCODE_COMMON_DIRNAME]:
-        dirpath = f"{world_dirpath}/{USERCODE_DIRNAME}/{dirname}"
-        for py_file in os.listdir(dirpath):
-            if not py_file.endswith(".py"):
-                continue
-            module_name = os.path.splitext(py_file)[0]
-            module = _load_module(module_name, f"{dirpath}/{py_file}")
-            if not module:
-                return False
-            sys.modules[f"{USERCODE_DIRNAME}.{dirname}.{module_name}"] = module
-    return True
+    # only modules that changed since the last run (and the modules importing them) are executed again
+    return get_usercode_loader(world_dirpath).load() is not None
+
+def _attach_storage(world: World, node_cache: NodeCache) -> None:
+    # route node reads and writes through the world's storage backend
+    storage = open_storage(world.dirpath, world.storage_mode, world.journal_fsync_interval, world.node_encoding)
+    if node_cache.storage is not storage:
+        # buffered writes belong to the previous backend, cached nodes stay valid as long as the layout is the same
+        node_cache.flush()
+        if node_cache.storage.mode != storage.mode:
+            node_cache.clear()
+        node_cache.storage = storage
+
+def _attach_codecs(world: World, storage: StorageBackend) -> None:
+    # every struct's codec, not just the generator's inputs, generators may create nodes of any struct
+    for struct in world.structs:
+        module = sys.modules.get(f"{USERCODE_DIRNAME}.{USERCODE_TYPES_DIRNAME}.{struct.name}")
+        cls = getattr(module, file_to_class_name(struct.name), None) if module else None
+        if cls is not None and cls.CODEC is not None:
+            storage.set_codec(f"{world.dirpath}/{STRUCT_DIRNAME}/{struct.name}", cls.CODEC)
+
+def prepare_generator(world: World, generator_name: str, node_cache: NodeCache) -> Optional[Tuple[ModuleType, Dict[str, NodeCollection], Dict[str, Any]]]:
+    _attach_storage(world, node_cache)
+
+    # structs loaded lazily still need their type files checked before the usercode is loaded
+    if not world.load_remaining_structs():
+        return None
 
-def create_executor(
-    execute_count: int, world: World, generator_name: str, module_cache: Dict[str, Iterator[Optional[float]]],
-    node_cache: NodeCache, on_update: Optional[Callable[[float], None]]=None, on_end: Optional[Callable[[], None]]=None
-) -> Tuple[Optional[threading.Thread], Optional[threading.Event]]:
     # load the usercode (types and common subdirs)
     ok = _load_usercode(world.dirpath)
     if not ok:
+        return None
+    _attach_codecs(world, node_cache.storage)
+
+    gen_filepath = f"{world.dirpath}/{USERCODE_DIRNAME}/{USERCODE_GENERATORS_DIRNAME}/{generator_name}.py"
+    gen_module = load_module(generator_name, gen_filepath)
+    if not gen_module:
+        return None
+
+    # get the GeneratorInfo for the currently selected generator function
+    generator_infos = [i for i in world.generators if i.filename == generator_name]
+    if len(generator_infos) != 1:
+        critical(f"Found {len(generator_infos)} GeneratorInfo objects with name {generator_name}, expected 1")
+        return None
+    generator_info = generator_infos[0]
+
+    # create the node arguments for the generator function
+    node_args: Dict[str, NodeCollection] = { }
+    for name in generator_info.input_struct_names:
+        # grab the module
+        module_name = f"{USERCODE_DIRNAME}.{USERCODE_TYPES_DIRNAME}.{name}"
+        if module_name not in sys.modules:
+            critical(f"Failed to find module in sys.modules, searched for {module_name}")
+            return None
+        
+        # grab the class
+        module = sys.modules[module_name]
+        class_name = file_to_class_name(name)
+        if not hasattr(module, class_name):
+            critical(f"Failed to find class '{class_name}' in module '{module_name}'")
+            return None
+        cls: Type[Node] = getattr(module, class_name)
+
+        # add to the node args a lazy collection over the struct's instances
+        node_args[f"{name}s"] = NodeCollection(cls, f"{world.dirpath}/{STRUCT_DIRNAME}/{name}", node_cache)
+
+    completion_cache = open_completion_cache(world.dirpath)
+    create_args = {
+        'world_dirpath': world.dirpath, 'global_cache': node_cache, 'storage': node_cache.storage,
+        'completion_cache': completion_cache,
+        'llm_client': open_llm_client(world.dirpath, world.llm, completion_cache),
+    }
+    return gen_module, node_args, create_args
+
+def create_executor(
+    execute_count: int, world: World, generator_name: str, module_cache: Dict[str, Any],
+    node_cache: NodeCache, on_update: Optional[Callable[[float], None]]=None, on_end: Optional[Callable[[], None]]=None,
+    concurrency: int=1, metrics: Optional[RunMetrics]=None, profiler: Optional[RunProfiler]=None
+) -> Tuple[Optional[threading.Thread], Optional[threading.Event]]:
+    # metrics, when given, is filled in while the run goes and can be read live with metrics.snapshot()
+    # profiler, when given, profiles the generator steps, call profiler.save() once the thread is done
+    # concurrency only applies to 'async def generate' generators: that many copies run at once, each on
+    # its own shard of the inputs, and create_args['semaphore'] limits tasks spawned by the generators
+    if concurrency < 1:
+        error(f"Concurrency must be >= 1, got {concurrency}")
         return None, None
     if generator_name not in module_cache:
         # module is not in cache so we need to load it
-        gen_filepath = f"{world.dirpath}/{USERCODE_DIRNAME}/{USERCODE_GENERATORS_DIRNAME}/{generator_name}.py"
-        gen_module = _load_module(generator_name, gen_filepath)
-        if not gen_module:
-            return None, None
-
-        # get the GeneratorInfo for the currently selected generator function
-        generator_infos = [i for i in world.generators if i.filename == generator_name]
-        if len(generator_infos) != 1:
-            critical(f"Found {len(generator_infos)} GeneratorInfo objects with name {generator_name}, expected 1")
+        prepared = prepare_generator(world, generator_name, node_cache)
+        if not prepared:
             return None, None
-        generator_info = generator_infos[0]
-
-        # create the node arguments for the generator function
-        node_args = { }
-        for name in generator_info.input_struct_names:
-            # grab the module
-            module_name = f"{USERCODE_DIRNAME}.{USERCODE_TYPES_DIRNAME}.{name}"
-            if module_name not in sys.modules:
-                critical(f"Failed to find module in sys.modules, searched for {module_name}")
-                return None, None
-            
-            # grab the class
-            module = sys.modules[module_name]
-            class_name = file_to_class_name(name)
-            if not hasattr(module, class_name):
-                critical(f"Failed to find class '{class_name}' in module '{module_name}'")
-                return None, None
-            cls: Type[Node] = getattr(module, class_name)
-
-            # add to the node args a Node instance for each file in the instances folder
-            instance_dirpath = f"{world.dirpath}/{STRUCT_DIRNAME}/{name}/{INSTANCES_DIRNAME}"
-            node_args[f"{name}s"] = [cls(f"{instance_dirpath}/{f}", node_cache) for f in os.listdir(instance_dirpath)] if os.path.isdir(instance_dirpath) else []
+        gen_module, node_args, create_args = prepared
 
         # create the generator function and store it in the cache
-        create_args = { 'world_dirpath': world.dirpath, 'global_cache': node_cache }
-        module_cache[generator_name] = gen_module.generate(create_args, **node_args) # type: ignore
+        if inspect.isasyncgenfunction(gen_module.generate):
+            loop = asyncio.new_event_loop()
+            create_args['concurrency'] = concurrency
+            create_args['semaphore'] = asyncio.Semaphore(concurrency)
+            copies = [
+                gen_module.generate({ **create_args, 'shard': (i, concurrency) }, **{ k: v.shard(i, concurrency) for k, v in node_args.items() })
+                for i in range(concurrency)
+            ] if concurrency > 1 else [gen_module.generate(create_args, **node_args)]
+            module_cache[generator_name] = AsyncGeneratorRun(loop, copies)
+        else:
+            module_cache[generator_name] = gen_module.generate(create_args, **node_args) # type: ignore
+    else:
+        # the cached generator keeps its collections, but usercode types and the storage backend still need refreshing
+        _attach_storage(world, node_cache)
+        if not world.load_remaining_structs() or not _load_usercode(world.dirpath):
+            return None, None
 
     # create a thread to run the executor and start it
     generator_call = module_cache[generator_name]
     exit_event = threading.Event()
-    execute_thread = threading.Thread(target=_executor_thread, args=(generator_call, execute_count, exit_event, on_update, on_end))
+    target = _async_executor_thread if isinstance(generator_call, AsyncGeneratorRun) else _executor_thread
+    execute_thread = threading.Thread(target=target, args=(generator_call, execute_count, node_cache, exit_event, on_update, on_end, metrics, profiler))
 
     return execute_thread, exit_event
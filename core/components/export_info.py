@@ -1,24 +1,33 @@
-from typing import Optional, Type, Tuple, Any, Dict, List, Callable
+from typing import Optional, Type, Any, Dict, List, Callable
 
+from core.components.index import INDEX_KINDS
 from core.logger import error
 
+INDEX_OPTIONS = [None, *INDEX_KINDS]
+
 class Parameter:
     TO_DICT: bool = True
     name:  str
     type_: type
-    def __init__(self, name: str, type_: type):
+    index: Optional[str]    # None, "hash" or "sorted", see core.components.index
+    def __init__(self, name: str, type_: type, index: Optional[str]=None):
         self.name  = name
         self.type_ = type_
+        self.index = index
     def to_dict(self):
-        return { 'name': self.name, 'type': type_to_int[self.type_] }
+        data = { 'name': self.name, 'type': type_to_int[self.type_] }
+        if self.index:
+            data['index'] = self.index
+        return data
     @staticmethod
     def from_dict(dict: Dict) -> Optional['Parameter']:
         if 'name' not in dict:             error(f"did not find key 'name' in dictionary when loading Parameters"); return None
         if type(dict['name']) is not str:  error(f"'name' value was of type {type(dict['name'])} when trying to load Parameters, expected string"); return None
         if 'type' not in dict:             error(f"did not find key 'name' in dictionary when loading Parameters"); return None
         if type(dict['type']) is not int:  error(f"'type' value was of type {type(dict['type'])} when trying to load Parameters, expected int"); return None
+        if dict.get('index') not in INDEX_OPTIONS: error(f"'index' value was {dict['index']} when trying to load Parameters, expected one of {INDEX_OPTIONS}"); return None
 
-        return Parameter(dict['name'], int_to_type[dict['type']])
+        return Parameter(dict['name'], int_to_type[dict['type']], dict.get('index'))
 
 class DirPath: pass
 class FilePath: pass
@@ -1,5 +1,3 @@
-import re
-
 from core.components.formable import Formable
 from core.components.export_info import ExportInfo, dictize
 from core.logger import error
@@ -11,6 +9,7 @@ from typing import List, Dict
 generator_template = """
 from typing import List, Iterator, Optional
 
+from core.components.node_collection import NodeCollection
 <imports>
 
 def generate(create_args<params>) -> Iterator[Optional[float]]:
@@ -19,6 +18,13 @@ def generate(create_args<params>) -> Iterator[Optional[float]]:
     # When it makes sense, yield a float between 0 and 1 to indicate the percent progress of your generator
     # If a percentage does not make sense, yield -1
     # When your generator is complete with no more work to do, yield None
+    # Input structs are passed as lazy NodeCollections: len(), iteration, indexing, slicing and page() work
+    # without loading every instance, and nodes created while the generator runs are picked up at the end
+    # generate can also be an 'async def' generator, the executor then runs create_args['concurrency'] copies of it
+    # at once, each on its own shard of the inputs, and create_args['semaphore'] can bound any tasks it spawns
+    # Wrap LLM calls in create_args['completion_cache'].complete(model, prompt, lambda: <call>, **params) so
+    # reruns with the same model, params and prompt are served from disk instead of the model
+    # If the world configures an LLM endpoint, create_args['llm_client'] is a shared pooled and rate limited client
 
     # we cannot determine a percentage completion so we yield -1
     import random
@@ -35,7 +41,7 @@ def generate(create_args<params>) -> Iterator[Optional[float]]:
     yield None
 """.lstrip()
 import_template = f"from {USERCODE_DIRNAME}.{USERCODE_TYPES_DIRNAME}.<file_name> import <class_name>"
-params_template = "<file_name>s: List[<class_name>]"
+params_template = "<file_name>s: NodeCollection[<class_name>]"
 
 class GeneratorInfo(Formable):
     TO_DICT: bool = True
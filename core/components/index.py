@@ -0,0 +1,225 @@
+from typing import Dict, List, Set, Tuple, Optional, Any, Iterable, Callable
+from bisect import bisect_left, bisect_right, insort
+import threading
+import json
+import os
+
+from core.logger import debug, error
+from core.globals import INDEXES_DIRNAME
+
+INDEX_HASH = "hash"         # equality lookups
+INDEX_SORTED = "sorted"     # equality and range lookups
+INDEX_KINDS = [INDEX_HASH, INDEX_SORTED]
+
+SORT_RANKS: Dict[type, int] = { bool: 0, int: 0, float: 0, str: 1 }
+
+def _sort_key(value: Any) -> Optional[Tuple[int, Any]]:
+    # None for values that can not be ordered against the rest of a sorted index
+    rank = SORT_RANKS.get(type(value))
+    return None if rank is None else (rank, value)
+
+def _hashable(value: Any) -> bool:
+    # node data is json, so lists and dicts are the only unhashable values
+    return not isinstance(value, (list, dict))
+
+class AttributeIndex:
+    # In-memory index over one attribute of one struct, persisted to structs/<name>/indexes/<attr>.json.
+    # Nodes whose value is None or that never set the attribute are kept in a separate missing set, and so are
+    # values the index can not hold: lists and dicts, and for sorted indexes anything but numbers and strings.
+    # Sorted indexes order numbers before strings, so a struct that mixes both still indexes every value.
+    # The file is marked unclean while there are unsaved changes, so a crash forces a rebuild on next load.
+    attr: str
+    kind: str
+    __filepath: str
+    __values: Dict[Any, Set[str]]           # hash indexes
+    __sorted: List[Tuple[int, Any, str]]    # sorted indexes, (type rank, value, node id)
+    __missing: Set[str]
+    __dirty: bool
+    __lock: threading.RLock
+
+    def __init__(self, struct_dirpath: str, attr: str, kind: str):
+        if kind not in INDEX_KINDS:
+            raise ValueError(f"Unknown index kind '{kind}', expected one of {INDEX_KINDS}")
+        self.attr = attr
+        self.kind = kind
+        self.__filepath = f"{struct_dirpath}/{INDEXES_DIRNAME}/{attr}.json"
+        self.__values = {}
+        self.__sorted = []
+        self.__missing = set()
+        self.__dirty = False
+        self.__lock = threading.RLock()
+
+    def load(self) -> bool:
+        if not os.path.exists(self.__filepath):
+            return False
+        try:
+            with open(self.__filepath) as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return False # replaced or cut short by another process, rebuilt like an unclean index
+        if data.get('kind') != self.kind or not data.get('clean'):
+            return False
+        with self.__lock:
+            self.__missing = set(data['missing'])
+            if self.kind == INDEX_HASH:
+                self.__values = { value: set(ids) for value, ids in data['values'] }
+            else:
+                self.__sorted = sorted((SORT_RANKS[type(value)], value, node_id) for value, node_id in data['values'])
+        return True
+
+    def build(self, entries: Iterable[Tuple[str, Any]]) -> None:
+        with self.__lock:
+            self.__values = {}
+            self.__sorted = []
+            self.__missing = set()
+            for node_id, value in entries:
+                self.__add(node_id, value)
+            if self.kind == INDEX_SORTED:
+                self.__sorted.sort()
+            self.__dirty = True
+            self.persist()
+        debug(f"Built {self.kind} index for '{self.attr}' at {self.__filepath}")
+
+    def persist(self) -> None:
+        with self.__lock:
+            if not self.__dirty:
+                return
+            if self.kind == INDEX_HASH:
+                values: List = [[value, sorted(ids)] for value, ids in self.__values.items()]
+            else:
+                values = [[value, node_id] for _, value, node_id in self.__sorted]
+            self.__write({ 'kind': self.kind, 'clean': True, 'missing': sorted(self.__missing), 'values': values })
+            self.__dirty = False
+
+    def __write(self, data: Dict) -> None:
+        os.makedirs(os.path.dirname(self.__filepath), exist_ok=True)
+        tmp_filepath = f"{self.__filepath}.{os.getpid()}.tmp"
+        with open(tmp_filepath, "w") as f:
+            json.dump(data, f)
+        os.replace(tmp_filepath, self.__filepath)
+
+    def __mark_dirty(self) -> None:
+        if not self.__dirty:
+            self.__dirty = True
+            # a small unclean marker is enough, the full index is written by persist()
+            self.__write({ 'kind': self.kind, 'clean': False })
+
+    def __add(self, node_id: str, value: Any) -> None:
+        if self.kind == INDEX_HASH:
+            if value is None or not _hashable(value):
+                self.__missing.add(node_id)
+            else:
+                self.__values.setdefault(value, set()).add(node_id)
+        else:
+            key = None if value is None else _sort_key(value)
+            if key is None:
+                self.__missing.add(node_id)
+            else:
+                insort(self.__sorted, key + (node_id,))
+
+    def __remove(self, node_id: str, value: Any) -> None:
+        if self.kind == INDEX_HASH:
+            if value is None or not _hashable(value):
+                self.__missing.discard(node_id)
+                return
+            ids = self.__values.get(value)
+            if ids is not None:
+                ids.discard(node_id)
+                if not ids:
+                    del self.__values[value]
+        else:
+            key = None if value is None else _sort_key(value)
+            if key is None:
+                self.__missing.discard(node_id)
+                return
+            entry = key + (node_id,)
+            position = bisect_left(self.__sorted, entry)
+            if position < len(self.__sorted) and self.__sorted[position] == entry:
+                del self.__sorted[position]
+
+    def add(self, node_id: str, value: Any) -> None:
+        with self.__lock:
+            self.__mark_dirty()
+            self.__add(node_id, value)
+
+    def add_many(self, entries: Iterable[Tuple[str, Any]]) -> None:
+        with self.__lock:
+            self.__mark_dirty()
+            for node_id, value in entries:
+                self.__add(node_id, value)
+
+    def remove(self, node_id: str, value: Any) -> None:
+        with self.__lock:
+            self.__mark_dirty()
+            self.__remove(node_id, value)
+
+    def update(self, node_id: str, old_value: Any, new_value: Any) -> None:
+        if old_value == new_value and type(old_value) is type(new_value):
+            return
+        with self.__lock:
+            self.__mark_dirty()
+            self.__remove(node_id, old_value)
+            self.__add(node_id, new_value)
+
+    def holds(self, value: Any) -> bool:
+        # whether equal(value) is exact, otherwise it returns the missing set and callers check the candidates
+        if value is None:
+            return False
+        return _hashable(value) if self.kind == INDEX_HASH else _sort_key(value) is not None
+
+    def equal(self, value: Any) -> List[str]:
+        with self.__lock:
+            if not self.holds(value):
+                return list(self.__missing)
+            if self.kind == INDEX_HASH:
+                return list(self.__values.get(value, ()))
+            key = _sort_key(value)
+            low = bisect_left(self.__sorted, key)
+            high = low
+            while high < len(self.__sorted) and self.__sorted[high][:2] == key:
+                high += 1
+            return [node_id for _, _, node_id in self.__sorted[low:high]]
+
+    def range(self, low: Any=None, high: Any=None) -> List[str]:
+        # inclusive on both ends, None leaves that end open
+        if self.kind != INDEX_SORTED:
+            raise ValueError(error(f"Range queries need a '{INDEX_SORTED}' index, '{self.attr}' has a '{self.kind}' index"))
+        low_key = None if low is None else _sort_key(low)
+        high_key = None if high is None else _sort_key(high)
+        if (low is not None and low_key is None) or (high is not None and high_key is None):
+            raise ValueError(error(f"Range queries on '{self.attr}' need numbers or strings as bounds, got {low!r} and {high!r}"))
+        with self.__lock:
+            start = 0 if low_key is None else bisect_left(self.__sorted, low_key)
+            if high_key is None:
+                end = len(self.__sorted)
+            else:
+                end = bisect_right(self.__sorted, high_key)
+                while end < len(self.__sorted) and self.__sorted[end][:2] == high_key:
+                    end += 1
+            return [node_id for _, _, node_id in self.__sorted[start:end]]
+
+indexes: Dict[Tuple[str, str], AttributeIndex] = {}
+indexes_lock = threading.Lock()
+
+def get_index(struct_dirpath: str, attr: str, kind: str, load_entries: Callable[[], Iterable[Tuple[str, Any]]]) -> AttributeIndex:
+    # load_entries is only called when there is no clean index on disk and it has to be rebuilt
+    key = (os.path.abspath(struct_dirpath), attr)
+    with indexes_lock:
+        index = indexes.get(key)
+        if index is None or index.kind != kind:
+            index = AttributeIndex(struct_dirpath, attr, kind)
+            if not index.load():
+                index.build(load_entries())
+            indexes[key] = index
+        return index
+
+def persist_indexes() -> None:
+    with indexes_lock:
+        for index in indexes.values():
+            index.persist()
+
+def forget_indexes() -> None:
+    # drops the in-memory indexes so they are reloaded (or rebuilt if unclean) on next use,
+    # needed after other processes changed nodes behind our back
+    with indexes_lock:
+        indexes.clear()
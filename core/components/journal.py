@@ -0,0 +1,197 @@
+from typing import Dict, List, Optional, BinaryIO
+import threading
+import json
+import time
+import os
+
+from core.logger import error, warning, debug
+from core.globals import JOURNAL_FILENAME
+
+class Journal:
+    # Node writes are appended to a single per-world file instead of rewriting one file per node.
+    # Records are buffered and written in groups by a background thread, and the compactor
+    # later folds the latest value of every node back into its json file under instances/.
+    __world_dirpath: str
+    __filepath: str
+    __old_filepath: str
+    __pending: Dict[str, Optional[str]]     # relative node path -> latest encoded data that is not compacted yet, None if deleted
+    __buffer: List[str]
+    __file: BinaryIO
+    __lock: threading.RLock
+    __compact_lock: threading.Lock
+    __wakeup: threading.Event
+    __closed: bool
+    __thread: threading.Thread
+
+    def __init__(self, world_dirpath: str, fsync_interval: float=1.0, commit_interval: float=0.05, compact_bytes: int=64*1024*1024):
+        self.__world_dirpath = world_dirpath
+        self.__filepath = f"{world_dirpath}/{JOURNAL_FILENAME}"
+        self.__old_filepath = f"{self.__filepath}.old"
+        self.fsync_interval = fsync_interval        # < 0 never fsyncs, 0 fsyncs on every group commit
+        self.commit_interval = commit_interval
+        self.compact_bytes = compact_bytes
+        self.__pending = {}
+        self.__buffer = []
+        self.__lock = threading.RLock()
+        self.__compact_lock = threading.Lock()
+        self.__wakeup = threading.Event()
+        self.__compact_requested = False
+        self.__closed = False
+        self.__last_fsync = time.monotonic()
+        self.__size = 0
+
+        # an .old file only survives if we crashed mid-compaction, it is older than the live journal
+        for filepath in [self.__old_filepath, self.__filepath]:
+            if os.path.exists(filepath):
+                self.__replay(filepath)
+        self.__file = open(self.__filepath, "ab")
+        self.__size = self.__file.tell()
+
+        self.__thread = threading.Thread(target=self.__run, daemon=True)
+        self.__thread.start()
+
+    def __replay(self, filepath: str) -> None:
+        good_size = 0       # end of the last complete record
+        with open(filepath, "rb+") as f:
+            for line in f:
+                if not line.endswith(b"\n"):
+                    # torn write at the tail of the journal, cut off so the next append starts a fresh line
+                    f.truncate(good_size)
+                    warning(f"Dropped a torn record of {len(line)} bytes at the end of {filepath}")
+                    break
+                good_size += len(line)
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    error(f"Skipping corrupt journal record in {filepath}")
+                    continue
+                self.__pending[record['p']] = None if record.get('x') else json.dumps(record['d'])
+        debug(f"Replayed journal {filepath}, {len(self.__pending)} nodes pending compaction")
+
+    def __relpath(self, path_on_disk: str) -> str:
+        return os.path.relpath(path_on_disk, self.__world_dirpath).replace(os.sep, "/")
+
+    def append(self, path_on_disk: str, data: Dict) -> int:
+        encoded = json.dumps(data)
+        relpath = self.__relpath(path_on_disk)
+        with self.__lock:
+            if self.__closed:
+                raise RuntimeError(error(f"Tried appending to closed journal {self.__filepath}"))
+            self.__pending[relpath] = encoded
+            self.__buffer.append(f'{{"p": {json.dumps(relpath)}, "d": {encoded}}}\n')
+        self.__wakeup.set()
+        return len(encoded)
+
+    def delete(self, path_on_disk: str) -> None:
+        relpath = self.__relpath(path_on_disk)
+        with self.__lock:
+            if self.__closed:
+                raise RuntimeError(error(f"Tried appending to closed journal {self.__filepath}"))
+            self.__pending[relpath] = None
+            self.__buffer.append(f'{{"p": {json.dumps(relpath)}, "x": true}}\n')
+        self.__wakeup.set()
+
+    def lookup(self, path_on_disk: str) -> Optional[Dict]:
+        encoded = self.lookup_encoded(path_on_disk)
+        return None if encoded is None else json.loads(encoded)
+
+    def lookup_encoded(self, path_on_disk: str) -> Optional[str]:
+        return self.__pending.get(self.__relpath(path_on_disk))
+
+    def contains(self, path_on_disk: str) -> bool:
+        return self.__pending.get(self.__relpath(path_on_disk)) is not None
+
+    def is_deleted(self, path_on_disk: str) -> bool:
+        relpath = self.__relpath(path_on_disk)
+        return relpath in self.__pending and self.__pending[relpath] is None
+
+    def pending_paths(self, prefix: str="") -> List[str]:
+        prefix = self.__relpath(prefix) if prefix else ""
+        with self.__lock:
+            return [f"{self.__world_dirpath}/{p}" for p, e in self.__pending.items() if e is not None and p.startswith(prefix)]
+
+    def commit(self, fsync: bool=False) -> None:
+        with self.__lock:
+            if self.__buffer:
+                chunk = "".join(self.__buffer).encode()
+                self.__buffer = []
+                self.__file.write(chunk)
+                self.__file.flush()
+                self.__size += len(chunk)
+            now = time.monotonic()
+            if fsync or (self.fsync_interval >= 0 and now - self.__last_fsync >= self.fsync_interval):
+                os.fsync(self.__file.fileno())
+                self.__last_fsync = now
+
+    def compact(self) -> int:
+        with self.__compact_lock:
+            # rotate the journal so writers can keep appending while the snapshot is folded in
+            with self.__lock:
+                self.commit(fsync=True)
+                if not self.__pending:
+                    return 0
+                self.__file.close()
+                os.replace(self.__filepath, self.__old_filepath)
+                self.__file = open(self.__filepath, "ab")
+                self.__size = 0
+                snapshot = dict(self.__pending)
+
+            for relpath, encoded in snapshot.items():
+                filepath = f"{self.__world_dirpath}/{relpath}"
+                if encoded is None:
+                    self.remove_file(filepath)
+                else:
+                    self.write_file(filepath, encoded)
+
+            with self.__lock:
+                for relpath, encoded in snapshot.items():
+                    if relpath in self.__pending and self.__pending[relpath] is encoded:
+                        del self.__pending[relpath]
+            os.remove(self.__old_filepath)
+            debug(f"Compacted {len(snapshot)} nodes from journal {self.__filepath}")
+            return len(snapshot)
+
+    # compaction goes through these, JournalStorage points them at FileStorage so packed nodes are handled
+    def write_file(self, filepath: str, encoded: str) -> None:
+        with open(filepath, "w") as f:
+            f.write(encoded)
+
+    def remove_file(self, filepath: str) -> None:
+        if os.path.exists(filepath):
+            os.remove(filepath)
+
+    def request_compaction(self) -> None:
+        self.__compact_requested = True
+        self.__wakeup.set()
+
+    def __run(self) -> None:
+        while not self.__closed:
+            if self.__wakeup.wait(max(self.fsync_interval, self.commit_interval)):
+                self.__wakeup.clear()
+                time.sleep(self.commit_interval) # let concurrent appends pile up into one group commit
+            try:
+                self.commit()
+                if self.__compact_requested or self.__size >= self.compact_bytes:
+                    self.__compact_requested = False
+                    self.compact()
+            except Exception as ex:
+                error(f"Exception occured in journal background thread -> {ex}")
+
+    def close(self) -> None:
+        if self.__closed:
+            return
+        self.__closed = True
+        self.__wakeup.set()
+        self.__thread.join()
+        self.compact()
+        with self.__lock:
+            self.__file.close()
+        open_journals.pop(os.path.abspath(self.__world_dirpath), None)
+
+open_journals: Dict[str, Journal] = {}
+
+def open_journal(world_dirpath: str, fsync_interval: float=1.0) -> Journal:
+    key = os.path.abspath(world_dirpath)
+    if key not in open_journals:
+        open_journals[key] = Journal(world_dirpath, fsync_interval)
+    return open_journals[key]
@@ -0,0 +1,289 @@
+from typing import Dict, List, Any, Optional, Tuple
+from concurrent.futures import Future
+from urllib.parse import urlsplit
+import http.client
+import threading
+import asyncio
+import random
+import queue
+import json
+import time
+import os
+
+from core.components.completion_cache import CompletionCache
+from core.logger import debug, warning, error
+
+# status codes worth retrying, everything else is returned to the generator as an error
+RETRY_STATUSES = {408, 409, 429, 500, 502, 503, 504}
+
+DEFAULT_LLM_SETTINGS: Dict[str, Any] = {
+    'base_url': "",                 # e.g. http://127.0.0.1:8765, empty leaves create_args['llm_client'] unset
+    'path': "/v1/completions",
+    'api_key_env': "",              # name of the environment variable holding the key, never the key itself
+    'model': "",
+    'max_connections': 8,
+    'requests_per_minute': 0,       # 0 disables that limit
+    'tokens_per_minute': 0,
+    'batch_size': 1,                # > 1 sends concurrent prompts with the same model and params as one request
+    'batch_wait': 0.01,             # seconds to wait for a batch to fill up
+    'max_retries': 4,
+    'backoff': 0.5,
+    'timeout': 60.0,
+    'use_cache': True,              # serve repeated (model, params, prompt) calls from the world's completion cache
+}
+
+class LLMError(Exception):
+    pass
+
+class TokenBucket:
+    # refills at rate per second up to capacity, acquire blocks until enough is available
+    rate: float
+    capacity: float
+    __level: float
+    __last: float
+    __lock: threading.Lock
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.__level = capacity
+        self.__last = time.monotonic()
+        self.__lock = threading.Lock()
+
+    def acquire(self, amount: float=1.0) -> float:
+        # returns the time spent waiting. Requests larger than the capacity wait for a full bucket and are still
+        # charged in full, the level goes negative and later requests wait until it refilled, so the rate holds
+        needed = min(amount, self.capacity)
+        waited = 0.0
+        while True:
+            with self.__lock:
+                now = time.monotonic()
+                self.__level = min(self.capacity, self.__level + (now - self.__last) * self.rate)
+                self.__last = now
+                if self.__level >= needed:
+                    self.__level -= amount
+                    return waited
+                delay = (needed - self.__level) / self.rate
+            time.sleep(delay)
+            waited += delay
+
+class ConnectionPool:
+    # keep-alive connections to a single host, at most max_connections are open at once
+    __idle: 'queue.LifoQueue[http.client.HTTPConnection]'
+    __slots: threading.Semaphore
+
+    def __init__(self, base_url: str, max_connections: int, timeout: float):
+        parts = urlsplit(base_url)
+        self.https = parts.scheme == "https"
+        self.host = parts.hostname or "127.0.0.1"
+        self.port = parts.port
+        self.base_path = parts.path.rstrip("/")
+        self.timeout = timeout
+        self.opened = 0
+        self.__idle = queue.LifoQueue()
+        self.__slots = threading.Semaphore(max_connections)
+
+    def __connect(self) -> http.client.HTTPConnection:
+        self.opened += 1
+        if self.https:
+            return http.client.HTTPSConnection(self.host, self.port, timeout=self.timeout)
+        return http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+
+    def request(self, path: str, body: bytes, headers: Dict[str, str]) -> Tuple[int, Dict[str, str], bytes]:
+        self.__slots.acquire()
+        try:
+            try:
+                connection = self.__idle.get_nowait()
+            except queue.Empty:
+                connection = self.__connect()
+            try:
+                connection.request("POST", self.base_path + path, body, headers)
+                response = connection.getresponse()
+                data = response.read()
+            except (http.client.HTTPException, OSError):
+                # the server may have dropped an idle connection, retry once on a fresh one
+                connection.close()
+                connection = self.__connect()
+                connection.request("POST", self.base_path + path, body, headers)
+                response = connection.getresponse()
+                data = response.read()
+            if response.will_close:
+                connection.close()
+            else:
+                self.__idle.put(connection)
+            return response.status, dict(response.getheaders()), data
+        finally:
+            self.__slots.release()
+
+    def close(self) -> None:
+        while True:
+            try:
+                self.__idle.get_nowait().close()
+            except queue.Empty:
+                return
+
+class LLMClient:
+    # Shared client for OpenAI style completion endpoints, handed to generators as create_args['llm_client'].
+    # One client exists per world, so every generator and worker thread shares its connections and rate limits.
+    settings: Dict[str, Any]
+    cache: Optional[CompletionCache]
+    __pool: ConnectionPool
+    __request_bucket: Optional[TokenBucket]
+    __token_bucket: Optional[TokenBucket]
+    __pending: 'queue.Queue[Tuple[str, Dict[str, Any], str, Future]]'
+    __batcher: Optional[threading.Thread]
+
+    def __init__(self, settings: Dict[str, Any], cache: Optional[CompletionCache]=None):
+        self.settings = { **DEFAULT_LLM_SETTINGS, **settings }
+        if not self.settings['base_url']:
+            raise ValueError(error("LLM client needs a base_url"))
+        self.cache = cache
+        self.__pool = ConnectionPool(self.settings['base_url'], self.settings['max_connections'], self.settings['timeout'])
+        rpm, tpm = self.settings['requests_per_minute'], self.settings['tokens_per_minute']
+        self.__request_bucket = TokenBucket(rpm / 60, max(1.0, rpm / 60)) if rpm > 0 else None
+        self.__token_bucket = TokenBucket(tpm / 60, max(1.0, tpm / 60)) if tpm > 0 else None
+        self.__pending = queue.Queue()
+        self.__batcher = None
+        self.__lock = threading.Lock()
+        self.requests = 0
+        self.prompts = 0
+        self.retries = 0
+        self.failures = 0
+        self.throttle_time = 0.0
+
+    def __headers(self) -> Dict[str, str]:
+        headers = { 'Content-Type': "application/json" }
+        key_env = self.settings['api_key_env']
+        if key_env and os.environ.get(key_env):
+            headers['Authorization'] = f"Bearer {os.environ[key_env]}"
+        return headers
+
+    @staticmethod
+    def estimate_tokens(prompts: List[str], params: Dict[str, Any]) -> int:
+        # about 4 characters per token, plus what the completions may use
+        return sum(len(p) // 4 + 1 for p in prompts) + params.get('max_tokens', 16) * len(prompts)
+
+    def __post(self, model: str, prompts: List[str], params: Dict[str, Any]) -> List[str]:
+        body = json.dumps({ **params, 'model': model, 'prompt': prompts if len(prompts) > 1 else prompts[0] }).encode()
+        throttle = 0.0
+        if self.__token_bucket:
+            throttle += self.__token_bucket.acquire(self.estimate_tokens(prompts, params))
+        attempt = 0
+        while True:
+            if self.__request_bucket:
+                throttle += self.__request_bucket.acquire()
+            retry_after: Optional[float] = None
+            try:
+                status, headers, data = self.__pool.request(self.settings['path'], body, self.__headers())
+            except (http.client.HTTPException, OSError) as ex:
+                status, headers, data = 0, {}, str(ex).encode()
+            with self.__lock:
+                self.requests += 1
+                self.throttle_time += throttle
+            throttle = 0.0
+            if status == 200:
+                choices = sorted(json.loads(data)['choices'], key=lambda c: c.get('index', 0))
+                return [c['text'] for c in choices]
+            if (status == 0 or status in RETRY_STATUSES) and attempt < self.settings['max_retries']:
+                if 'Retry-After' in headers:
+                    try:
+                        retry_after = float(headers['Retry-After'])
+                    except ValueError:
+                        pass
+                delay = retry_after if retry_after is not None else self.settings['backoff'] * (2 ** attempt) * (0.5 + random.random())
+                attempt += 1
+                with self.__lock:
+                    self.retries += 1
+                debug(f"LLM request failed with status {status}, retry {attempt} in {delay:.2f}s")
+                time.sleep(delay)
+                continue
+            with self.__lock:
+                self.failures += 1
+            raise LLMError(warning(f"LLM request failed with status {status} after {attempt} retries: {data[:200].decode(errors='replace')}"))
+
+    def __batch_loop(self) -> None:
+        # groups prompts that arrive within batch_wait of each other and share a model and params
+        while True:
+            first = self.__pending.get()
+            batch = [first]
+            deadline = time.monotonic() + self.settings['batch_wait']
+            while len(batch) < self.settings['batch_size']:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self.__pending.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            groups: Dict[str, List[Tuple[str, Dict[str, Any], str, Future]]] = {}
+            for item in batch:
+                groups.setdefault(json.dumps([item[0], item[1]], sort_keys=True), []).append(item)
+            for group in groups.values():
+                threading.Thread(target=self.__send_group, args=(group,), daemon=True).start()
+
+    def __send_group(self, group: List[Tuple[str, Dict[str, Any], str, Future]]) -> None:
+        model, params = group[0][0], group[0][1]
+        try:
+            texts = self.__post(model, [item[2] for item in group], params)
+            if len(texts) != len(group):
+                raise LLMError(error(f"LLM endpoint returned {len(texts)} choices for a batch of {len(group)} prompts"))
+        except Exception as ex:
+            for item in group:
+                item[3].set_exception(ex)
+            return
+        for item, text in zip(group, texts):
+            item[3].set_result(text)
+
+    def __complete_uncached(self, model: str, prompt: str, params: Dict[str, Any]) -> str:
+        with self.__lock:
+            self.prompts += 1
+        if self.settings['batch_size'] <= 1:
+            return self.__post(model, [prompt], params)[0]
+        with self.__lock:
+            if not self.__batcher:
+                self.__batcher = threading.Thread(target=self.__batch_loop, daemon=True)
+                self.__batcher.start()
+        future: Future = Future()
+        self.__pending.put((model, params, prompt, future))
+        return future.result()
+
+    def complete(self, prompt: str, model: Optional[str]=None, **params) -> str:
+        # blocking, safe to call from any number of threads at once, which is what lets batching kick in
+        model = model or self.settings['model']
+        if self.cache:
+            return self.cache.complete(model, prompt, lambda: self.__complete_uncached(model, prompt, params), **params)
+        return self.__complete_uncached(model, prompt, params)
+
+    async def complete_async(self, prompt: str, model: Optional[str]=None, **params) -> str:
+        # for async generators, concurrent awaits from the same event loop are batched together
+        return await asyncio.get_running_loop().run_in_executor(None, lambda: self.complete(prompt, model, **params))
+
+    def stats(self) -> Dict[str, Any]:
+        with self.__lock:
+            return {
+                'requests': self.requests, 'prompts': self.prompts, 'retries': self.retries, 'failures': self.failures,
+                'connections_opened': self.__pool.opened, 'throttle_time': self.throttle_time,
+            }
+
+    def close(self) -> None:
+        self.__pool.close()
+
+llm_clients: Dict[str, LLMClient] = {}
+llm_clients_lock = threading.Lock()
+
+def open_llm_client(world_dirpath: str, settings: Dict[str, Any], cache: Optional[CompletionCache]=None) -> Optional[LLMClient]:
+    # clients are kept per world and reused while the settings stay the same, so rate limits hold across runs
+    if not settings.get('base_url'):
+        return None
+    key = os.path.abspath(world_dirpath)
+    if not settings.get('use_cache', DEFAULT_LLM_SETTINGS['use_cache']):
+        cache = None
+    with llm_clients_lock:
+        client = llm_clients.get(key)
+        if client is None or client.settings != { **DEFAULT_LLM_SETTINGS, **settings } or client.cache is not cache:
+            if client:
+                client.close()
+            client = LLMClient(settings, cache)
+            llm_clients[key] = client
+            debug(f"Opened LLM client for {world_dirpath} -> {client.settings['base_url']}")
+        return client
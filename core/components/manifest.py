@@ -0,0 +1,231 @@
+from typing import Dict, List, Optional, Iterable, Iterator, BinaryIO
+from contextlib import contextmanager
+import threading
+import time
+import os
+
+try:
+    import fcntl
+except ImportError: # windows, where a world's manifests must only be written by one process
+    fcntl = None # type: ignore
+
+from core.components.storage import StorageBackend, FileStorage
+from core.logger import debug
+from core.globals import MANIFEST_FILENAME
+
+HEADER_MAGIC = b"WCMANIFEST1"
+HEADER_SIZE = len(HEADER_MAGIC) + 1 + 12 + 1 + 20 + 1 + 20 + 1
+
+class InstanceManifest:
+    # Per-struct record of instance ids in creation order.
+    # The file is a fixed width header (count, last modified stamp, storage change stamp) followed by
+    # "+<id>" / "-<id>" lines, so creates and deletes are appends plus an in-place header rewrite.
+    # The manifest is stale when the storage's change stamp (the instances directory mtime for files) no longer
+    # matches the one recorded after our own last change, and is then rebuilt.
+    # Every change to the manifest, and every create or delete of an instance file, happens under locked(),
+    # an flock on <manifest>.lock shared by all processes. Holding it from ensure_fresh() through the file change
+    # to add() or remove() means the change stamp recorded afterwards only covers our own change.
+    __struct_dirpath: str
+    __filepath: str
+    __ids: Optional[Dict[str, None]]    # loaded lazily, insertion ordered
+    __ids_list: Optional[List[str]]     # index snapshot of __ids for random access
+    __count: int
+    __modified: int
+    __change_stamp: int
+    __ops: int
+    __lock: threading.RLock
+    __lock_file: Optional[BinaryIO]
+    __lock_depth: int
+    storage: StorageBackend             # rebuilds list the instances through it, so nodes outside instances/ are found
+
+    def __init__(self, struct_dirpath: str):
+        self.__struct_dirpath = struct_dirpath
+        self.__filepath = f"{struct_dirpath}/{MANIFEST_FILENAME}"
+        self.__ids = None
+        self.__ids_list = None
+        self.__count = -1
+        self.__modified = 0
+        self.__change_stamp = 0
+        self.__ops = 0
+        self.__lock = threading.RLock()
+        self.__lock_file = None
+        self.__lock_depth = 0
+        self.storage = FileStorage()
+
+    @contextmanager
+    def locked(self) -> Iterator[None]:
+        # reentrant, only the outermost call takes and releases the file lock
+        with self.__lock:
+            if self.__lock_depth == 0 and fcntl is not None:
+                self.__lock_file = open(f"{self.__filepath}.lock", "ab")
+                fcntl.flock(self.__lock_file.fileno(), fcntl.LOCK_EX)
+            self.__lock_depth += 1
+            try:
+                yield
+            finally:
+                self.__lock_depth -= 1
+                if self.__lock_depth == 0 and self.__lock_file is not None:
+                    self.__lock_file.close() # closing releases the flock
+                    self.__lock_file = None
+
+    def __current_stamp(self) -> int:
+        return self.storage.change_stamp(self.__struct_dirpath)
+
+    def is_stale(self) -> bool:
+        with self.__lock:
+            stamp = self.__current_stamp()
+            if self.__count >= 0 and stamp == self.__change_stamp:
+                return False
+            # another process may have updated the manifest, so check what is on disk before rebuilding
+            try:
+                self.__read_header()
+            except (OSError, ValueError):
+                return True
+            return stamp != self.__change_stamp
+
+    def ensure_fresh(self) -> None:
+        with self.__lock:
+            if self.is_stale():
+                with self.locked():
+                    # another process may have rebuilt it while we waited for the lock
+                    if self.is_stale():
+                        self.rebuild()
+
+    def __read_header(self) -> None:
+        with open(self.__filepath, "rb") as f:
+            header = f.read(HEADER_SIZE)
+        magic, count, modified, change_stamp = header.split()
+        if magic != HEADER_MAGIC:
+            raise ValueError(f"Bad manifest header in {self.__filepath}")
+        if int(modified) != self.__modified:
+            self.__ids = None
+            self.__ids_list = None
+        self.__count = int(count)
+        self.__modified = int(modified)
+        self.__change_stamp = int(change_stamp)
+
+    def __header(self) -> bytes:
+        return HEADER_MAGIC + b" %012d %020d %020d\n" % (self.__count, self.__modified, self.__change_stamp)
+
+    def __load_ids(self) -> Dict[str, None]:
+        if self.__ids is None:
+            ids: Dict[str, None] = {}
+            ops = 0
+            with open(self.__filepath, "rb") as f:
+                f.seek(HEADER_SIZE)
+                for line in f:
+                    ops += 1
+                    node_id = line[1:].strip().decode()
+                    if line[:1] == b"+":
+                        ids[node_id] = None
+                    else:
+                        ids.pop(node_id, None)
+            self.__ids = ids
+            self.__ops = ops
+        return self.__ids
+
+    def count(self) -> int:
+        with self.__lock:
+            self.ensure_fresh()
+            return self.__count
+
+    def modified(self) -> int:
+        with self.__lock:
+            self.ensure_fresh()
+            return self.__modified
+
+    def ids(self) -> List[str]:
+        with self.__lock:
+            self.ensure_fresh()
+            return list(self.__load_ids())
+
+    def id_at(self, index: int) -> str:
+        # avoids copying the id list for every random access
+        with self.__lock:
+            self.ensure_fresh()
+            ids = self.__load_ids()
+            if self.__ids_list is None:
+                self.__ids_list = list(ids)
+            return self.__ids_list[index]
+
+    def __append(self, lines: bytes, delta: int) -> None:
+        # under locked(), count starts from the header on disk so other processes' appends are kept
+        self.__count += delta
+        self.__modified = max(self.__modified + 1, time.time_ns())
+        self.__change_stamp = self.__current_stamp()
+        self.__ids_list = None
+        with open(self.__filepath, "ab") as f:
+            f.write(lines)
+        with open(self.__filepath, "r+b") as f:
+            f.write(self.__header())
+
+    def add(self, node_ids: Iterable[str]) -> None:
+        # callers must hold locked() and ensure_fresh() before creating the instance files,
+        # or the rebuild would count them twice
+        with self.locked():
+            self.__read_header()
+            new_ids = [i for i in node_ids]
+            if self.__ids is not None:
+                for node_id in new_ids:
+                    self.__ids[node_id] = None
+            self.__ops += len(new_ids)
+            self.__append(b"".join(b"+%s\n" % i.encode() for i in new_ids), len(new_ids))
+
+    def remove(self, node_ids: Iterable[str]) -> None:
+        # callers must hold locked() and ensure_fresh() before deleting the instance files,
+        # otherwise their own delete makes the manifest look stale and it is rebuilt
+        with self.locked():
+            self.__read_header()
+            ids = self.__load_ids()
+            removed = [i for i in node_ids if i in ids]
+            for node_id in removed:
+                del ids[node_id]
+            self.__ops += len(removed)
+            self.__append(b"".join(b"-%s\n" % i.encode() for i in removed), -len(removed))
+            if self.__ops > 2 * self.__count + 64:
+                self.__write(list(ids))
+
+    def rebuild(self, extra_ids: Iterable[str]=()) -> None:
+        with self.locked():
+            # keep the creation order we already know about, new files go at the end oldest first
+            known: List[str] = []
+            if os.path.exists(self.__filepath):
+                try:
+                    known = list(self.__load_ids())
+                except (ValueError, OSError):
+                    known = []
+            # stamped before listing, a change that lands while we list makes the next check rebuild again
+            change_stamp = self.__current_stamp()
+            found: Dict[str, None] = { i: None for i in extra_ids }
+            found.update((i, None) for i in self.storage.list(self.__struct_dirpath))
+            ordered = [i for i in known if i in found]
+            known_set = set(ordered)
+            ordered += [i for i in found if i not in known_set]
+            self.__change_stamp = change_stamp
+            self.__write(ordered)
+            debug(f"Rebuilt instance manifest {self.__filepath} with {len(ordered)} ids")
+
+    def __write(self, ordered: List[str]) -> None:
+        self.__count = len(ordered)
+        self.__modified = max(self.__modified + 1, time.time_ns())
+        self.__ids = { i: None for i in ordered }
+        self.__ids_list = None
+        self.__ops = len(ordered)
+        tmp_filepath = f"{self.__filepath}.{os.getpid()}.tmp"
+        with open(tmp_filepath, "wb") as f:
+            f.write(self.__header())
+            f.write(b"".join(b"+%s\n" % i.encode() for i in ordered))
+        os.replace(tmp_filepath, self.__filepath)
+
+manifests: Dict[str, InstanceManifest] = {}
+manifests_lock = threading.Lock()
+
+def get_manifest(struct_dirpath: str, storage: Optional[StorageBackend]=None) -> InstanceManifest:
+    key = os.path.abspath(struct_dirpath)
+    with manifests_lock:
+        if key not in manifests:
+            manifests[key] = InstanceManifest(struct_dirpath)
+        manifest = manifests[key]
+        if storage is not None:
+            manifest.storage = storage
+        return manifest
@@ -0,0 +1,181 @@
+from typing import Dict, Set, Tuple, Any, Optional
+import threading
+import datetime
+import math
+import json
+import time
+import os
+
+from core.components.node import NodeCache
+from core.logger import info
+
+# counters copied from NodeCache.stats(), reported as the difference since the run started
+NODE_COUNTERS = ["hits", "misses", "evictions", "writes", "creates", "loads", "bytes_read", "bytes_written"]
+
+class LatencyHistogram:
+    # Log-scale buckets, BUCKETS_PER_DOUBLING per power of two starting at 1 microsecond, so memory stays
+    # constant however long the run is and percentiles are within ~9% of the true value.
+    BUCKETS_PER_DOUBLING = 8
+    MIN_SECONDS = 1e-6
+    counts: Dict[int, int]
+    count: int
+    total: float
+    min: float
+    max: float
+
+    def __init__(self):
+        self.counts = {}
+        self.count = 0
+        self.total = 0.0
+        self.min = math.inf
+        self.max = 0.0
+
+    def __bucket(self, seconds: float) -> int:
+        if seconds <= self.MIN_SECONDS:
+            return 0
+        return int(math.log2(seconds / self.MIN_SECONDS) * self.BUCKETS_PER_DOUBLING) + 1
+
+    def __bucket_value(self, bucket: int) -> float:
+        # upper edge of the bucket
+        return self.MIN_SECONDS * 2 ** (bucket / self.BUCKETS_PER_DOUBLING)
+
+    def add(self, seconds: float) -> None:
+        bucket = self.__bucket(seconds)
+        self.counts[bucket] = self.counts.get(bucket, 0) + 1
+        self.count += 1
+        self.total += seconds
+        self.min = min(self.min, seconds)
+        self.max = max(self.max, seconds)
+
+    def percentile(self, p: float) -> float:
+        if not self.count:
+            return 0.0
+        target = max(1, math.ceil(self.count * p / 100))
+        seen = 0
+        for bucket in sorted(self.counts):
+            seen += self.counts[bucket]
+            if seen >= target:
+                return min(self.__bucket_value(bucket), self.max)
+        return self.max
+
+    def summary(self) -> Dict[str, float]:
+        return {
+            'count': self.count,
+            'mean': self.total / self.count if self.count else 0.0,
+            'min': self.min if self.count else 0.0,
+            'p50': self.percentile(50), 'p90': self.percentile(90), 'p99': self.percentile(99),
+            'max': self.max,
+        }
+
+class RunMetrics:
+    # Collected for every executor run: per-step latency, yields/sec and node I/O.
+    # A step is the time the generator spends between two yields, including the flush of its node writes.
+    generator_name: str
+    latency: LatencyHistogram
+    yields: int
+    __node_cache: Optional[NodeCache]
+    __baseline: Dict[str, int]
+    __worker_counters: Dict[str, int]      # counters reported by process workers, which have their own caches
+    __written_paths: Set[str]               # nodes written and created by process workers and by finished runs
+    __created_paths: Set[str]
+    __lock: threading.Lock
+
+    def __init__(self, generator_name: str):
+        self.generator_name = generator_name
+        self.latency = LatencyHistogram()
+        self.yields = 0
+        self.last_step: Optional[float] = None
+        self.started_at: Optional[float] = None
+        self.ended_at: Optional[float] = None
+        self.__node_cache = None
+        self.__baseline = {}
+        self.__worker_counters = { k: 0 for k in NODE_COUNTERS }
+        self.__written_paths = set()
+        self.__created_paths = set()
+        self.__lock = threading.Lock()
+
+    def start(self, node_cache: NodeCache) -> None:
+        stats = node_cache.stats()
+        node_cache.track_writes(True)
+        with self.__lock:
+            self.__node_cache = node_cache
+            self.__baseline = { k: stats[k] for k in NODE_COUNTERS }
+            self.started_at = time.perf_counter()
+            self.ended_at = None
+
+    def finish(self) -> None:
+        # the cache stops tracking paths, this run keeps what it wrote
+        written, created = self.__node_cache.tracked_writes() if self.__node_cache else (set(), set())
+        if self.__node_cache:
+            self.__node_cache.track_writes(False)
+        with self.__lock:
+            self.__written_paths |= written
+            self.__created_paths |= created
+            self.ended_at = time.perf_counter()
+
+    def step(self, seconds: float) -> None:
+        with self.__lock:
+            self.yields += 1
+            self.last_step = seconds
+            self.latency.add(seconds)
+
+    def add_worker_counters(self, stats: Dict[str, Any]) -> None:
+        with self.__lock:
+            for k in NODE_COUNTERS:
+                self.__worker_counters[k] += stats.get(k, 0)
+            self.__written_paths.update(stats.get('written_paths', ()))
+            self.__created_paths.update(stats.get('created_paths', ()))
+
+    def node_paths(self) -> Tuple[Set[str], Set[str]]:
+        # (written, created) by this run so far, including process workers
+        written, created = self.__node_cache.tracked_writes() if self.__node_cache and self.ended_at is None else (set(), set())
+        with self.__lock:
+            return written | self.__written_paths, created | self.__created_paths
+
+    def elapsed(self) -> float:
+        if self.started_at is None:
+            return 0.0
+        return (self.ended_at if self.ended_at is not None else time.perf_counter()) - self.started_at
+
+    def snapshot(self) -> Dict[str, Any]:
+        stats = self.__node_cache.stats() if self.__node_cache else {}
+        written, created = self.node_paths()
+        with self.__lock:
+            elapsed = self.elapsed()
+            nodes = { k: max(0, stats.get(k, 0) - self.__baseline.get(k, 0)) + self.__worker_counters[k] for k in NODE_COUNTERS }
+            lookups = nodes['hits'] + nodes['misses']
+            return {
+                'generator': self.generator_name,
+                'running': self.started_at is not None and self.ended_at is None,
+                'elapsed': elapsed,
+                'yields': self.yields,
+                'yields_per_sec': self.yields / elapsed if elapsed > 0 else 0.0,
+                'step_latency': self.latency.summary(),
+                'node_loads': nodes['loads'],
+                'node_saves': nodes['writes'],
+                'node_creates': nodes['creates'],
+                'nodes_modified': len(written - created),    # distinct nodes written that existed before the run
+                'bytes_read': nodes['bytes_read'],
+                'bytes_written': nodes['bytes_written'],
+                'cache_hits': nodes['hits'],
+                'cache_misses': nodes['misses'],
+                'cache_evictions': nodes['evictions'],
+                'cache_hit_rate': nodes['hits'] / lookups if lookups else 0.0,
+            }
+
+    def format_line(self) -> str:
+        s = self.snapshot()
+        latency = s['step_latency']
+        return (
+            f"{s['yields']} yields, {s['yields_per_sec']:.1f}/s | step p50 {latency['p50']*1000:.2f}ms p99 {latency['p99']*1000:.2f}ms"
+            f" | loads {s['node_loads']} saves {s['node_saves']} creates {s['node_creates']}"
+            f" | read {s['bytes_read']/1024:.0f}KiB written {s['bytes_written']/1024:.0f}KiB | cache hit {s['cache_hit_rate']:.1%}"
+        )
+
+    def dump(self, log_dirpath: str) -> str:
+        os.makedirs(log_dirpath, exist_ok=True)
+        filepath = os.path.join(log_dirpath, datetime.datetime.now().strftime(f"%Y-%m-%d_%H-%M-%S_metrics_{self.generator_name}.json"))
+        with open(filepath, "w") as f:
+            json.dump(self.snapshot(), f, indent=2)
+        info(f"Wrote executor metrics to {filepath}")
+        return filepath
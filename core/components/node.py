@@ -1,150 +1,632 @@
-from typing import Dict, List, TypeVar, Type
+from typing import Dict, List, Set, TypeVar, Type, Optional, Any, Iterator, Iterable, Tuple
+from contextlib import contextmanager
+from collections import OrderedDict
+from enum import Enum
+import threading
+import hashlib
 import json
 import uuid
-import time
 import os
 
 from core.components.export_info import Parameter
+from core.components.storage import StorageBackend, FileStorage
+from core.components.codec import NodeCodec
+from core.components.manifest import get_manifest
+from core.components.index import AttributeIndex, get_index
 from core.utils import file_to_class_name
-from core.logger import error
+from core.logger import error, debug
 from core.globals import STRUCT_DIRNAME, INSTANCES_DIRNAME
 
 T = TypeVar('T')
 
+INDEX_LOAD_BATCH = 256
+
+class CachePolicy(Enum):
+    LRU = "lru"
+    LFU = "lfu"
+
 class CacheLine:
     data: Dict
-    time: float
+    size: int
+    freq: int
+    dirty: bool
+    def __init__(self, data: Dict, size: int, dirty: bool=False):
+        self.data = data
+        self.size = size
+        self.freq = 1
+        self.dirty = dirty
+
+def estimate_size(data: Any) -> int:
+    # rough JSON-encoded size, only used when the caller does not know the real size
+    if isinstance(data, dict):
+        return 2 + sum(estimate_size(k) + estimate_size(v) + 2 for k, v in data.items())
+    if isinstance(data, list):
+        return 2 + sum(estimate_size(v) + 1 for v in data)
+    if isinstance(data, str):
+        return len(data) + 2
+    return 8
 
 class NodeCache:
     __max_size: int
+    __max_bytes: int
+    __policy: CachePolicy
     __cache: Dict[str, CacheLine]
+    __order: 'OrderedDict[str, None]'                   # LRU recency order, oldest first
+    __freqs: Dict[int, 'OrderedDict[str, None]']        # LFU buckets, oldest first within a bucket
+    __min_freq: int
+    __bytes: int
+    __lock: threading.RLock
+    hits: int
+    misses: int
+    evictions: int
+    writes: int
+    creates: int
+    loads: int                      # nodes read from storage instead of the cache
+    bytes_read: int
+    bytes_written: int
+    __written_paths: Optional[Set[str]]    # nodes written since track_writes(True), None when not tracking
+    __created_paths: Optional[Set[str]]
+    write_back: bool = False        # when set, Node setters only mark the cache line dirty until flush()
+    storage: StorageBackend         # where nodes are read from and written to, set per world by the executor
 
-    def __init__(self, max_size: int):
+    def __init__(self, max_size: int, max_bytes: int=0, policy: CachePolicy=CachePolicy.LRU):
         if max_size < 1:
             raise ValueError(f"Tried creating cache with max_size {max_size}, must be >= 1")
+        if max_bytes < 0:
+            raise ValueError(f"Tried creating cache with max_bytes {max_bytes}, must be >= 0 (0 disables the byte limit)")
         self.__max_size = max_size
-        self.__cache = {}
+        self.__max_bytes = max_bytes
+        self.__policy = policy
+        self.storage = FileStorage()
+        self.__lock = threading.RLock()
+        self.__written_paths = None
+        self.__created_paths = None
+        self.__reset()
+
+    def clear(self) -> None:
+        with self.__lock:
+            self.flush()
+            self.__reset()
+
+    def __reset(self) -> None:
+        with self.__lock:
+            self.__cache = {}
+            self.__order = OrderedDict()
+            self.__freqs = {}
+            self.__min_freq = 0
+            self.__bytes = 0
+            self.hits = 0
+            self.misses = 0
+            self.evictions = 0
+            self.writes = 0
+            self.creates = 0
+            self.loads = 0
+            self.bytes_read = 0
+            self.bytes_written = 0
+
+    def __len__(self) -> int:
+        return len(self.__cache)
+
+    def track_writes(self, enabled: bool) -> None:
+        # run metrics count distinct nodes written, the paths are only kept while a run tracks them
+        with self.__lock:
+            self.__written_paths = set() if enabled else None
+            self.__created_paths = set() if enabled else None
+
+    def tracked_writes(self) -> Tuple[Set[str], Set[str]]:
+        # (written, created) since track_writes(True)
+        with self.__lock:
+            return set(self.__written_paths or ()), set(self.__created_paths or ())
 
     def contains(self, path_on_disk: str) -> bool:
         return path_on_disk in self.__cache
 
     def retrieve(self, path_on_disk: str) -> Dict:
-        cache_line = self.__cache[path_on_disk]
-        cache_line.time = time.time()
-        return cache_line.data
-    
-    def store(self, path_on_disk: str, data: Dict) -> None:
-        if path_on_disk in self.__cache:
+        with self.__lock:
             cache_line = self.__cache[path_on_disk]
-        else:
-            cache_line = CacheLine()
-            self.__cache[path_on_disk] = cache_line
-        cache_line.time = time.time()
-        cache_line.data = data
-
-        if len(self.__cache) > self.__max_size:
-            earliest_key  = None
-            earliest_time = 0
-            for key in self.__cache:
-                key_time = self.__cache[key].time
-                if earliest_key is None or key_time < earliest_time:
-                    earliest_key = key
-                    earliest_time = key_time
-            del self.__cache[earliest_key] # type: ignore
+            self.hits += 1
+            self.__touch(path_on_disk, cache_line)
+            return cache_line.data
+
+    def get(self, path_on_disk: str) -> Optional[Dict]:
+        with self.__lock:
+            if path_on_disk not in self.__cache:
+                self.misses += 1
+                return None
+            return self.retrieve(path_on_disk)
+
+    def store(self, path_on_disk: str, data: Dict, size: Optional[int]=None, dirty: bool=False) -> None:
+        size = size if size is not None else estimate_size(data)
+        with self.__lock:
+            cache_line = CacheLine(data, size, dirty)
+            if path_on_disk in self.__cache:
+                old_line = self.__cache[path_on_disk]
+                if old_line.dirty and not dirty:
+                    # a clean copy, e.g. read from storage while another thread wrote the node back, is older than
+                    # the pending write, replacing it would flush the stale copy and lose the write
+                    self.__touch(path_on_disk, old_line)
+                    return
+                # unlink while making room so the entry being stored is never its own victim
+                cache_line.freq = old_line.freq + 1
+                self.__unlink(path_on_disk)
+            while self.__cache and (len(self.__cache) >= self.__max_size or (self.__max_bytes and self.__bytes + size > self.__max_bytes)):
+                victim = self.__victim()
+                victim_line = self.__cache[victim]
+                if victim_line.dirty:
+                    self.__write(victim, victim_line)
+                self.__unlink(victim)
+                self.evictions += 1
+            self.__link(path_on_disk, cache_line)
+
+    def read_through(self, path_on_disk: str) -> Dict:
+        data = self.get(path_on_disk)
+        if data is not None:
+            return data
+        loaded = self.storage.get(path_on_disk)
+        if loaded is None:
+            raise FileExistsError(error(f"Could not find node information in {self.storage.mode} storage, searched {path_on_disk}"))
+        data, size = loaded
+        with self.__lock:
+            self.loads += 1
+            self.bytes_read += size
+            return self.__fill(path_on_disk, data, size)
+
+    def read_through_many(self, paths: List[str]) -> Dict[str, Dict]:
+        # one bulk storage read for every path that is not cached, missing nodes are left out
+        found: Dict[str, Dict] = {}
+        missing: List[str] = []
+        for path_on_disk in paths:
+            data = self.get(path_on_disk)
+            if data is None:
+                missing.append(path_on_disk)
+            else:
+                found[path_on_disk] = data
+        if missing:
+            loaded = self.storage.get_many(missing)
+            with self.__lock:
+                self.loads += len(loaded)
+                self.bytes_read += sum(size for _, size in loaded.values())
+                for path_on_disk, (data, size) in loaded.items():
+                    found[path_on_disk] = self.__fill(path_on_disk, data, size)
+        return found
+
+    def __fill(self, path_on_disk: str, data: Dict, size: int) -> Dict:
+        # caches data read from storage, returns what the cache holds, which is newer if the node was written meanwhile
+        self.store(path_on_disk, data, size)
+        cache_line = self.__cache.get(path_on_disk)
+        return cache_line.data if cache_line is not None else data
+
+    def write_through(self, path_on_disk: str, data: Dict) -> None:
+        with self.__lock:
+            self.writes += 1
+            size = self.__persist(path_on_disk, data)
+            if path_on_disk in self.__cache:
+                # what was just written supersedes a pending write of the node
+                self.__cache[path_on_disk].dirty = False
+            self.store(path_on_disk, data, size)
+
+    def delete_through(self, path_on_disk: str) -> None:
+        with self.__lock:
+            self.remove(path_on_disk)
+            self.storage.delete(path_on_disk)
+
+    def create_through(self, path_on_disk: str) -> Dict:
+        with self.__lock:
+            # the backend refuses duplicates, so a colliding id never overwrites an existing node
+            data: Dict = {}
+            size = self.storage.create(path_on_disk, data)
+            self.writes += 1
+            self.creates += 1
+            self.bytes_written += size
+            if self.__created_paths is not None:
+                self.__created_paths.add(path_on_disk)
+            self.store(path_on_disk, data, size)
+            return data
+
+    def create_many_through(self, items: List[Tuple[str, Dict]]) -> None:
+        # one bulk create in the backend, the nodes are cached as written
+        with self.__lock:
+            sizes = self.storage.create_many(items)
+            self.writes += len(items)
+            self.creates += len(items)
+            self.bytes_written += sum(sizes)
+            if self.__created_paths is not None:
+                self.__created_paths.update(path_on_disk for path_on_disk, _ in items)
+            for (path_on_disk, data), size in zip(items, sizes):
+                self.store(path_on_disk, data, size)
+
+    def node_exists(self, path_on_disk: str) -> bool:
+        return path_on_disk in self.__cache or self.storage.exists(path_on_disk)
+
+    def __persist(self, path_on_disk: str, data: Dict) -> int:
+        size = self.storage.put(path_on_disk, data)
+        self.bytes_written += size
+        if self.__written_paths is not None:
+            self.__written_paths.add(path_on_disk)
+        return size
+
+    def is_dirty(self, path_on_disk: str) -> bool:
+        cache_line = self.__cache.get(path_on_disk)
+        return cache_line is not None and cache_line.dirty
+
+    def flush_path(self, path_on_disk: str) -> bool:
+        with self.__lock:
+            cache_line = self.__cache.get(path_on_disk)
+            if cache_line is None or not cache_line.dirty:
+                return False
+            self.__write(path_on_disk, cache_line)
+            return True
+
+    def flush(self) -> int:
+        # every dirty node goes to the backend in one bulk write
+        with self.__lock:
+            dirty = [(key, cache_line) for key, cache_line in self.__cache.items() if cache_line.dirty]
+            if not dirty:
+                return 0
+            sizes = self.storage.put_many([(key, cache_line.data) for key, cache_line in dirty])
+            for (key, cache_line), size in zip(dirty, sizes):
+                self.bytes_written += size
+                self.__written(cache_line, size)
+                if self.__written_paths is not None:
+                    self.__written_paths.add(key)
+            return len(dirty)
+
+    def remove(self, path_on_disk: str) -> None:
+        # drops the entry without writing it back, even if it is dirty
+        with self.__lock:
+            if path_on_disk in self.__cache:
+                self.__unlink(path_on_disk)
+
+    def stats(self) -> Dict[str, Any]:
+        with self.__lock:
+            lookups = self.hits + self.misses
+            return {
+                'policy': self.__policy.value,
+                'entries': len(self.__cache), 'max_size': self.__max_size,
+                'bytes': self.__bytes, 'max_bytes': self.__max_bytes,
+                'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions, 'writes': self.writes, 'creates': self.creates,
+                'loads': self.loads, 'bytes_read': self.bytes_read, 'bytes_written': self.bytes_written,
+                'dirty': sum(1 for cache_line in self.__cache.values() if cache_line.dirty),
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+            }
+
+    def __touch(self, key: str, cache_line: CacheLine) -> None:
+        if self.__policy == CachePolicy.LRU:
+            self.__order.move_to_end(key)
+            return
+        bucket = self.__freqs[cache_line.freq]
+        del bucket[key]
+        if not bucket:
+            del self.__freqs[cache_line.freq]
+            if self.__min_freq == cache_line.freq:
+                self.__min_freq += 1
+        cache_line.freq += 1
+        self.__freqs.setdefault(cache_line.freq, OrderedDict())[key] = None
+
+    def __write(self, key: str, cache_line: CacheLine) -> None:
+        self.__written(cache_line, self.__persist(key, cache_line.data))
+
+    def __written(self, cache_line: CacheLine, size: int) -> None:
+        self.__bytes += size - cache_line.size
+        cache_line.size = size
+        cache_line.dirty = False
+        self.writes += 1
+
+    def __link(self, key: str, cache_line: CacheLine) -> None:
+        self.__cache[key] = cache_line
+        self.__bytes += cache_line.size
+        if self.__policy == CachePolicy.LRU:
+            self.__order[key] = None
+            return
+        self.__freqs.setdefault(cache_line.freq, OrderedDict())[key] = None
+        self.__min_freq = cache_line.freq if len(self.__freqs) == 1 else min(self.__min_freq, cache_line.freq)
+
+    def __unlink(self, key: str) -> None:
+        cache_line = self.__cache.pop(key)
+        self.__bytes -= cache_line.size
+        if self.__policy == CachePolicy.LRU:
+            del self.__order[key]
+            return
+        bucket = self.__freqs[cache_line.freq]
+        del bucket[key]
+        if not bucket:
+            del self.__freqs[cache_line.freq]
+            if self.__min_freq == cache_line.freq:
+                self.__min_freq = min(self.__freqs) if self.__freqs else 0
+
+    def __victim(self) -> str:
+        if self.__policy == CachePolicy.LRU:
+            return next(iter(self.__order))
+        return next(iter(self.__freqs[self.__min_freq]))
+
+class NotLoaded:
+    # placeholder in an attribute slot until the attribute is first read or written
+    __slots__ = ()
+    def __repr__(self) -> str:
+        return "NOT_LOADED"
+
+NOT_LOADED = NotLoaded()
+SLOT_PREFIX = "_attr_"      # generated classes keep attribute <name> in slot _attr_<name>, apart from Node's methods
 
 class Node:
+    # no per-instance __dict__, generators may hold every instance of a struct at once
+    __slots__ = ("__path_on_disk", "__global_cache", "__batch_depth")
     NAME: str
     ATTRS: List[str]
+    INDEXES: Dict[str, str] = {}    # attr -> index kind, see core.components.index
+    CODEC: Optional[NodeCodec] = None   # compiled from ATTRS and their types, see core.components.codec
+    ATTR_SLOTS: List[Tuple[str, str]] = []     # (attr, slot) per entry of ATTRS, filled in for every subclass
     __path_on_disk: str
     __global_cache: NodeCache
+    __batch_depth: int
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls.ATTR_SLOTS = [(attr, SLOT_PREFIX + attr) for attr in getattr(cls, "ATTRS", [])]
     
     def __init__(self, path_on_disk, global_cache):
         self.__path_on_disk = path_on_disk
         self.__global_cache = global_cache
+        self.__batch_depth = 0
 
     def __load_data(self) -> Dict:
-        if self.__global_cache.contains(self.__path_on_disk):
-            return self.__global_cache.retrieve(self.__path_on_disk)
-        else:
-            if not os.path.isfile(self.__path_on_disk):
-                raise FileExistsError(error(f"Could not find node information on disk, searched {self.__path_on_disk}"))
-            with open(self.__path_on_disk) as f:
-                data = json.load(f)
-            return data
+        return self.__global_cache.read_through(self.__path_on_disk)
 
     def _load(self, attr):
-        if not hasattr(self, attr):
+        # attributes outside ATTRS have no slot and are read from the cache every time
+        value = getattr(self, SLOT_PREFIX + attr, NOT_LOADED)
+        if value is NOT_LOADED:
             data = self.__load_data()
             if attr not in data:
                 data[attr] = None
                 self.__global_cache.store(self.__path_on_disk, data)
-            setattr(self, attr, data[attr])
-        return getattr(self, attr)
+            value = data[attr]
+            if attr in self.ATTRS:
+                setattr(self, SLOT_PREFIX + attr, value)
+        return value
     
     def _save(self, attr, value):
-        setattr(self, attr, value)
+        if attr in self.ATTRS:
+            setattr(self, SLOT_PREFIX + attr, value)
         data = self.__load_data()
+        if attr in self.INDEXES:
+            self._get_index(os.path.dirname(os.path.dirname(self.__path_on_disk)), self.__global_cache, attr).update(self.get_id(), data.get(attr), value)
         data[attr] = value
-        with open(self.__path_on_disk, "w") as f:
-            json.dump(data, f)
-        self.__global_cache.store(self.__path_on_disk, data)
+        if self.__batch_depth > 0 or self.__global_cache.write_back:
+            self.__global_cache.store(self.__path_on_disk, data, dirty=True)
+        else:
+            self.__global_cache.write_through(self.__path_on_disk, data)
+
+    def is_dirty(self) -> bool:
+        return self.__global_cache.is_dirty(self.__path_on_disk)
+
+    def flush(self) -> bool:
+        return self.__global_cache.flush_path(self.__path_on_disk)
+
+    @contextmanager
+    def batch(self) -> Iterator['Node']:
+        # setters inside the block only touch the cache, the node is written once on exit
+        self.__batch_depth += 1
+        try:
+            yield self
+        finally:
+            self.__batch_depth -= 1
+            if self.__batch_depth == 0:
+                self.flush()
 
     def load_all(self):
         data = None
-        for attr in self.ATTRS:
-            if not hasattr(self, attr):
+        for attr, slot in self.ATTR_SLOTS:
+            if getattr(self, slot) is NOT_LOADED:
                 if data is None:
                     data = self.__load_data()
                 if attr not in data:
                     data[attr] = None
                     self.__global_cache.store(self.__path_on_disk, data)
-                setattr(self, attr, data[attr])
+                setattr(self, slot, data[attr])
     
+    def get_id(self) -> str:
+        return os.path.splitext(os.path.basename(self.__path_on_disk))[0]
+
+    def delete(self) -> None:
+        struct_dirpath = os.path.dirname(os.path.dirname(self.__path_on_disk))
+        if self.INDEXES:
+            data = self.__load_data()
+            for attr in self.INDEXES:
+                self._get_index(struct_dirpath, self.__global_cache, attr).remove(self.get_id(), data.get(attr))
+        manifest = get_manifest(struct_dirpath, self.__global_cache.storage)
+        with manifest.locked():
+            manifest.ensure_fresh()
+            self.__global_cache.delete_through(self.__path_on_disk)
+            manifest.remove([self.get_id()])
+
     def unload_all(self):
-        for attr in self.ATTRS:
-            if hasattr(self, attr):
-                delattr(self, attr)
+        for _, slot in self.ATTR_SLOTS:
+            setattr(self, slot, NOT_LOADED)
 
     @classmethod
     def create(cls: Type[T], create_args) -> T:
         if cls is Node:
             raise ValueError("Can not instanciate base Node, must be usertype generated from user-defined struct")
-        path_on_disk = f"{create_args['world_dirpath']}/{STRUCT_DIRNAME}/{cls.NAME}/{INSTANCES_DIRNAME}/{uuid.uuid4().hex}.json" # type: ignore
-        if os.path.exists(path_on_disk):
-            raise RuntimeError(f"Found duplicate node path when trying to create new Node {path_on_disk}")
-        with open(path_on_disk, "w") as f:
-            f.write("{}")
-        obj = cls(path_on_disk, create_args['global_cache']) # type: ignore
+        struct_dirpath = f"{create_args['world_dirpath']}/{STRUCT_DIRNAME}/{cls.NAME}" # type: ignore
+        node_id = uuid.uuid4().hex
+        path_on_disk = f"{struct_dirpath}/{INSTANCES_DIRNAME}/{node_id}.json"
+        global_cache: NodeCache = create_args['global_cache']
+        manifest = get_manifest(struct_dirpath, global_cache.storage)
+        with manifest.locked():
+            manifest.ensure_fresh()
+            global_cache.create_through(path_on_disk)
+            manifest.add([node_id])
+        for attr in cls.INDEXES: # type: ignore
+            cls._get_index(struct_dirpath, global_cache, attr).add(node_id, None) # type: ignore
+        obj = cls(path_on_disk, global_cache) # type: ignore
         return obj
 
+    @classmethod
+    def create_many(cls: Type[T], create_args, rows: Iterable[Dict[str, Any]]) -> List[T]:
+        # fully populated nodes in one backend write, instead of a create and a write per setter for each node
+        if cls is Node:
+            raise ValueError("Can not instanciate base Node, must be usertype generated from user-defined struct")
+        rows = [dict(row) for row in rows]
+        for row in rows:
+            unknown = [attr for attr in row if attr not in cls.ATTRS] # type: ignore
+            if unknown:
+                raise ValueError(error(f"{cls.__name__} has no attributes {unknown}, expected any of {cls.ATTRS}")) # type: ignore
+        struct_dirpath = f"{create_args['world_dirpath']}/{STRUCT_DIRNAME}/{cls.NAME}" # type: ignore
+        node_ids = [uuid.uuid4().hex for _ in rows]
+        items = [(f"{struct_dirpath}/{INSTANCES_DIRNAME}/{node_id}.json", row) for node_id, row in zip(node_ids, rows)]
+        global_cache: NodeCache = create_args['global_cache']
+        manifest = get_manifest(struct_dirpath, global_cache.storage)
+        with manifest.locked():
+            manifest.ensure_fresh()
+            # indexes that still have to be built read the manifest, so they are fetched before the new ids are in it
+            indexes = [(attr, cls._get_index(struct_dirpath, global_cache, attr)) for attr in cls.INDEXES] # type: ignore
+            global_cache.create_many_through(items)
+            manifest.add(node_ids)
+        for attr, index in indexes:
+            index.add_many((node_id, row.get(attr)) for node_id, row in zip(node_ids, rows))
+        nodes = []
+        for path_on_disk, row in items:
+            node = cls(path_on_disk, global_cache) # type: ignore
+            for attr, slot in cls.ATTR_SLOTS: # type: ignore
+                setattr(node, slot, row.get(attr))
+            nodes.append(node)
+        return nodes
+
+    @classmethod
+    def _get_index(cls, struct_dirpath: str, global_cache: NodeCache, attr: str) -> AttributeIndex:
+        def load_entries() -> Iterator[Tuple[str, Any]]:
+            # rebuilding an index reads every instance, in bulk reads of INDEX_LOAD_BATCH nodes
+            node_ids = get_manifest(struct_dirpath, global_cache.storage).ids()
+            for start in range(0, len(node_ids), INDEX_LOAD_BATCH):
+                batch = { f"{struct_dirpath}/{INSTANCES_DIRNAME}/{node_id}.json": node_id for node_id in node_ids[start:start + INDEX_LOAD_BATCH] }
+                found = global_cache.read_through_many(list(batch))
+                for path_on_disk, node_id in batch.items():
+                    if path_on_disk not in found:
+                        # deleted by another process since the manifest was read
+                        debug(f"Left {path_on_disk} out of the '{attr}' index, it is no longer in {global_cache.storage.mode} storage")
+                        continue
+                    yield node_id, found[path_on_disk].get(attr)
+        return get_index(struct_dirpath, attr, cls.INDEXES[attr], load_entries)
+
+    @classmethod
+    def __from_ids(cls: Type[T], create_args, node_ids: Iterable[str]) -> List[T]:
+        instance_dirpath = f"{create_args['world_dirpath']}/{STRUCT_DIRNAME}/{cls.NAME}/{INSTANCES_DIRNAME}" # type: ignore
+        return [cls(f"{instance_dirpath}/{node_id}.json", create_args['global_cache']) for node_id in node_ids] # type: ignore
+
+    @classmethod
+    def where(cls: Type[T], create_args, **conditions) -> List[T]:
+        # equality query, None matches nodes that never set the attribute
+        # indexed attributes are answered from their index, the rest are checked by loading the candidates
+        struct_dirpath = f"{create_args['world_dirpath']}/{STRUCT_DIRNAME}/{cls.NAME}" # type: ignore
+        global_cache: NodeCache = create_args['global_cache']
+        node_ids: Optional[List[str]] = None
+        unindexed = {}
+        for attr, value in conditions.items():
+            if attr not in cls.ATTRS: # type: ignore
+                raise ValueError(error(f"'{attr}' is not an attribute of {cls.__name__}"))
+            if attr not in cls.INDEXES: # type: ignore
+                unindexed[attr] = value
+                continue
+            index = cls._get_index(struct_dirpath, global_cache, attr) # type: ignore
+            if not index.holds(value):
+                # the missing set also holds values the index can not, the candidates are checked by loading them
+                unindexed[attr] = value
+            matches = index.equal(value)
+            if node_ids is None:
+                node_ids = matches
+            else:
+                match_set = set(matches)
+                node_ids = [i for i in node_ids if i in match_set]
+        if node_ids is None:
+            debug(f"{cls.__name__}.where() has no indexed conditions, scanning every instance")
+            node_ids = get_manifest(struct_dirpath, global_cache.storage).ids()
+        nodes = cls.__from_ids(create_args, node_ids) # type: ignore
+        if unindexed:
+            nodes = [n for n in nodes if all(n._load(attr) == value for attr, value in unindexed.items())] # type: ignore
+        return nodes
+
+    @classmethod
+    def where_range(cls: Type[T], create_args, attr: str, low: Any=None, high: Any=None) -> List[T]:
+        # inclusive range query over an attribute with a sorted index
+        if attr not in cls.INDEXES: # type: ignore
+            raise ValueError(error(f"'{attr}' of {cls.__name__} has no index, range queries need a sorted index"))
+        struct_dirpath = f"{create_args['world_dirpath']}/{STRUCT_DIRNAME}/{cls.NAME}" # type: ignore
+        node_ids = cls._get_index(struct_dirpath, create_args['global_cache'], attr).range(low, high) # type: ignore
+        return cls.__from_ids(create_args, node_ids) # type: ignore
+
 
 total_file = """
-from typing import Optional
+from typing import Optional, List
 
-from core.components.node import Node
+from core.components.node import Node, NOT_LOADED
+from core.components.codec import compile_codec
 
 #########################################################
 # NOTE: This file is auto-generated.                    #
 # Any changes made to this file will automatically get  #
-# deleted the next time the associated struct is saved. #
+# deleted the next time the associated struct changes.  #
 #########################################################
 
 class <class_name>(Node):
+    __slots__ = (<slot_list>)
     NAME = "<struct_name>"
     ATTRS = [<attr_list>]
+    INDEXES = {<index_list>}
+    CODEC = compile_codec("<struct_name>", [<codec_fields>])
 
     def __init__(self, *args):
         super().__init__(*args)
+        <slot_init>
 <getters_and_setters>""".lstrip()
 
 getters_and_setters = """
-    def get_<name>(self) -> Optional[<type>]:  return self._load("<name>")
+    def get_<name>(self) -> Optional[<type>]:
+        value = self._attr_<name>
+        return value if value is not NOT_LOADED else self._load("<name>")
     def set_<name>(self, value: <type>) -> None:  self._save("<name>", value)
 """
 
+index_queries = {
+    "hash": """
+    @classmethod
+    def where_<name>(cls, create_args, value: Optional[<type>]) -> List['<class_name>']:  return cls.where(create_args, <name>=value)
+""",
+    "sorted": """
+    @classmethod
+    def where_<name>(cls, create_args, value: Optional[<type>]) -> List['<class_name>']:  return cls.where(create_args, <name>=value)
+    @classmethod
+    def range_<name>(cls, create_args, low: Optional[<type>]=None, high: Optional[<type>]=None) -> List['<class_name>']:  return cls.where_range(create_args, "<name>", low, high)
+""",
+}
+
+# bump when the generated files change in a way the templates above do not capture
+NODE_CODEGEN_VERSION = 4
+CODEGEN_STAMP_PREFIX = "# codegen "
+
+def node_codegen_stamp(name: str, parameters: List[Parameter]) -> str:
+    # first line of every generated file, it changes whenever the struct or the code generator does
+    source = json.dumps([NODE_CODEGEN_VERSION, total_file, getters_and_setters, index_queries, name, [p.to_dict() for p in parameters]])
+    return f"{CODEGEN_STAMP_PREFIX}v{NODE_CODEGEN_VERSION} {hashlib.sha256(source.encode()).hexdigest()}"
+
+def node_text_is_current(filepath: str, name: str, parameters: List[Parameter]) -> bool:
+    # only the stamp line is read, so opening a world does not regenerate and compare every type file
+    if not os.path.isfile(filepath):
+        return False
+    with open(filepath) as f:
+        return f.readline().rstrip("\n") == node_codegen_stamp(name, parameters)
+
 def generate_node_text(name: str, parameters: List[Parameter]) -> str:
-    return total_file \
+    class_name = file_to_class_name(name)
+    return node_codegen_stamp(name, parameters) + "\n" + total_file \
         .replace("<struct_name>", name) \
         .replace("<attr_list>", ", ".join([f'"{p.name}"' for p in parameters])) \
-        .replace("<class_name>", file_to_class_name(name)) \
-        .replace("<getters_and_setters>", "".join([getters_and_setters.replace("<name>", p.name).replace("<type>", p.type_.__name__) for p in parameters]))
+        .replace("<index_list>", ", ".join([f'"{p.name}": "{p.index}"' for p in parameters if p.index])) \
+        .replace("<slot_list>", ", ".join([f'"{SLOT_PREFIX}{p.name}"' for p in parameters]) + ("," if len(parameters) == 1 else "")) \
+        .replace("<slot_init>", " = ".join([f"self.{SLOT_PREFIX}{p.name}" for p in parameters] + ["NOT_LOADED"]) if parameters else "pass") \
+        .replace("<codec_fields>", ", ".join([f'("{p.name}", {p.type_.__name__})' for p in parameters])) \
+        .replace("<class_name>", class_name) \
+        .replace("<getters_and_setters>", "".join([
+            (getters_and_setters + (index_queries[p.index] if p.index else "")).replace("<name>", p.name).replace("<type>", p.type_.__name__).replace("<class_name>", class_name)
+            for p in parameters
+        ]))
@@ -0,0 +1,79 @@
+from typing import Generic, TypeVar, Type, List, Set, Tuple, Iterator, Optional, Union, overload
+import zlib
+
+from core.components.node import Node, NodeCache
+from core.components.manifest import InstanceManifest, get_manifest
+from core.globals import INSTANCES_DIRNAME
+
+T = TypeVar('T', bound=Node)
+
+class NodeCollection(Generic[T]):
+    # Lazy view over the instances of one struct, backed by the struct's instance manifest.
+    # Node objects are created on access. Iterating visits the nodes that existed when the loop started, then the
+    # nodes created while visiting those, once: nodes created during that second pass are left for the next loop,
+    # so "for n in nodes: Node.create(...)" over the same struct ends.
+    __cls: Type[T]
+    __instance_dirpath: str
+    __node_cache: NodeCache
+    __manifest: InstanceManifest
+    __struct_dirpath: str
+    __shard: Optional[Tuple[int, int]]   # (index, count), only ids that hash into this shard are visible
+
+    def __init__(self, cls: Type[T], struct_dirpath: str, node_cache: NodeCache, shard: Optional[Tuple[int, int]]=None):
+        self.__cls = cls
+        self.__struct_dirpath = struct_dirpath
+        self.__instance_dirpath = f"{struct_dirpath}/{INSTANCES_DIRNAME}"
+        self.__node_cache = node_cache
+        self.__manifest = get_manifest(struct_dirpath, node_cache.storage)
+        self.__shard = shard
+
+    def shard(self, index: int, count: int) -> 'NodeCollection[T]':
+        # ids are split by hash, so a node stays in the same shard no matter what else is created or deleted
+        if count < 1 or not 0 <= index < count:
+            raise ValueError(f"Invalid shard {index} of {count}")
+        return NodeCollection(self.__cls, self.__struct_dirpath, self.__node_cache, (index, count))
+
+    def __in_shard(self, node_id: str) -> bool:
+        return self.__shard is None or zlib.crc32(node_id.encode()) % self.__shard[1] == self.__shard[0]
+
+    def __ids(self) -> List[str]:
+        ids = self.__manifest.ids()
+        return ids if self.__shard is None else [i for i in ids if self.__in_shard(i)]
+
+    def __make(self, node_id: str) -> T:
+        return self.__cls(f"{self.__instance_dirpath}/{node_id}.json", self.__node_cache)
+
+    def __len__(self) -> int:
+        # constant time for the whole struct, a shard has to filter the ids
+        return self.__manifest.count() if self.__shard is None else len(self.__ids())
+
+    def __iter__(self) -> Iterator[T]:
+        # walks a snapshot of the ids, then one rescan for anything created meanwhile, see the class comment
+        snapshot = self.__ids()
+        for node_id in snapshot:
+            yield self.__make(node_id)
+        seen: Set[str] = set(snapshot)
+        for node_id in [i for i in self.__ids() if i not in seen]:
+            yield self.__make(node_id)
+
+    @overload
+    def __getitem__(self, index: int) -> T: ...
+    @overload
+    def __getitem__(self, index: slice) -> List[T]: ...
+    def __getitem__(self, index: Union[int, slice]) -> Union[T, List[T]]:
+        if isinstance(index, slice):
+            return [self.__make(node_id) for node_id in self.__ids()[index]]
+        if self.__shard is not None:
+            return self.__make(self.__ids()[index])
+        return self.__make(self.__manifest.id_at(index))
+
+    def ids(self) -> List[str]:
+        return self.__ids()
+
+    def page(self, page_index: int, page_size: int) -> List[T]:
+        if page_size < 1:
+            raise ValueError(f"page_size must be >= 1, got {page_size}")
+        return self[page_index * page_size:(page_index + 1) * page_size]
+
+    def page_count(self, page_size: int) -> int:
+        return (len(self) + page_size - 1) // page_size
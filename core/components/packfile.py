@@ -0,0 +1,256 @@
+from typing import Dict, List, Set, Tuple, Optional, Iterator
+import threading
+import hashlib
+import struct
+import mmap
+import zlib
+import time
+import sys
+import os
+
+from core.components.shards import scan_instances
+from core.logger import info, debug
+from core.globals import INSTANCES_DIRNAME, PACK_FILENAME, PACK_RECHECK_INTERVAL
+
+# Packs a struct's loose instance files into one read-only file, modeled on a git pack with its .idx appended:
+#   header   MAGIC
+#   records  the json text of every node, back to back in creation order
+#   fanout   256 x u32, number of ids whose bucket is <= i
+#   entries  count x (id padded to ID_SIZE bytes, u64 offset, u32 length), sorted by bucket then id
+#   footer   u64 fanout offset, u32 count, sha256 of everything before the footer, END_MAGIC
+# git buckets by the first byte of a binary sha, our ids are hex text so the bucket is the low byte of their crc32.
+# Keeping the index in the same file means a repack swaps records and index in one os.replace.
+# Loose files shadow packed records, and a deleted packed node leaves a <id>.deleted tombstone until the next repack.
+#   python -m core.components.packfile repack <world_dirpath> [--struct NAME ...]
+
+MAGIC = b"WCPACK01"
+END_MAGIC = b"WCPACKND"
+ID_SIZE = 32        # uuid4 hex ids, longer ids are never packed and stay loose
+ENTRY = struct.Struct(f"<{ID_SIZE}sQI")
+FANOUT = struct.Struct("<256I")
+FOOTER = struct.Struct("<QI32s8s")
+TOMBSTONE_SUFFIX = ".deleted"
+
+def bucket(key: bytes) -> int:
+    return zlib.crc32(key) & 0xff
+
+def pack_filepath(struct_dirpath: str) -> str:
+    return f"{struct_dirpath}/{PACK_FILENAME}"
+
+def tombstone_filepath(struct_dirpath: str, node_id: str) -> str:
+    return f"{struct_dirpath}/{INSTANCES_DIRNAME}/{node_id}{TOMBSTONE_SUFFIX}"
+
+class PackFile:
+    # read side, every lookup is a binary search over the mapped index, records are sliced out of the mapping
+    filepath: str
+    stamp: Tuple[int, int, int]
+    count: int
+    tombstones: Set[str]        # packed ids deleted since the pack was written
+    __file: object
+    __map: mmap.mmap
+    __fanout: Tuple[int, ...]
+    __entries_offset: int
+
+    def __init__(self, filepath: str):
+        self.filepath = filepath
+        self.tombstones = set()
+        self.__file = open(filepath, "rb")
+        try:
+            stat = os.fstat(self.__file.fileno()) # type: ignore
+            self.stamp = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+            self.__map = mmap.mmap(self.__file.fileno(), 0, access=mmap.ACCESS_READ) # type: ignore
+            if self.__map[:len(MAGIC)] != MAGIC or self.__map[-len(END_MAGIC):] != END_MAGIC:
+                raise ValueError(f"{filepath} is not a pack file")
+            fanout_offset, self.count, _, _ = FOOTER.unpack_from(self.__map, len(self.__map) - FOOTER.size)
+            self.__fanout = FANOUT.unpack_from(self.__map, fanout_offset)
+            self.__entries_offset = fanout_offset + FANOUT.size
+        except Exception:
+            self.__file.close() # type: ignore
+            raise
+
+    def __entry(self, position: int) -> Tuple[bytes, int, int]:
+        return ENTRY.unpack_from(self.__map, self.__entries_offset + position * ENTRY.size)
+
+    def find(self, node_id: str) -> Optional[Tuple[int, int]]:
+        # (offset, length) of the node's record, None when it is not packed
+        key = node_id.encode()
+        if not key or len(key) > ID_SIZE:
+            return None
+        key = key.ljust(ID_SIZE, b"\0")
+        index = bucket(key)
+        low = self.__fanout[index - 1] if index > 0 else 0
+        high = self.__fanout[index]
+        mapped, base, size = self.__map, self.__entries_offset, ENTRY.size
+        while low < high:
+            middle = (low + high) // 2
+            position = base + middle * size
+            entry_id = mapped[position:position + ID_SIZE]
+            if entry_id < key:
+                low = middle + 1
+            elif entry_id > key:
+                high = middle
+            else:
+                _, offset, length = ENTRY.unpack_from(mapped, position)
+                return offset, length
+        return None
+
+    def record(self, offset: int, length: int) -> bytes:
+        return self.__map[offset:offset + length]
+
+    def read(self, node_id: str) -> Optional[bytes]:
+        found = self.find(node_id)
+        return None if found is None else self.record(*found)
+
+    def entries(self) -> List[Tuple[str, int, int]]:
+        # (id, offset, length) in creation order, which is also the order records sit in the file
+        entries = [self.__entry(i) for i in range(self.count)]
+        entries.sort(key=lambda e: e[1])
+        return [(e[0].rstrip(b"\0").decode(), e[1], e[2]) for e in entries]
+
+    def ids(self) -> List[str]:
+        return [node_id for node_id, _, _ in self.entries()]
+
+    def scan(self) -> Iterator[Tuple[str, bytes]]:
+        # sequential read of every record, the mapping lets the OS read ahead
+        for node_id, offset, length in self.entries():
+            yield node_id, self.__map[offset:offset + length]
+
+    def verify(self) -> bool:
+        _, _, digest, _ = FOOTER.unpack_from(self.__map, len(self.__map) - FOOTER.size)
+        return hashlib.sha256(self.__map[:len(self.__map) - FOOTER.size]).digest() == digest
+
+    def close(self) -> None:
+        self.__map.close()
+        self.__file.close() # type: ignore
+
+def write_pack(filepath: str, records: List[Tuple[str, bytes]]) -> int:
+    # records in creation order, returns the number of records written
+    tmp_filepath = f"{filepath}.{os.getpid()}.tmp"
+    digest = hashlib.sha256()
+    entries: List[Tuple[bytes, int, int]] = []
+    with open(tmp_filepath, "wb") as f:
+        def _write(chunk: bytes) -> None:
+            digest.update(chunk)
+            f.write(chunk)
+        _write(MAGIC)
+        offset = len(MAGIC)
+        for node_id, data in records:
+            entries.append((node_id.encode().ljust(ID_SIZE, b"\0"), offset, len(data)))
+            _write(data)
+            offset += len(data)
+        entries.sort(key=lambda e: (bucket(e[0]), e[0]))
+        fanout = [0] * 256
+        for entry_id, _, _ in entries:
+            fanout[bucket(entry_id)] += 1
+        for i in range(1, 256):
+            fanout[i] += fanout[i - 1]
+        _write(FANOUT.pack(*fanout))
+        _write(b"".join(ENTRY.pack(*e) for e in entries))
+        f.write(FOOTER.pack(offset, len(entries), digest.digest(), END_MAGIC))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_filepath, filepath)
+    return len(entries)
+
+def scan_tombstones(struct_dirpath: str) -> Set[str]:
+    with os.scandir(f"{struct_dirpath}/{INSTANCES_DIRNAME}") as entries:
+        return { e.name[:-len(TOMBSTONE_SUFFIX)] for e in entries if e.name.endswith(TOMBSTONE_SUFFIX) }
+
+open_packs: Dict[str, Tuple[float, Optional[PackFile]]] = {}     # struct dirpath -> (checked at, pack)
+open_packs_lock = threading.Lock()
+
+def get_pack(struct_dirpath: str, recheck: bool=False) -> Optional[PackFile]:
+    # Node reads and writes ask for the pack every time, so whether it exists, was replaced by a repack or
+    # gained tombstones from another process is only checked every PACK_RECHECK_INTERVAL seconds
+    now = time.monotonic()
+    cached = open_packs.get(struct_dirpath)
+    if cached is not None and not recheck and now - cached[0] < PACK_RECHECK_INTERVAL:
+        return cached[1]
+    with open_packs_lock:
+        pack = cached[1] if cached else None
+        try:
+            stat = os.stat(pack_filepath(struct_dirpath))
+        except FileNotFoundError:
+            open_packs[struct_dirpath] = (now, None)
+            return None
+        if pack is None or pack.stamp != (stat.st_ino, stat.st_mtime_ns, stat.st_size):
+            # the old mapping is left to the garbage collector, a reader on another thread may still be slicing it
+            pack = PackFile(pack_filepath(struct_dirpath))
+        pack.tombstones = scan_tombstones(struct_dirpath)
+        open_packs[struct_dirpath] = (now, pack)
+        return pack
+
+def forget_pack(struct_dirpath: str) -> None:
+    with open_packs_lock:
+        open_packs.pop(struct_dirpath, None)
+
+def repack(struct_dirpath: str) -> int:
+    # folds loose files and tombstones into a new pack, must not run while a generator writes to the struct
+    forget_pack(struct_dirpath)
+    pack = get_pack(struct_dirpath)
+    loose: Dict[str, Tuple[str, int]] = {}       # id -> (filepath, mtime), loose files may sit in shard directories
+    tombstones: List[str] = []
+    unpackable = 0
+    for entry in scan_instances(struct_dirpath):
+        if entry.name.endswith(".json"):
+            node_id = entry.name[:-len(".json")]
+            if len(node_id.encode()) > ID_SIZE:
+                unpackable += 1
+                continue
+            loose[node_id] = (entry.path, entry.stat().st_mtime_ns)
+        elif entry.name.endswith(TOMBSTONE_SUFFIX):
+            tombstones.append(entry.name[:-len(TOMBSTONE_SUFFIX)])
+
+    deleted = set(tombstones)
+    order = [i for i in (pack.ids() if pack else []) if i not in deleted]
+    packed = set(order)
+    order += sorted((i for i in loose if i not in packed and i not in deleted), key=lambda i: loose[i][1])
+    records: List[Tuple[str, bytes]] = []
+    for node_id in order:
+        if node_id in loose:
+            with open(loose[node_id][0], "rb") as f:
+                records.append((node_id, f.read()))
+        else:
+            records.append((node_id, pack.read(node_id))) # type: ignore
+    count = write_pack(pack_filepath(struct_dirpath), records)
+
+    # the new pack holds everything now, loose copies and tombstones can go
+    for filepath, _ in loose.values():
+        os.remove(filepath)
+    for node_id in tombstones:
+        os.remove(tombstone_filepath(struct_dirpath, node_id))
+    forget_pack(struct_dirpath)
+    debug(f"Repacked {struct_dirpath}, {count} nodes, {len(loose)} loose files and {len(tombstones)} tombstones folded in")
+    if unpackable:
+        info(f"Left {unpackable} nodes of {struct_dirpath} loose, their ids are longer than {ID_SIZE} bytes")
+    return count
+
+def main() -> int:
+    import argparse
+    from core.components.world import load_world
+    from core.components.journal import open_journal
+    from core.globals import STORAGE_MODE_JOURNAL, STORAGE_MODE_SQLITE
+
+    parser = argparse.ArgumentParser(description="Pack the loose instance files of a world's structs into pack files")
+    parser.add_argument("command", choices=["repack"])
+    parser.add_argument("world_dirpath")
+    parser.add_argument("--struct", nargs="+", metavar="NAME", help="only repack these structs")
+    args = parser.parse_args()
+
+    world = load_world(args.world_dirpath)
+    if not world:
+        return 1
+    if world.storage_mode == STORAGE_MODE_SQLITE:
+        print(f"{args.world_dirpath} uses sqlite storage, pack files only apply to the files and journal modes", file=sys.stderr)
+        return 1
+    if world.storage_mode == STORAGE_MODE_JOURNAL:
+        # nodes still in the journal have to reach their files before they can be packed
+        open_journal(args.world_dirpath).close()
+    for struct_dirpath in world.struct_paths:
+        if args.struct and os.path.basename(struct_dirpath) not in args.struct:
+            continue
+        print(f"{os.path.basename(struct_dirpath)}: packed {repack(struct_dirpath)} nodes")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,199 @@
+from typing import Optional, Callable, Tuple, List, Dict, Any
+import multiprocessing
+import inspect
+import threading
+import queue
+
+from core.components.world import World, load_world
+from core.components.node import NodeCache
+from core.components.index import forget_indexes
+from core.components.storage import open_storage
+from core.components.metrics import RunMetrics
+from core.components.profiler import RunProfiler
+from core.components.executor import prepare_generator, _begin_run, _end_run, _run_generator
+from core.logger import warning, error, critical
+from core.globals import NODE_CACHE_MAX_ENTRIES, NODE_CACHE_MAX_BYTES
+
+WORKER_THREAD = "thread"        # for I/O and LLM bound generators, workers share the node cache
+WORKER_PROCESS = "process"      # for CPU bound generators, every worker loads the world on its own
+WORKER_TYPES = [WORKER_THREAD, WORKER_PROCESS]
+
+class ProgressAggregator:
+    # combines the progress of every worker into the single float the GUI expects
+    __progress: List[float]
+    __lock: threading.Lock
+
+    def __init__(self, worker_count: int, on_update: Optional[Callable[[float], None]]):
+        self.__progress = [0.0] * worker_count
+        self.__lock = threading.Lock()
+        self.on_update = on_update
+
+    def update(self, worker_index: int, value: float) -> None:
+        with self.__lock:
+            self.__progress[worker_index] = value
+            total = -1 if any(p == -1 for p in self.__progress) else sum(self.__progress) / len(self.__progress)
+        if self.on_update:
+            self.on_update(total)
+
+    def finish(self, worker_index: int) -> None:
+        self.update(worker_index, 1)
+
+def _shard_generator(prepared, index: int, count: int):
+    gen_module, node_args, create_args = prepared
+    if inspect.isasyncgenfunction(gen_module.generate):
+        raise ValueError(error("Async generators run their copies through create_executor's concurrency, not through parallel workers"))
+    create_args = { **create_args, 'shard': (index, count) }
+    sharded = { k: v.shard(index, count) for k, v in node_args.items() }
+    return gen_module.generate(create_args, **sharded) # type: ignore
+
+def _thread_worker(
+    generator_call, max_count: int, node_cache: NodeCache, exit_event: threading.Event, index: int, progress: ProgressAggregator,
+    metrics: Optional[RunMetrics], profiler: Optional[RunProfiler]
+):
+    try:
+        _run_generator(generator_call, max_count, node_cache, exit_event, lambda v: progress.update(index, v), metrics, profiler)
+    except Exception as ex:
+        error(f"Exception occured in executor worker {index} -> {ex}")
+        exit_event.set()
+    progress.finish(index)
+
+def _process_worker(world_dirpath: str, generator_name: str, max_count: int, index: int, count: int, exit_event: Any, progress_queue: Any):
+    # runs in a child process, only plain values cross the process boundary
+    node_stats: Dict[str, Any] = {}
+    try:
+        world = load_world(world_dirpath)
+        if not world:
+            progress_queue.put((index, "error", f"Failed to load world {world_dirpath}"))
+            return
+        node_cache = NodeCache(NODE_CACHE_MAX_ENTRIES, NODE_CACHE_MAX_BYTES)
+        prepared = prepare_generator(world, generator_name, node_cache)
+        if not prepared:
+            progress_queue.put((index, "error", f"Failed to prepare generator {generator_name}"))
+            return
+        generator_call = _shard_generator(prepared, index, count)
+        # step latencies ride along with the progress updates, node counters are sent once at the end
+        metrics = RunMetrics(generator_name)
+        _begin_run(node_cache, metrics)
+        sent = 0
+        def _on_update(value: float) -> None:
+            nonlocal sent
+            sent += 1
+            progress_queue.put((index, "progress", (value, metrics.last_step)))
+        try:
+            _run_generator(generator_call, max_count, node_cache, exit_event, _on_update, metrics)
+            if metrics.yields > sent:
+                # the yield that ended the generator has no progress update, its step still counts
+                progress_queue.put((index, "step", metrics.last_step))
+        finally:
+            # indexes changed here are left marked unclean on disk, the parent rebuilds them on next use
+            _end_run(node_cache, persist=False, metrics=metrics)
+            # paths go along so the parent counts a node written by several workers once
+            written, created = metrics.node_paths()
+            node_stats = { **node_cache.stats(), 'written_paths': sorted(written), 'created_paths': sorted(created) }
+    except Exception as ex:
+        progress_queue.put((index, "error", f"Exception occured in executor worker {index} -> {ex}"))
+    finally:
+        progress_queue.put((index, "done", node_stats))
+
+def _run_threads(world: World, generator_name: str, execute_count: int, worker_count: int, node_cache: NodeCache, exit_event: threading.Event, progress: ProgressAggregator, metrics: Optional[RunMetrics], profiler: Optional[RunProfiler]) -> None:
+    prepared = prepare_generator(world, generator_name, node_cache)
+    if not prepared:
+        return
+    try:
+        generator_calls = [_shard_generator(prepared, index, worker_count) for index in range(worker_count)]
+    except ValueError:
+        return
+
+    _begin_run(node_cache, metrics)
+    try:
+        workers = [threading.Thread(target=_thread_worker, args=(g, execute_count, node_cache, exit_event, i, progress, metrics, profiler)) for i, g in enumerate(generator_calls)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+    finally:
+        _end_run(node_cache, metrics=metrics)
+
+def _run_processes(world: World, generator_name: str, execute_count: int, worker_count: int, node_cache: NodeCache, exit_event: threading.Event, progress: ProgressAggregator, metrics: Optional[RunMetrics], profiler: Optional[RunProfiler]) -> None:
+    # spawn keeps the parent's threads, locks and Tk state out of the children, but they import the parent's
+    # __main__ again, so main.py and headless.py only start their app behind a __name__ == "__main__" guard
+    context = multiprocessing.get_context("spawn")
+    process_exit = context.Event()
+    progress_queue = context.Queue()
+    # anything the parent still holds must be on disk before the children read it
+    node_cache.flush()
+    node_cache.clear()
+    if metrics:
+        metrics.start(node_cache)
+    processes = [
+        context.Process(target=_process_worker, args=(world.dirpath, generator_name, execute_count, i, worker_count, process_exit, progress_queue), daemon=True)
+        for i in range(worker_count)
+    ]
+    for process in processes:
+        process.start()
+
+    running = worker_count
+    while running > 0:
+        if exit_event.is_set():
+            process_exit.set()
+        try:
+            index, kind, value = progress_queue.get(timeout=0.1)
+        except queue.Empty:
+            if not any(p.is_alive() for p in processes):
+                break
+            continue
+        if kind == "progress":
+            value, latency = value
+            if metrics and latency is not None:
+                metrics.step(latency)
+            progress.update(index, value)
+        elif kind == "step":
+            if metrics and value is not None:
+                metrics.step(value)
+        elif kind == "error":
+            error(value)
+            process_exit.set()
+        elif kind == "done":
+            if metrics and value:
+                metrics.add_worker_counters(value)
+            progress.finish(index)
+            running -= 1
+    for process in processes:
+        process.join()
+    if metrics:
+        metrics.finish()
+    forget_indexes()
+
+def create_parallel_executor(
+    execute_count: int, world: World, generator_name: str, node_cache: NodeCache, worker_count: int, worker_type: str=WORKER_THREAD,
+    on_update: Optional[Callable[[float], None]]=None, on_end: Optional[Callable[[], None]]=None,
+    metrics: Optional[RunMetrics]=None, profiler: Optional[RunProfiler]=None
+) -> Tuple[Optional[threading.Thread], Optional[threading.Event]]:
+    # Runs worker_count copies of the generator, each one only sees its own shard of every input struct.
+    # execute_count applies to every worker, and parallel runs always start fresh generators (no module cache).
+    if worker_count < 1:
+        error(f"Worker count must be >= 1, got {worker_count}")
+        return None, None
+    if worker_type not in WORKER_TYPES:
+        critical(f"Got unsupported worker type '{worker_type}', expected one of {WORKER_TYPES}")
+        return None, None
+    if worker_type == WORKER_PROCESS and not open_storage(world.dirpath, world.storage_mode, world.journal_fsync_interval, world.node_encoding).process_safe:
+        error(f"Process workers can not share {world.storage_mode} storage, use thread workers or the files storage mode")
+        return None, None
+    if worker_type == WORKER_PROCESS and profiler:
+        warning("Profiling only covers thread workers, running the process workers without it")
+        profiler = None
+
+    exit_event = threading.Event()
+    progress = ProgressAggregator(worker_count, on_update)
+    run = _run_threads if worker_type == WORKER_THREAD else _run_processes
+
+    def _coordinator():
+        try:
+            run(world, generator_name, execute_count, worker_count, node_cache, exit_event, progress, metrics, profiler)
+        except Exception as ex:
+            error(f"Exception occured running parallel executor -> {ex}")
+        if on_end:
+            on_end()
+
+    return threading.Thread(target=_coordinator), exit_event
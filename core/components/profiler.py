@@ -0,0 +1,249 @@
+from typing import Dict, List, Tuple, Optional, Any
+from abc import ABC, abstractmethod
+from types import FrameType
+import threading
+import datetime
+import cProfile
+import pstats
+import json
+import time
+import sys
+import os
+
+from core.logger import info, warning
+from core.globals import USERCODE_DIRNAME
+
+PROFILE_OFF = "off"
+PROFILE_DETERMINISTIC = "deterministic"     # cProfile, exact call counts, slows the generator down noticeably
+PROFILE_SAMPLING = "sampling"               # periodic stack samples, low overhead, statistical
+PROFILE_MODES = [PROFILE_OFF, PROFILE_DETERMINISTIC, PROFILE_SAMPLING]
+
+# where time goes, a frame counts towards the first category found walking from the innermost frame outwards
+CATEGORY_JSON = "json"
+CATEGORY_NODE = "node_storage"
+CATEGORY_USERCODE = "usercode"
+CATEGORY_OTHER = "other"
+CATEGORIES = [CATEGORY_USERCODE, CATEGORY_NODE, CATEGORY_JSON, CATEGORY_OTHER]
+
+NODE_STORAGE_FILES = ["node.py", "node_collection.py", "storage.py", "codec.py", "journal.py", "manifest.py", "index.py"]
+COMPONENTS_DIRPATH = os.path.dirname(os.path.abspath(__file__))
+JSON_DIRPATH = os.path.dirname(json.__file__)
+
+def classify(filename: str, funcname: str="") -> Optional[str]:
+    if filename.startswith(JSON_DIRPATH) or "_json" in funcname:
+        return CATEGORY_JSON
+    if os.path.dirname(filename) == COMPONENTS_DIRPATH and os.path.basename(filename) in NODE_STORAGE_FILES:
+        return CATEGORY_NODE
+    if f"{os.sep}{USERCODE_DIRNAME}{os.sep}" in filename:
+        return CATEGORY_USERCODE
+    return None
+
+class RunProfiler(ABC):
+    # Profiles the threads that run generator steps. Executors call attach() on the thread running the
+    # generator, mark_step() whenever a new step starts on it, and detach() when the thread is done.
+    mode: str
+    generator_name: str
+    __step_times: Dict[int, float]          # wall time per step, summed over threads
+    __current: Dict[int, Tuple[int, float]] # thread ident -> (step, started at)
+    _lock: threading.RLock
+
+    def __init__(self, generator_name: str):
+        self.generator_name = generator_name
+        self.__step_times = {}
+        self.__current = {}
+        self._lock = threading.RLock()
+
+    def attach(self) -> None:
+        self.mark_step(0)
+
+    def mark_step(self, step: int) -> None:
+        now = time.perf_counter()
+        ident = threading.get_ident()
+        with self._lock:
+            self.__close_step(ident, now)
+            self.__current[ident] = (step, now)
+
+    def detach(self) -> None:
+        with self._lock:
+            self.__close_step(threading.get_ident(), time.perf_counter())
+            self.__current.pop(threading.get_ident(), None)
+
+    def __close_step(self, ident: int, now: float) -> None:
+        if ident in self.__current:
+            step, started = self.__current[ident]
+            self.__step_times[step] = self.__step_times.get(step, 0.0) + now - started
+
+    def current_step(self, ident: int) -> Optional[int]:
+        current = self.__current.get(ident)
+        return current[0] if current else None
+
+    def _summary(self) -> Dict[str, Any]:
+        return { 'mode': self.mode, 'generator': self.generator_name, 'step_times': { str(k): v for k, v in sorted(self.__step_times.items()) } }
+
+    def _prefix(self, log_dirpath: str) -> str:
+        os.makedirs(log_dirpath, exist_ok=True)
+        return os.path.join(log_dirpath, datetime.datetime.now().strftime(f"%Y-%m-%d_%H-%M-%S_profile_{self.generator_name}"))
+
+    def _write_summary(self, filepath: str, summary: Dict[str, Any]) -> None:
+        with open(filepath, "w") as f:
+            json.dump(summary, f, indent=2)
+
+    @abstractmethod
+    def save(self, log_dirpath: str) -> List[str]:
+        pass
+
+class DeterministicProfiler(RunProfiler):
+    mode = PROFILE_DETERMINISTIC
+    __profiles: Dict[int, cProfile.Profile]
+
+    def __init__(self, generator_name: str):
+        super().__init__(generator_name)
+        self.__profiles = {}
+
+    def attach(self) -> None:
+        # cProfile only sees the thread it was enabled on, so every worker thread gets its own
+        profile = cProfile.Profile()
+        with self._lock:
+            self.__profiles[threading.get_ident()] = profile
+        super().attach()
+        profile.enable()
+
+    def detach(self) -> None:
+        profile = self.__profiles.get(threading.get_ident())
+        if profile:
+            profile.disable()
+        super().detach()
+
+    def stats(self) -> Optional[pstats.Stats]:
+        with self._lock:
+            profiles = [p for p in self.__profiles.values() if p.getstats()]
+        if not profiles:
+            return None
+        stats = pstats.Stats(profiles[0])
+        for profile in profiles[1:]:
+            stats.add(profile)
+        return stats
+
+    def categories(self, stats: pstats.Stats) -> Dict[str, float]:
+        # own time of every function, functions outside the known categories (builtins, stdlib)
+        # count towards whichever category their most expensive caller chain leads to
+        entries: Dict = stats.stats # type: ignore
+        resolved: Dict[Tuple, str] = {}
+
+        def _resolve(func: Tuple, depth: int) -> str:
+            if func in resolved:
+                return resolved[func]
+            category = classify(func[0], func[2])
+            if category is None and depth < 16 and func in entries:
+                callers = entries[func][4]
+                if callers:
+                    top_caller = max(callers, key=lambda c: callers[c][3])
+                    category = _resolve(top_caller, depth + 1)
+            resolved[func] = category or CATEGORY_OTHER
+            return resolved[func]
+
+        totals = { c: 0.0 for c in CATEGORIES }
+        for func, (_, _, tottime, _, _) in entries.items():
+            totals[_resolve(func, 0)] += tottime
+        return totals
+
+    def save(self, log_dirpath: str) -> List[str]:
+        stats = self.stats()
+        if not stats:
+            warning("Profiler collected nothing, no generator steps ran")
+            return []
+        prefix = self._prefix(log_dirpath)
+        stats.dump_stats(f"{prefix}.pstats")
+        summary = { **self._summary(), 'seconds_by_category': self.categories(stats) }
+        self._write_summary(f"{prefix}.json", summary)
+        info(f"Wrote deterministic profile to {prefix}.pstats, view it with 'python -m pstats {prefix}.pstats' or snakeviz")
+        return [f"{prefix}.pstats", f"{prefix}.json"]
+
+class SamplingProfiler(RunProfiler):
+    # A background thread samples the stacks of attached threads every interval seconds.
+    # Collapsed stacks are rooted at "step_<n>", so a flamegraph shows the cost of each step side by side.
+    # Samples can only be taken when the GIL is released, long C calls (e.g. the C json encoder) are under-counted.
+    mode = PROFILE_SAMPLING
+    interval: float
+    samples: int
+    __stacks: Dict[str, int]
+    __categories: Dict[str, int]
+    __step_categories: Dict[int, Dict[str, int]]
+    __sampler: Optional[threading.Thread]
+    __stop: threading.Event
+
+    def __init__(self, generator_name: str, interval: float=0.005):
+        super().__init__(generator_name)
+        self.interval = interval
+        self.samples = 0
+        self.__stacks = {}
+        self.__categories = { c: 0 for c in CATEGORIES }
+        self.__step_categories = {}
+        self.__sampler = None
+        self.__stop = threading.Event()
+
+    def attach(self) -> None:
+        super().attach()
+        with self._lock:
+            if self.__sampler is None:
+                self.__stop.clear()
+                self.__sampler = threading.Thread(target=self.__sample_loop, daemon=True)
+                self.__sampler.start()
+
+    def __sample_loop(self) -> None:
+        while not self.__stop.wait(self.interval):
+            frames = sys._current_frames()
+            with self._lock:
+                for ident, frame in frames.items():
+                    step = self.current_step(ident)
+                    if step is not None:
+                        self.__record(step, frame)
+
+    def __record(self, step: int, frame: Optional[FrameType]) -> None:
+        names: List[str] = []
+        category: Optional[str] = None
+        while frame is not None:
+            code = frame.f_code
+            if category is None:
+                category = classify(code.co_filename, code.co_name)
+            names.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+            frame = frame.f_back
+        category = category or CATEGORY_OTHER
+        stack = ";".join([f"step_{step}", *reversed(names)])
+        self.__stacks[stack] = self.__stacks.get(stack, 0) + 1
+        self.__categories[category] += 1
+        step_categories = self.__step_categories.setdefault(step, { c: 0 for c in CATEGORIES })
+        step_categories[category] += 1
+        self.samples += 1
+
+    def save(self, log_dirpath: str) -> List[str]:
+        self.__stop.set()
+        if self.__sampler:
+            self.__sampler.join()
+        with self._lock:
+            stacks = dict(self.__stacks)
+            summary = {
+                **self._summary(),
+                'interval': self.interval, 'samples': self.samples,
+                'seconds_by_category': { c: n * self.interval for c, n in self.__categories.items() },
+                'samples_by_step': { str(k): v for k, v in sorted(self.__step_categories.items()) },
+            }
+        if not stacks:
+            warning("Profiler collected no samples, the run was shorter than the sampling interval")
+            return []
+        prefix = self._prefix(log_dirpath)
+        with open(f"{prefix}.collapsed", "w") as f:
+            for stack, count in sorted(stacks.items()):
+                f.write(f"{stack} {count}\n")
+        self._write_summary(f"{prefix}.json", summary)
+        info(f"Wrote sampling profile to {prefix}.collapsed, view it with flamegraph.pl or speedscope")
+        return [f"{prefix}.collapsed", f"{prefix}.json"]
+
+def create_profiler(mode: str, generator_name: str) -> Optional[RunProfiler]:
+    if mode == PROFILE_OFF:
+        return None
+    if mode == PROFILE_DETERMINISTIC:
+        return DeterministicProfiler(generator_name)
+    if mode == PROFILE_SAMPLING:
+        return SamplingProfiler(generator_name)
+    raise ValueError(f"Unknown profile mode '{mode}', expected one of {PROFILE_MODES}")
@@ -0,0 +1,186 @@
+from typing import Dict, List, Tuple, Optional, Iterator
+import threading
+import json
+import time
+import sys
+import os
+
+from core.utils import write_atomic
+from core.logger import error, debug
+from core.globals import INSTANCES_DIRNAME, STRUCT_SETTINGS_FILENAME, SHARD_WIDTH, MAX_SHARD_DEPTH, SHARD_RECHECK_INTERVAL
+
+# Structs with many instances can spread their files over hash-prefix directories, chosen by "shard_depth" in
+# struct.json: with depth 2, <id>.json lives in instances/<id[0:2]>/<id[2:4]>/. ids are uuid4 hex, so every
+# directory gets about the same number of files. Node paths keep the flat instances/<id>.json form everywhere,
+# only FileStorage and packing map them to where the file actually is.
+# Changing the depth moves files, which reshard() does while generators keep running:
+#   python -m core.components.shards reshard <world_dirpath> --depth N [--struct NAME ...]
+# During a reshard "reshard_from" holds the old depth and lookups try both layouts.
+
+SHARD_SETTINGS = ["shard_depth", "reshard_from"]     # owned by this module, Struct.save keeps what is on disk
+
+Layout = Tuple[int, Optional[int]]      # (depth, depth files are moving away from during a reshard)
+
+def settings_filepath(struct_dirpath: str) -> str:
+    return f"{struct_dirpath}/{STRUCT_SETTINGS_FILENAME}"
+
+def shard_dirpath(struct_dirpath: str, node_id: str, depth: int) -> str:
+    # ids too short to fill every level stay in instances/ itself
+    dirpath = f"{struct_dirpath}/{INSTANCES_DIRNAME}"
+    if len(node_id) <= depth * SHARD_WIDTH:
+        return dirpath
+    for level in range(depth):
+        dirpath += "/" + node_id[level * SHARD_WIDTH:(level + 1) * SHARD_WIDTH]
+    return dirpath
+
+def shard_path(struct_dirpath: str, node_id: str, depth: int) -> str:
+    return f"{shard_dirpath(struct_dirpath, node_id, depth)}/{node_id}.json"
+
+def read_shard_settings(struct_dirpath: str) -> Dict[str, int]:
+    try:
+        with open(settings_filepath(struct_dirpath)) as f:
+            data = json.load(f)
+    except FileNotFoundError:
+        return {}
+    return { k: data[k] for k in SHARD_SETTINGS if data.get(k) is not None }
+
+def read_layout(struct_dirpath: str) -> Layout:
+    settings = read_shard_settings(struct_dirpath)
+    depth, previous = settings.get("shard_depth", 0), settings.get("reshard_from")
+    for value in (depth, previous):
+        if value is not None and (type(value) is not int or not 0 <= value <= MAX_SHARD_DEPTH):
+            raise ValueError(error(f"Shard depths in {settings_filepath(struct_dirpath)} must be between 0 and {MAX_SHARD_DEPTH}, got {value}"))
+    return depth, previous
+
+layouts: Dict[str, Tuple[float, int, Layout]] = {}     # struct dirpath -> (checked at, struct.json mtime, layout)
+layouts_lock = threading.Lock()
+
+def get_layout(struct_dirpath: str) -> Layout:
+    # every node read and write asks, so struct.json is only checked every SHARD_RECHECK_INTERVAL seconds
+    now = time.monotonic()
+    cached = layouts.get(struct_dirpath)
+    if cached is not None and now - cached[0] < SHARD_RECHECK_INTERVAL:
+        return cached[2]
+    with layouts_lock:
+        try:
+            stamp = os.stat(settings_filepath(struct_dirpath)).st_mtime_ns
+        except FileNotFoundError:
+            stamp = 0
+        layout = cached[2] if cached is not None and cached[1] == stamp else read_layout(struct_dirpath)
+        layouts[struct_dirpath] = (now, stamp, layout)
+        return layout
+
+def forget_layout(struct_dirpath: str) -> None:
+    with layouts_lock:
+        layouts.pop(struct_dirpath, None)
+
+def scan_instances(struct_dirpath: str) -> Iterator[os.DirEntry]:
+    # every file below instances/, whatever layout put it there
+    def _scan(dirpath: str, level: int) -> Iterator[os.DirEntry]:
+        with os.scandir(dirpath) as entries:
+            for entry in entries:
+                if not entry.is_dir(follow_symlinks=False):
+                    yield entry
+                elif level < MAX_SHARD_DEPTH:
+                    yield from _scan(entry.path, level + 1)
+    dirpath = f"{struct_dirpath}/{INSTANCES_DIRNAME}"
+    if os.path.isdir(dirpath):
+        yield from _scan(dirpath, 0)
+
+def touch_instances(struct_dirpath: str) -> None:
+    # manifests notice new and deleted instances by the mtime of instances/, which files in shards leave alone
+    os.utime(f"{struct_dirpath}/{INSTANCES_DIRNAME}")
+
+def write_shard_settings(struct_dirpath: str, settings: Dict[str, Optional[int]]) -> None:
+    with open(settings_filepath(struct_dirpath)) as f:
+        data = json.load(f)
+    for k, v in settings.items():
+        if v is None:
+            data.pop(k, None)
+        else:
+            data[k] = v
+    write_atomic(settings_filepath(struct_dirpath), json.dumps(data))
+    forget_layout(struct_dirpath)
+
+def _remove_empty_shards(struct_dirpath: str) -> None:
+    instances_dirpath = f"{struct_dirpath}/{INSTANCES_DIRNAME}"
+    # bottom up, os.walk lists a directory's children before they are removed, so rmdir decides what is empty
+    for dirpath, _, _ in os.walk(instances_dirpath, topdown=False):
+        if dirpath != instances_dirpath:
+            try:
+                os.rmdir(dirpath)
+            except OSError:
+                pass # not empty, or a writer just put a node there
+
+def reshard(struct_dirpath: str, depth: int) -> int:
+    # moves every loose instance file to the layout of the given depth, returns how many files moved
+    # packed nodes stay in their pack, only nodes written afterwards land in the new layout
+    if type(depth) is not int or not 0 <= depth <= MAX_SHARD_DEPTH:
+        raise ValueError(error(f"Shard depth must be between 0 and {MAX_SHARD_DEPTH}, got {depth}"))
+    current, previous = read_layout(struct_dirpath)
+    if previous is not None and current != depth:
+        raise ValueError(error(f"{struct_dirpath} is still being resharded to depth {current}, finish that first"))
+    if current == depth and previous is None:
+        return 0
+    if previous is None:
+        write_shard_settings(struct_dirpath, { "shard_depth": depth, "reshard_from": current })
+        # every process sees the new layout before the first file moves, writes already go to their new place
+        time.sleep(2 * SHARD_RECHECK_INTERVAL)
+
+    moved = 0
+    for entry in list(scan_instances(struct_dirpath)):
+        if not entry.name.endswith(".json"):
+            continue
+        target = shard_path(struct_dirpath, entry.name[:-len(".json")], depth)
+        if entry.path == target:
+            continue
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        # link and unlink instead of rename, a node a generator wrote to its new place meanwhile is newer and stays
+        try:
+            os.link(entry.path, target)
+        except FileExistsError:
+            pass
+        except FileNotFoundError:
+            continue # written or deleted by a generator since the scan
+        try:
+            os.remove(entry.path)
+        except FileNotFoundError:
+            pass
+        moved += 1
+
+    from core.components.manifest import get_manifest # manifest imports storage, which imports this module
+    _remove_empty_shards(struct_dirpath)
+    write_shard_settings(struct_dirpath, { "shard_depth": depth, "reshard_from": None })
+    with get_manifest(struct_dirpath).locked():
+        touch_instances(struct_dirpath)
+    debug(f"Resharded {struct_dirpath} to depth {depth}, moved {moved} files")
+    return moved
+
+def main() -> int:
+    import argparse
+    from core.components.world import load_world
+    from core.globals import STORAGE_MODE_SQLITE
+
+    parser = argparse.ArgumentParser(description="Move the instance files of a world's structs into hash-prefix directories")
+    parser.add_argument("command", choices=["reshard"])
+    parser.add_argument("world_dirpath")
+    parser.add_argument("--depth", type=int, required=True, help=f"directory levels of {SHARD_WIDTH} id characters each, 0 is flat, at most {MAX_SHARD_DEPTH}")
+    parser.add_argument("--struct", nargs="+", metavar="NAME", help="only reshard these structs")
+    args = parser.parse_args()
+
+    world = load_world(args.world_dirpath, lazy=True)
+    if not world:
+        return 1
+    if world.storage_mode == STORAGE_MODE_SQLITE:
+        print(f"{args.world_dirpath} uses sqlite storage, shards only apply to the files and journal modes", file=sys.stderr)
+        return 1
+    struct_dirpaths: List[str] = [p for p in world.struct_paths if not args.struct or os.path.basename(p) in args.struct]
+    for struct_dirpath in struct_dirpaths:
+        try:
+            print(f"{os.path.basename(struct_dirpath)}: moved {reshard(struct_dirpath, args.depth)} files")
+        except ValueError:
+            return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,305 @@
+from typing import Dict, List, Tuple, Optional, Iterable, Any
+import argparse
+import threading
+import sqlite3
+import json
+import sys
+import os
+
+from core.components.storage import StorageBackend, FileStorage, open_storage, node_id_from_path, copy_nodes
+from core.components.export_info import Parameter
+from core.components.struct import Struct
+from core.components.world import load_world
+from core.logger import error, debug
+from core.globals import SQLITE_FILENAME, SQLITE_BATCH_SIZE, STORAGE_MODE_SQLITE, STORAGE_MODE_FILES
+
+# One database per world, one table per struct. Every Parameter gets a typed column, values that do not
+# match their column's type (or attributes the struct does not declare) go to the __extra json column,
+# so any data a generator sets round-trips exactly.
+#   python -m core.components.sqlite_storage import <world_dirpath> [--remove-source]
+#   python -m core.components.sqlite_storage export <world_dirpath> [--remove-source]
+
+ID_COLUMN = "__id"
+EXTRA_COLUMN = "__extra"
+CHANGES_TABLE = "__changes"     # per struct table, a counter the triggers bump on every insert and delete
+COLUMN_TYPES = { str: "TEXT", int: "INTEGER" }
+DECLARED_TYPES = { v: k for k, v in COLUMN_TYPES.items() }
+
+def quote(name: str) -> str:
+    return '"' + name.replace('"', '""') + '"'
+
+def literal(text: str) -> str:
+    # triggers can not take parameters
+    return "'" + text.replace("'", "''") + "'"
+
+class SqliteTable:
+    # columns of one struct's table, refreshed whenever its struct.json changes
+    name: str
+    columns: Dict[str, type]
+    stamp: int
+    select: str
+    insert: str
+    upsert: str
+
+    def __init__(self, name: str, columns: Dict[str, type], stamp: int):
+        self.name = name
+        self.columns = columns
+        self.stamp = stamp
+        names = [ID_COLUMN, *columns, EXTRA_COLUMN]
+        self.select = f"SELECT {', '.join(quote(n) for n in names)} FROM {quote(name)}"
+        self.insert = f"INSERT INTO {quote(name)} ({', '.join(quote(n) for n in names)}) VALUES ({', '.join('?' * len(names))})"
+        self.upsert = f"{self.insert} ON CONFLICT({quote(ID_COLUMN)}) DO UPDATE SET {', '.join(f'{quote(n)} = excluded.{quote(n)}' for n in names[1:])}"
+
+    def encode(self, node_id: str, data: Dict) -> Tuple[List[Any], int]:
+        row: List[Any] = [node_id]
+        extra = {}
+        for name, type_ in self.columns.items():
+            value = data.get(name)
+            if value is None or type(value) is type_:
+                row.append(value)
+            else:
+                row.append(None)
+                extra[name] = value
+        extra.update((k, v) for k, v in data.items() if k not in self.columns)
+        encoded_extra = json.dumps(extra) if extra else None
+        row.append(encoded_extra)
+        return row, row_size(row)
+
+    def decode(self, row: Tuple) -> Tuple[Dict, int]:
+        # None columns are left out, Node reads missing attributes as None like it does for json files
+        data = { name: value for name, value in zip(self.columns, row[1:-1]) if value is not None }
+        if row[-1]:
+            data.update(json.loads(row[-1]))
+        return data, row_size(row)
+
+def row_size(row: Iterable[Any]) -> int:
+    # approximate payload bytes, used for the cache byte budget and the I/O metrics
+    return sum(len(v) if isinstance(v, str) else 8 for v in row if v is not None)
+
+class SqliteStorage(StorageBackend):
+    # WAL mode lets readers run alongside one writer at a time, so executor processes can share the world
+    mode = STORAGE_MODE_SQLITE
+    process_safe = True
+    world_dirpath: str
+    filepath: str
+    __tables: Dict[str, SqliteTable]        # struct dirpath -> table
+    __local: threading.local                # one connection per thread
+    __connections: List[sqlite3.Connection]
+    __lock: threading.Lock
+
+    def __init__(self, world_dirpath: str):
+        self.world_dirpath = world_dirpath
+        self.filepath = f"{world_dirpath}/{SQLITE_FILENAME}"
+        self.__tables = {}
+        self.__local = threading.local()
+        self.__connections = []
+        self.__lock = threading.Lock()
+
+    def __connection(self) -> sqlite3.Connection:
+        connection = getattr(self.__local, "connection", None)
+        if connection is None:
+            # autocommit, put_many opens its own transactions
+            connection = sqlite3.connect(self.filepath, timeout=30, isolation_level=None, check_same_thread=False)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self.__local.connection = connection
+            with self.__lock:
+                self.__connections.append(connection)
+        return connection
+
+    def __table(self, struct_dirpath: str) -> SqliteTable:
+        # creates the table on first use and adds columns for parameters added since
+        settings_filepath = f"{struct_dirpath}/{Struct.SETTINGS_FILENAME}"
+        try:
+            stamp = os.stat(settings_filepath).st_mtime_ns
+        except FileNotFoundError:
+            raise RuntimeError(error(f"Could not find struct settings for sqlite storage, searched {settings_filepath}"))
+        table = self.__tables.get(struct_dirpath)
+        if table is not None and table.stamp == stamp:
+            return table
+        connection = self.__connection()
+        with self.__lock:
+            with open(settings_filepath) as f:
+                parameters = [Parameter.from_dict(d) for d in json.load(f).get("parameters", [])]
+            name = os.path.basename(struct_dirpath)
+            connection.execute(f"CREATE TABLE IF NOT EXISTS {quote(name)} ({quote(ID_COLUMN)} TEXT PRIMARY KEY, {quote(EXTRA_COLUMN)} TEXT)")
+            # manifests in every process compare this counter, the instances directory never changes in sqlite mode
+            # an upsert that updates an existing row fires no insert trigger, so only creates and deletes count
+            connection.execute(f"CREATE TABLE IF NOT EXISTS {quote(CHANGES_TABLE)} (name TEXT PRIMARY KEY, counter INTEGER NOT NULL)")
+            connection.execute(f"INSERT OR IGNORE INTO {quote(CHANGES_TABLE)} VALUES (?, 0)", (name,))
+            for event in ["INSERT", "DELETE"]:
+                connection.execute(
+                    f"CREATE TRIGGER IF NOT EXISTS {quote(f'{CHANGES_TABLE}_{event.lower()}_{name}')} AFTER {event} ON {quote(name)} "
+                    f"BEGIN UPDATE {quote(CHANGES_TABLE)} SET counter = counter + 1 WHERE name = {literal(name)}; END"
+                )
+            existing = { r[1]: r[2] for r in connection.execute(f"PRAGMA table_info({quote(name)})") }
+            for p in parameters:
+                if p and p.name not in existing and p.type_ in COLUMN_TYPES:
+                    try:
+                        connection.execute(f"ALTER TABLE {quote(name)} ADD COLUMN {quote(p.name)} {COLUMN_TYPES[p.type_]}")
+                    except sqlite3.OperationalError:
+                        pass # another process added it first
+            existing = { r[1]: r[2] for r in connection.execute(f"PRAGMA table_info({quote(name)})") }
+            # a parameter whose type changed keeps its old column, values of the new type go to __extra
+            columns = { n: DECLARED_TYPES[t] for n, t in existing.items() if n not in (ID_COLUMN, EXTRA_COLUMN) and t in DECLARED_TYPES }
+            table = SqliteTable(name, columns, stamp)
+            self.__tables[struct_dirpath] = table
+            debug(f"Using sqlite table {name} with columns {list(columns)} in {self.filepath}")
+            return table
+
+    def __locate(self, path_on_disk: str) -> Tuple[SqliteTable, str]:
+        return self.__table(os.path.dirname(os.path.dirname(path_on_disk))), node_id_from_path(path_on_disk)
+
+    def get(self, path_on_disk: str) -> Optional[Tuple[Dict, int]]:
+        table, node_id = self.__locate(path_on_disk)
+        row = self.__connection().execute(f"{table.select} WHERE {quote(ID_COLUMN)} = ?", (node_id,)).fetchone()
+        return None if row is None else table.decode(row)
+
+    def put(self, path_on_disk: str, data: Dict) -> int:
+        table, node_id = self.__locate(path_on_disk)
+        row, size = table.encode(node_id, data)
+        self.__connection().execute(table.upsert, row)
+        return size
+
+    def create(self, path_on_disk: str, data: Dict) -> int:
+        table, node_id = self.__locate(path_on_disk)
+        row, size = table.encode(node_id, data)
+        try:
+            self.__connection().execute(table.insert, row)
+        except sqlite3.IntegrityError:
+            raise RuntimeError(f"Found duplicate node path when trying to create new Node {path_on_disk}")
+        return size
+
+    def exists(self, path_on_disk: str) -> bool:
+        table, node_id = self.__locate(path_on_disk)
+        return self.__connection().execute(f"SELECT 1 FROM {quote(table.name)} WHERE {quote(ID_COLUMN)} = ?", (node_id,)).fetchone() is not None
+
+    def delete(self, path_on_disk: str) -> None:
+        table, node_id = self.__locate(path_on_disk)
+        self.__connection().execute(f"DELETE FROM {quote(table.name)} WHERE {quote(ID_COLUMN)} = ?", (node_id,))
+
+    def list(self, struct_dirpath: str) -> List[str]:
+        table = self.__table(struct_dirpath)
+        return [r[0] for r in self.__connection().execute(f"SELECT {quote(ID_COLUMN)} FROM {quote(table.name)} ORDER BY rowid")]
+
+    def change_stamp(self, struct_dirpath: str) -> int:
+        table = self.__table(struct_dirpath)
+        row = self.__connection().execute(f"SELECT counter FROM {quote(CHANGES_TABLE)} WHERE name = ?", (table.name,)).fetchone()
+        return 0 if row is None else row[0]
+
+    def __group(self, paths: Iterable[str]) -> Dict[str, List[Tuple[str, str]]]:
+        # struct dirpath -> [(path_on_disk, node_id)]
+        groups: Dict[str, List[Tuple[str, str]]] = {}
+        for path_on_disk in paths:
+            groups.setdefault(os.path.dirname(os.path.dirname(path_on_disk)), []).append((path_on_disk, node_id_from_path(path_on_disk)))
+        return groups
+
+    def get_many(self, paths: Iterable[str]) -> Dict[str, Tuple[Dict, int]]:
+        found = {}
+        connection = self.__connection()
+        for struct_dirpath, entries in self.__group(paths).items():
+            table = self.__table(struct_dirpath)
+            by_id = { node_id: path_on_disk for path_on_disk, node_id in entries }
+            ids = list(by_id)
+            for start in range(0, len(ids), SQLITE_BATCH_SIZE):
+                chunk = ids[start:start + SQLITE_BATCH_SIZE]
+                for row in connection.execute(f"{table.select} WHERE {quote(ID_COLUMN)} IN ({', '.join('?' * len(chunk))})", chunk):
+                    found[by_id[row[0]]] = table.decode(row)
+        return found
+
+    def put_many(self, items: List[Tuple[str, Dict]]) -> List[int]:
+        # one transaction for the whole batch, IMMEDIATE takes the write lock up front so concurrent writers wait instead of failing
+        encoded = []
+        for path_on_disk, data in items:
+            table, node_id = self.__locate(path_on_disk)
+            encoded.append((table, *table.encode(node_id, data)))
+        connection = self.__connection()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            for table, row, _ in encoded:
+                connection.execute(table.upsert, row)
+            connection.execute("COMMIT")
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        return [size for _, _, size in encoded]
+
+    def create_many(self, items: List[Tuple[str, Dict]]) -> List[int]:
+        encoded = []
+        for path_on_disk, data in items:
+            table, node_id = self.__locate(path_on_disk)
+            encoded.append((path_on_disk, table, *table.encode(node_id, data)))
+        connection = self.__connection()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            for path_on_disk, table, row, _ in encoded:
+                try:
+                    connection.execute(table.insert, row)
+                except sqlite3.IntegrityError:
+                    raise RuntimeError(f"Found duplicate node path when trying to create new Node {path_on_disk}")
+            connection.execute("COMMIT")
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        return [size for _, _, _, size in encoded]
+
+    def delete_many(self, paths: Iterable[str]) -> None:
+        connection = self.__connection()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            for struct_dirpath, entries in self.__group(paths).items():
+                table = self.__table(struct_dirpath)
+                connection.executemany(f"DELETE FROM {quote(table.name)} WHERE {quote(ID_COLUMN)} = ?", [(node_id,) for _, node_id in entries])
+            connection.execute("COMMIT")
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+
+    def checkpoint(self) -> None:
+        # copies the WAL into the database file, PASSIVE never waits on readers in other processes
+        self.__connection().execute("PRAGMA wal_checkpoint(PASSIVE)")
+
+    def close(self) -> None:
+        with self.__lock:
+            connections, self.__connections = self.__connections, []
+        for connection in connections:
+            connection.close()
+        self.__local = threading.local()
+
+def migrate(world_dirpath: str, target_mode: str, remove_source: bool=False) -> int:
+    # copies every node of the world into the target storage and switches the world over to it
+    world = load_world(world_dirpath)
+    if not world:
+        raise RuntimeError(f"Failed to load world {world_dirpath}")
+    if world.storage_mode == target_mode or STORAGE_MODE_SQLITE not in (world.storage_mode, target_mode):
+        raise ValueError(error(f"World {world_dirpath} uses {world.storage_mode} storage, can not move it to {target_mode} with the sqlite tool"))
+    source = open_storage(world_dirpath, world.storage_mode, world.journal_fsync_interval)
+    target = SqliteStorage(world_dirpath) if target_mode == STORAGE_MODE_SQLITE else FileStorage()
+    total = 0
+    for struct_dirpath in world.struct_paths:
+        count = copy_nodes(source, target, struct_dirpath, remove_source)
+        print(f"{os.path.basename(struct_dirpath)}: {count} nodes")
+        total += count
+    target.checkpoint()
+    target.close()
+    source.close()
+    world.storage_mode = target_mode
+    world.save()
+    return total
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Move a world's nodes between the json files and sqlite storage")
+    parser.add_argument("direction", choices=["import", "export"], help="import json files into sqlite, or export sqlite back to json files")
+    parser.add_argument("world_dirpath")
+    parser.add_argument("--remove-source", action="store_true", help="delete the nodes from the old storage once they are copied")
+    args = parser.parse_args()
+    try:
+        total = migrate(args.world_dirpath, STORAGE_MODE_SQLITE if args.direction == "import" else STORAGE_MODE_FILES, args.remove_source)
+    except (RuntimeError, ValueError) as ex:
+        print(ex, file=sys.stderr)
+        return 1
+    print(f"Moved {total} nodes, {args.world_dirpath} now uses {STORAGE_MODE_SQLITE if args.direction == 'import' else STORAGE_MODE_FILES} storage")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,105 @@
+from typing import Dict, List, Any, Optional, Tuple
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+import threading
+import hashlib
+import json
+import time
+
+# Local stand-in for an OpenAI style completions endpoint, so generators, the completion cache and the
+# LLM client can be exercised offline. Completions are deterministic: the same prompt always gets the same text.
+#   python -m core.components.standin_model [port]
+
+def standin_completion(model: str, prompt: str) -> str:
+    digest = hashlib.sha256(f"{model}\n{prompt}".encode()).hexdigest()[:12]
+    return f"[{model}:{digest}] {prompt[-40:]}"
+
+class StandinModelServer:
+    host: str
+    port: int
+    latency: float
+    fail_first: int
+    fail_status: int
+    request_count: int
+    prompt_count: int
+    __server: ThreadingHTTPServer
+    __thread: Optional[threading.Thread]
+
+    def __init__(self, host: str="127.0.0.1", port: int=0, latency: float=0.0, fail_first: int=0, fail_status: int=429):
+        # fail_first answers that many requests with fail_status first, to exercise retries
+        self.latency = latency
+        self.fail_first = fail_first
+        self.fail_status = fail_status
+        self.request_count = 0
+        self.prompt_count = 0
+        self.batch_sizes: List[int] = []
+        self.__lock = threading.Lock()
+        self.__server = ThreadingHTTPServer((host, port), self.__make_handler())
+        self.__server.daemon_threads = True
+        self.host, self.port = self.__server.server_address[:2] # type: ignore
+        self.__thread = None
+
+    @property
+    def base_url(self) -> str:
+        return f"http://{self.host}:{self.port}"
+
+    def __respond(self, body: Dict) -> Tuple[int, Dict]:
+        with self.__lock:
+            self.request_count += 1
+            if self.fail_first > 0:
+                self.fail_first -= 1
+                return self.fail_status, { 'error': { 'message': f"stand-in failed with {self.fail_status}" } }
+        prompts = body.get('prompt', "")
+        prompts = prompts if isinstance(prompts, list) else [prompts]
+        model = body.get('model', "standin")
+        with self.__lock:
+            self.prompt_count += len(prompts)
+            self.batch_sizes.append(len(prompts))
+        if self.latency:
+            time.sleep(self.latency)
+        choices = [{ 'index': i, 'text': standin_completion(model, str(p)), 'finish_reason': "stop" } for i, p in enumerate(prompts)]
+        tokens = sum(len(str(p).split()) for p in prompts)
+        return 200, { 'object': "text_completion", 'model': model, 'choices': choices, 'usage': { 'prompt_tokens': tokens, 'completion_tokens': tokens, 'total_tokens': tokens * 2 } }
+
+    def __make_handler(self):
+        server = self
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"   # keep-alive, so pooled clients can reuse connections
+
+            def do_POST(self):
+                length = int(self.headers.get('Content-Length', 0))
+                try:
+                    body = json.loads(self.rfile.read(length) or b"{}")
+                except ValueError:
+                    status, response = 400, { 'error': { 'message': "invalid json" } }
+                else:
+                    status, response = server._StandinModelServer__respond(body) # type: ignore
+                encoded = json.dumps(response).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', "application/json")
+                self.send_header('Content-Length', str(len(encoded)))
+                self.end_headers()
+                self.wfile.write(encoded)
+
+            def log_message(self, format: str, *args: Any) -> None:
+                pass
+        return Handler
+
+    def start(self) -> 'StandinModelServer':
+        self.__thread = threading.Thread(target=self.__server.serve_forever, daemon=True)
+        self.__thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.__server.shutdown()
+        self.__server.server_close()
+
+if __name__ == "__main__":
+    import sys
+    server = StandinModelServer(port=int(sys.argv[1]) if len(sys.argv) > 1 else 8765)
+    print(f"Stand-in model listening on {server.base_url}/v1/completions")
+    server.start()
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        server.stop()
@@ -0,0 +1,354 @@
+from typing import Dict, List, Tuple, Optional, Iterable
+import threading
+import json
+import os
+
+from core.components.journal import Journal, open_journal
+from core.components.packfile import PackFile, TOMBSTONE_SUFFIX, get_pack, tombstone_filepath
+from core.components.codec import NodeCodec, decode_node, remember_codec, check_encoding
+from core.components.shards import get_layout, shard_path, scan_instances, touch_instances
+from core.logger import critical
+from core.globals import INSTANCES_DIRNAME, STORAGE_MODE_FILES, STORAGE_MODE_JOURNAL, STORAGE_MODE_SQLITE, STORAGE_MODES, SQLITE_BATCH_SIZE
+from core.globals import NODE_ENCODING_JSON, NODE_ENCODING_BINARY
+
+# Nodes are addressed by their path_on_disk, <world>/structs/<struct>/instances/<id>.json, no matter how a
+# backend actually stores them. NodeCache is the only caller, so generators never see which backend is in use.
+
+def node_id_from_path(path_on_disk: str) -> str:
+    return os.path.splitext(os.path.basename(path_on_disk))[0]
+
+def instance_dirpath(struct_dirpath: str) -> str:
+    return f"{struct_dirpath}/{INSTANCES_DIRNAME}"
+
+class StorageBackend:
+    mode: str
+    process_safe: bool = True       # several processes may read and write the same world at once
+    encoding: str = NODE_ENCODING_JSON
+
+    def get(self, path_on_disk: str) -> Optional[Tuple[Dict, int]]:
+        # (data, encoded size), None when the node does not exist
+        raise NotImplementedError()
+
+    def put(self, path_on_disk: str, data: Dict) -> int:
+        # returns the encoded size written
+        raise NotImplementedError()
+
+    def create(self, path_on_disk: str, data: Dict) -> int:
+        # like put, but raises when the node already exists
+        raise NotImplementedError()
+
+    def exists(self, path_on_disk: str) -> bool:
+        raise NotImplementedError()
+
+    def delete(self, path_on_disk: str) -> None:
+        raise NotImplementedError()
+
+    def list(self, struct_dirpath: str) -> List[str]:
+        # ids of every instance of the struct, oldest first where the backend can tell
+        raise NotImplementedError()
+
+    def change_stamp(self, struct_dirpath: str) -> int:
+        # changes whenever an instance of the struct is created or deleted, by any process,
+        # manifests keep it in their header to tell whether they are stale
+        try:
+            return os.stat(instance_dirpath(struct_dirpath)).st_mtime_ns
+        except FileNotFoundError:
+            return 0
+
+    def get_many(self, paths: Iterable[str]) -> Dict[str, Tuple[Dict, int]]:
+        # missing nodes are left out of the result
+        found = {}
+        for path_on_disk in paths:
+            loaded = self.get(path_on_disk)
+            if loaded is not None:
+                found[path_on_disk] = loaded
+        return found
+
+    def put_many(self, items: List[Tuple[str, Dict]]) -> List[int]:
+        return [self.put(path_on_disk, data) for path_on_disk, data in items]
+
+    def create_many(self, items: List[Tuple[str, Dict]]) -> List[int]:
+        # raises on the first duplicate, backends with transactions create none of the batch then
+        return [self.create(path_on_disk, data) for path_on_disk, data in items]
+
+    def delete_many(self, paths: Iterable[str]) -> None:
+        for path_on_disk in paths:
+            self.delete(path_on_disk)
+
+    def set_codec(self, struct_dirpath: str, codec: NodeCodec) -> None:
+        # the struct's generated codec, for backends that can write the binary node encoding
+        pass
+
+    def checkpoint(self) -> None:
+        # called when a run ends, everything written so far has to be durable afterwards
+        pass
+
+    def close(self) -> None:
+        pass
+
+def struct_dirpath_from_path(path_on_disk: str) -> str:
+    # node paths are always <struct>/instances/<id>.json, every read and write asks so os.path is too slow here
+    return path_on_disk.rsplit("/", 2)[0]
+
+class FileStorage(StorageBackend):
+    # the original layout, one json file per node under the struct's instances directory
+    # structs packed by core.components.packfile keep most nodes in their pack, loose files always win over it
+    mode = STORAGE_MODE_FILES
+    codecs: Dict[str, NodeCodec]      # struct name -> codec
+
+    def __init__(self, encoding: str=NODE_ENCODING_JSON):
+        self.encoding = encoding
+        self.codecs = {}
+
+    def set_codec(self, struct_dirpath: str, codec: NodeCodec) -> None:
+        if self.encoding == NODE_ENCODING_BINARY:
+            remember_codec(struct_dirpath, codec)
+        self.codecs[os.path.basename(struct_dirpath)] = codec
+
+    def encode(self, path_on_disk: str, data: Dict) -> bytes:
+        # structs without a registered codec, e.g. before their usercode was loaded, fall back to plain json
+        if self.encoding == NODE_ENCODING_BINARY:
+            codec = self.codecs.get(os.path.basename(struct_dirpath_from_path(path_on_disk)))
+            if codec is not None:
+                return codec.encode_binary(data)
+        return json.dumps(data).encode()
+
+    def __located(self, path_on_disk: str, struct_dirpath: Optional[str]=None) -> Tuple[str, Optional[str]]:
+        # where the node's file is, and where it may still be while its struct is resharded
+        if struct_dirpath is None:
+            struct_dirpath = struct_dirpath_from_path(path_on_disk)
+        depth, previous = get_layout(struct_dirpath)
+        if depth == 0 and previous is None:
+            return path_on_disk, None
+        node_id = node_id_from_path(path_on_disk)
+        return shard_path(struct_dirpath, node_id, depth), (None if previous is None else shard_path(struct_dirpath, node_id, previous))
+
+    def __read(self, filepath: str) -> Optional[bytes]:
+        try:
+            with open(filepath, "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def __open(self, filepath: str, mode: str):
+        # shard directories are made when their first node is written
+        try:
+            return open(filepath, mode)
+        except FileNotFoundError:
+            os.makedirs(os.path.dirname(filepath), exist_ok=True)
+            return open(filepath, mode)
+
+    def __packed(self, path_on_disk: str) -> Optional[Tuple[PackFile, str, Tuple[int, int]]]:
+        # the node's pack and record, if it is packed and was not deleted since
+        pack = get_pack(struct_dirpath_from_path(path_on_disk))
+        if pack is None:
+            return None
+        node_id = node_id_from_path(path_on_disk)
+        found = pack.find(node_id) if node_id not in pack.tombstones else None
+        return None if found is None else (pack, node_id, found)
+
+    def get(self, path_on_disk: str) -> Optional[Tuple[Dict, int]]:
+        # json and binary nodes can sit side by side, the first byte tells them apart
+        struct_dirpath = struct_dirpath_from_path(path_on_disk)
+        filepath, previous = self.__located(path_on_disk, struct_dirpath)
+        raw = self.__read(filepath)
+        if raw is None and previous is not None:
+            # the reshard may move the file between the two reads, so its new place is looked at once more
+            raw = self.__read(previous)
+            if raw is None:
+                raw = self.__read(filepath)
+        if raw is None:
+            packed = self.__packed(path_on_disk)
+            if packed is None:
+                return None
+            raw = packed[0].record(*packed[2])
+        return decode_node(raw, struct_dirpath), len(raw)
+
+    def put(self, path_on_disk: str, data: Dict) -> int:
+        return self.write_encoded(path_on_disk, self.encode(path_on_disk, data))
+
+    def write_text(self, path_on_disk: str, text: str) -> int:
+        return self.write_encoded(path_on_disk, text.encode())
+
+    def write_encoded(self, path_on_disk: str, raw: bytes) -> int:
+        filepath, previous = self.__located(path_on_disk)
+        with self.__open(filepath, "wb") as f:
+            f.write(raw)
+        if previous is not None and os.path.exists(previous):
+            # the copy the reshard has not moved yet is older now, it must not be moved over this one
+            try:
+                os.remove(previous)
+            except FileNotFoundError:
+                pass
+        self.__clear_tombstone(path_on_disk)
+        return len(raw)
+
+    def __clear_tombstone(self, path_on_disk: str) -> None:
+        # writing a deleted packed node brings it back, same as rewriting a deleted loose file
+        struct_dirpath = struct_dirpath_from_path(path_on_disk)
+        pack = get_pack(struct_dirpath)
+        node_id = node_id_from_path(path_on_disk)
+        if pack is not None and node_id in pack.tombstones:
+            pack.tombstones.discard(node_id)
+            tombstone = tombstone_filepath(struct_dirpath, node_id)
+            if os.path.exists(tombstone):
+                os.remove(tombstone)
+
+    def create(self, path_on_disk: str, data: Dict) -> int:
+        raw = self.encode(path_on_disk, data)
+        filepath, previous = self.__located(path_on_disk)
+        try:
+            if self.__packed(path_on_disk) is not None or (previous is not None and os.path.exists(previous)):
+                raise FileExistsError()
+            # written aside and linked in, readers in other processes never see an empty node and the link
+            # still refuses an existing file
+            tmp_filepath = f"{filepath}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with self.__open(tmp_filepath, "wb") as f:
+                f.write(raw)
+            try:
+                os.link(tmp_filepath, filepath)
+            finally:
+                os.remove(tmp_filepath)
+        except FileExistsError:
+            raise RuntimeError(f"Found duplicate node path when trying to create new Node {path_on_disk}")
+        if filepath != path_on_disk:
+            touch_instances(struct_dirpath_from_path(path_on_disk))
+        return len(raw)
+
+    def exists(self, path_on_disk: str) -> bool:
+        filepath, previous = self.__located(path_on_disk)
+        if os.path.exists(filepath) or (previous is not None and os.path.exists(previous)):
+            return True
+        return self.__packed(path_on_disk) is not None
+
+    def delete(self, path_on_disk: str) -> None:
+        filepath, previous = self.__located(path_on_disk)
+        for candidate in (filepath, previous):
+            if candidate is not None and os.path.exists(candidate):
+                os.remove(candidate)
+                if candidate != path_on_disk:
+                    touch_instances(struct_dirpath_from_path(path_on_disk))
+        packed = self.__packed(path_on_disk)
+        if packed is not None:
+            pack, node_id, _ = packed
+            with open(tombstone_filepath(struct_dirpath_from_path(path_on_disk), node_id), "w"):
+                pass
+            pack.tombstones.add(node_id)
+
+    def list(self, struct_dirpath: str) -> List[str]:
+        # packed ids first in pack order, then loose files oldest first, from every shard directory
+        if not os.path.isdir(instance_dirpath(struct_dirpath)):
+            return []
+        found: Dict[str, int] = {}
+        tombstones = set()
+        for entry in scan_instances(struct_dirpath):
+            if entry.name.endswith(".json"):
+                node_id = entry.name[:-len(".json")]
+                try:
+                    found[node_id] = entry.stat().st_mtime_ns
+                except FileNotFoundError:
+                    # moved by a reshard since the scan, a file it misses entirely shows up after the reshard
+                    # touches instances/ once it is done
+                    try:
+                        found[node_id] = os.stat(shard_path(struct_dirpath, node_id, get_layout(struct_dirpath)[0])).st_mtime_ns
+                    except FileNotFoundError:
+                        pass
+            elif entry.name.endswith(TOMBSTONE_SUFFIX):
+                tombstones.add(entry.name[:-len(TOMBSTONE_SUFFIX)])
+        pack = get_pack(struct_dirpath, recheck=True)
+        ids = [i for i in pack.ids() if i not in tombstones] if pack else []
+        packed = set(ids)
+        return ids + sorted((i for i in found if i not in packed), key=lambda i: found[i])
+
+class JournalStorage(FileStorage):
+    # writes go to the world's journal, the journal later compacts them into the same files FileStorage reads
+    mode = STORAGE_MODE_JOURNAL
+    process_safe = False
+    journal: Journal
+
+    def __init__(self, journal: Journal):
+        # the journal holds json lines, so nodes stay json here whatever the world's node_encoding says
+        super().__init__()
+        self.journal = journal
+        journal.write_file = lambda p, text: FileStorage.write_text(self, p, text) # type: ignore
+        journal.remove_file = lambda p: FileStorage.delete(self, p) # type: ignore
+
+    def get(self, path_on_disk: str) -> Optional[Tuple[Dict, int]]:
+        encoded = self.journal.lookup_encoded(path_on_disk)
+        if encoded is not None:
+            return json.loads(encoded), len(encoded)
+        if self.journal.is_deleted(path_on_disk):
+            return None
+        return super().get(path_on_disk)
+
+    def put(self, path_on_disk: str, data: Dict) -> int:
+        return self.journal.append(path_on_disk, data)
+
+    def create(self, path_on_disk: str, data: Dict) -> int:
+        if self.exists(path_on_disk):
+            raise RuntimeError(f"Found duplicate node path when trying to create new Node {path_on_disk}")
+        return self.journal.append(path_on_disk, data)
+
+    def exists(self, path_on_disk: str) -> bool:
+        if self.journal.contains(path_on_disk):
+            return True
+        return not self.journal.is_deleted(path_on_disk) and super().exists(path_on_disk)
+
+    def delete(self, path_on_disk: str) -> None:
+        self.journal.delete(path_on_disk)
+
+    def list(self, struct_dirpath: str) -> List[str]:
+        # creates that only live in the journal go last, nodes deleted in the journal are dropped
+        ids = [i for i in super().list(struct_dirpath) if not self.journal.is_deleted(f"{instance_dirpath(struct_dirpath)}/{i}.json")]
+        known = set(ids)
+        ids += [i for i in (node_id_from_path(p) for p in self.journal.pending_paths(instance_dirpath(struct_dirpath))) if i not in known]
+        return ids
+
+    def checkpoint(self) -> None:
+        self.journal.commit(fsync=True)
+        self.journal.request_compaction()
+
+    def close(self) -> None:
+        self.journal.close()
+
+open_storages: Dict[str, StorageBackend] = {}
+open_storages_lock = threading.Lock()
+
+def open_storage(world_dirpath: str, storage_mode: str, fsync_interval: float=1.0, encoding: str=NODE_ENCODING_JSON) -> StorageBackend:
+    if storage_mode not in STORAGE_MODES:
+        raise ValueError(critical(f"Unknown storage mode '{storage_mode}', expected one of {STORAGE_MODES}"))
+    check_encoding(encoding)
+    key = os.path.abspath(world_dirpath)
+    with open_storages_lock:
+        storage = open_storages.get(key)
+        if storage is not None and storage.mode == storage_mode:
+            if isinstance(storage, JournalStorage):
+                storage.journal.fsync_interval = fsync_interval
+            elif isinstance(storage, FileStorage):
+                # nodes already written keep their encoding, only new writes switch
+                storage.encoding = encoding
+            return storage
+        if storage is not None:
+            # switching away from the journal folds it into the instance files first, so nothing it holds is lost
+            storage.close()
+        if storage_mode == STORAGE_MODE_JOURNAL:
+            storage = JournalStorage(open_journal(world_dirpath, fsync_interval))
+        elif storage_mode == STORAGE_MODE_SQLITE:
+            # imported here, the sqlite backend builds on this module
+            from core.components.sqlite_storage import SqliteStorage
+            storage = SqliteStorage(world_dirpath)
+        else:
+            storage = FileStorage(encoding)
+        open_storages[key] = storage
+        return storage
+
+def copy_nodes(source: StorageBackend, target: StorageBackend, struct_dirpath: str, remove_source: bool=False, batch_size: int=SQLITE_BATCH_SIZE) -> int:
+    # moves a struct's nodes between backends in bulk reads and writes, ids and their order are kept
+    node_ids = source.list(struct_dirpath)
+    for start in range(0, len(node_ids), batch_size):
+        paths = [f"{instance_dirpath(struct_dirpath)}/{node_id}.json" for node_id in node_ids[start:start + batch_size]]
+        found = source.get_many(paths)
+        target.put_many([(p, found[p][0]) for p in paths if p in found])
+        if remove_source:
+            source.delete_many(paths)
+    return len(node_ids)
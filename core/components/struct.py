@@ -1,17 +1,18 @@
-from typing import Tuple, Optional, List
+from typing import Optional, List, Dict, Any, Union
+from concurrent.futures import ThreadPoolExecutor
 import json
 import os
-import re
 
 from core.components.export_info import ExportInfo, DirPath, Parameter, dictize
 from core.components.formable import Formable
-from core.components.node import generate_node_text
-from core.globals import USERCODE_DIRNAME, USERCODE_TYPES_DIRNAME
-from core.logger import error
-from core.utils import check_name
+from core.components.node import generate_node_text, node_text_is_current
+from core.components.shards import SHARD_SETTINGS, read_shard_settings
+from core.globals import USERCODE_DIRNAME, USERCODE_TYPES_DIRNAME, STRUCT_LOAD_WORKERS, STRUCT_SETTINGS_FILENAME
+from core.logger import error, debug
+from core.utils import check_name, write_atomic, write_if_changed
 
 class Struct(Formable):
-    SETTINGS_FILENAME = "struct.json"
+    SETTINGS_FILENAME = STRUCT_SETTINGS_FILENAME
     PARAM_LIST = [
         ExportInfo("dirpath",    DirPath),
         ExportInfo("name",       str),
@@ -27,13 +28,72 @@ class Struct(Formable):
     name: str
     parameters: List[Parameter]
 
+    # structs made by from_header() only know their name and parameter count until something needs the rest
+    _header: Optional[Dict[str, Any]] = None
+
+    @staticmethod
+    def from_header(path: str, world_dirpath: str, header: Dict[str, Any]) -> 'Struct':
+        struct = Struct()
+        struct.dirpath = path
+        struct.world_dirpath = world_dirpath
+        struct.name = header['name']
+        struct._header = header
+        return struct
+
+    def header(self) -> Dict[str, Any]:
+        if self._header is not None:
+            return self._header
+        return { 'name': self.name, 'parameter_count': len(self.parameters) }
+
+    def is_loaded(self) -> bool:
+        return self._header is None
+
+    @property
+    def parameter_count(self) -> int:
+        return self._header['parameter_count'] if self._header is not None else len(self.parameters)
+
+    def load_rest(self) -> bool:
+        # reads struct.json and regenerates the type file if needed, like a struct loaded by load_struct
+        failure = self._load_rest_unlogged()
+        if failure is not None:
+            error(f"Exception occured loading struct at {self.dirpath} -> {failure}")
+            return False
+        return True
+
+    def _load_rest_unlogged(self) -> Optional[Exception]:
+        # load_remaining_structs runs this on pool threads, the failure is logged by the calling thread
+        if self.is_loaded():
+            return None
+        try:
+            struct = _read_struct(self.dirpath, self.world_dirpath)
+            self.name = struct.name
+            self.parameters = struct.parameters
+            self._header = None
+            self.save()
+        except Exception as ex:
+            return ex
+        return None
+
+    def __getattr__(self, attr: str) -> Any:
+        # only called when normal lookup fails, i.e. for parameters of a struct that is not loaded yet
+        if attr == "parameters" and self._header is not None:
+            if not self.load_rest():
+                raise AttributeError(f"Failed to load the parameters of struct '{self.name}' from {self.dirpath}")
+            return self.parameters
+        raise AttributeError(attr)
+
     def save(self) -> None:
-        exlclude_list = ["dirpath"]
+        # files are only rewritten when their contents change, so opening a world leaves mtimes alone
+        self.load_rest()
+        exlclude_list = ["dirpath", "_header"] + SHARD_SETTINGS
         export_data = { k:dictize(v) for k,v in self.__dict__.items() if k not in exlclude_list }
-        with open(f"{self.dirpath}/{Struct.SETTINGS_FILENAME}", 'w') as f:
-            json.dump(export_data, f)
-        with open(f"{self.world_dirpath}/{USERCODE_DIRNAME}/{USERCODE_TYPES_DIRNAME}/{self.name}.py", "w") as f:
-            f.write(generate_node_text(self.name, self.parameters))
+        # a reshard may have changed the layout since this struct was loaded, what is on disk wins
+        export_data.update(read_shard_settings(self.dirpath))
+        write_if_changed(f"{self.dirpath}/{Struct.SETTINGS_FILENAME}", json.dumps(export_data))
+        type_filepath = f"{self.world_dirpath}/{USERCODE_DIRNAME}/{USERCODE_TYPES_DIRNAME}/{self.name}.py"
+        if not node_text_is_current(type_filepath, self.name, self.parameters):
+            write_atomic(type_filepath, generate_node_text(self.name, self.parameters))
+            debug(f"Generated {type_filepath}")
 
     def is_valid(self) -> bool:
         if not os.path.isdir(self.dirpath):
@@ -50,14 +110,21 @@ class Struct(Formable):
         return struct
 
 def load_struct(path: str, world_dirpath: str) -> Optional[Struct]:
+    try:
+        return _read_struct(path, world_dirpath)
+    except FileNotFoundError as ex:
+        error(str(ex))
+        return None
+
+def _read_struct(path: str, world_dirpath: str) -> Struct:
+    # raises instead of logging, so it can run on pool threads
     struct = Struct()
     struct.dirpath = path
     struct.world_dirpath = world_dirpath
 
     settings_filepath = f"{path}/{Struct.SETTINGS_FILENAME}"
     if not os.path.exists(settings_filepath):
-        error(f"Could not find {Struct.SETTINGS_FILENAME} file, searched {settings_filepath}")
-        return None
+        raise FileNotFoundError(f"Could not find {Struct.SETTINGS_FILENAME} file, searched {settings_filepath}")
     with open(settings_filepath) as f:
         json_data = json.load(f)
         for k, v in json_data.items():
@@ -66,3 +133,38 @@ def load_struct(path: str, world_dirpath: str) -> Optional[Struct]:
             setattr(struct, k, v)
 
     return struct
+
+def _load_struct_unlogged(path: str, world_dirpath: str, save: bool) -> Union[Struct, Exception]:
+    try:
+        struct = _read_struct(path, world_dirpath)
+        if save:
+            struct.save()
+        return struct
+    except Exception as ex:
+        return ex
+
+def _log_failures(paths: List[str], failures: List[Optional[Exception]]) -> bool:
+    # the logger's actions include the GUI's message boxes, so they only run on the thread that waited for the pool
+    for path, failure in zip(paths, failures):
+        if failure is not None:
+            error(f"Exception occured loading struct at {path} -> {failure}")
+    return all(f is None for f in failures)
+
+def load_structs(paths: List[str], world_dirpath: str, save: bool=True) -> Optional[List[Struct]]:
+    # struct files are read concurrently, which mostly helps on network filesystems,
+    # the result keeps the order of paths and is None if any struct failed to load
+    if not paths:
+        return []
+    with ThreadPoolExecutor(max_workers=min(STRUCT_LOAD_WORKERS, len(paths))) as pool:
+        results = list(pool.map(lambda p: _load_struct_unlogged(p, world_dirpath, save), paths))
+    if not _log_failures(paths, [r if isinstance(r, Exception) else None for r in results]):
+        return None
+    return results # type: ignore
+
+def load_remaining_structs(structs: List[Struct]) -> bool:
+    pending = [s for s in structs if not s.is_loaded()]
+    if not pending:
+        return True
+    with ThreadPoolExecutor(max_workers=min(STRUCT_LOAD_WORKERS, len(pending))) as pool:
+        failures = list(pool.map(lambda s: s._load_rest_unlogged(), pending))
+    return _log_failures([s.dirpath for s in pending], failures)
@@ -0,0 +1,206 @@
+from typing import Dict, List, Set, Tuple, Optional
+from types import ModuleType
+import importlib.util
+import threading
+import hashlib
+import ast
+import sys
+import os
+
+from core.logger import info, debug, critical
+from core.globals import USERCODE_DIRNAME, USERCODE_TYPES_DIRNAME, USERCODE_COMMON_DIRNAME
+
+USERCODE_LOADED_DIRNAMES = [USERCODE_TYPES_DIRNAME, USERCODE_COMMON_DIRNAME]
+
+def load_module(module_name: str, module_path: str) -> Optional[ModuleType]:
+    spec = importlib.util.spec_from_file_location(module_name, module_path)
+    if spec is None or spec.loader is None:
+        critical(f"Failed to load module, name={module_name}, path={module_path}, spec={spec}, loader={None if not spec else spec.loader}")
+        return None
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+
+    return module
+
+def find_usercode_imports(source: str, known: Set[str]) -> Set[str]:
+    # usercode modules a file imports, as sys.modules keys like 'usercode.common.helpers'
+    found: Set[str] = set()
+    try:
+        tree = ast.parse(source)
+    except SyntaxError:
+        return found
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            found.update(alias.name for alias in node.names if alias.name in known)
+        elif isinstance(node, ast.ImportFrom) and node.module and node.level == 0:
+            if node.module in known:
+                found.add(node.module)
+            # from usercode.types import person
+            found.update(f"{node.module}.{alias.name}" for alias in node.names if f"{node.module}.{alias.name}" in known)
+    return found
+
+class UsercodeModule:
+    key: str                # sys.modules key, usercode.<dirname>.<name>
+    name: str
+    filepath: str
+    mtime_ns: int
+    size: int
+    digest: str
+    imports: Set[str]
+    module: ModuleType
+
+    def __init__(self, key: str, name: str, filepath: str):
+        self.key = key
+        self.name = name
+        self.filepath = filepath
+        self.mtime_ns = -1
+        self.size = -1
+        self.digest = ""
+        self.imports = set()
+
+class UsercodeReport:
+    loaded: List[str]       # executed for the first time
+    reloaded: List[str]     # executed again because they or a module they import changed
+    removed: List[str]
+    unchanged: int
+
+    def __init__(self):
+        self.loaded = []
+        self.reloaded = []
+        self.removed = []
+        self.unchanged = 0
+
+    def __str__(self) -> str:
+        return f"loaded {self.loaded}, reloaded {self.reloaded}, removed {self.removed}, {self.unchanged} unchanged"
+
+class UsercodeLoader:
+    # Loads usercode/types and usercode/common into sys.modules, only executing modules whose content changed
+    # since the last load plus the modules that import them. Unchanged modules keep their module and class
+    # objects, so isinstance keeps working against nodes created by earlier runs.
+    world_dirpath: str
+    __modules: Dict[str, UsercodeModule]
+    __lock: threading.Lock
+
+    def __init__(self, world_dirpath: str):
+        self.world_dirpath = world_dirpath
+        self.__modules = {}
+        self.__lock = threading.Lock()
+
+    def __scan(self) -> Dict[str, UsercodeModule]:
+        found: Dict[str, UsercodeModule] = {}
+        for dirname in USERCODE_LOADED_DIRNAMES:
+            dirpath = f"{self.world_dirpath}/{USERCODE_DIRNAME}/{dirname}"
+            for py_file in sorted(os.listdir(dirpath)):
+                if not py_file.endswith(".py"):
+                    continue
+                name = os.path.splitext(py_file)[0]
+                key = f"{USERCODE_DIRNAME}.{dirname}.{name}"
+                found[key] = self.__modules.get(key) or UsercodeModule(key, name, f"{dirpath}/{py_file}")
+        return found
+
+    def __changed(self, entry: UsercodeModule, known: Set[str]) -> bool:
+        # the mtime and size check skips hashing unchanged files, the hash skips files that were only touched
+        stat = os.stat(entry.filepath)
+        if stat.st_mtime_ns == entry.mtime_ns and stat.st_size == entry.size:
+            return False
+        with open(entry.filepath, "rb") as f:
+            source = f.read()
+        digest = hashlib.sha256(source).hexdigest()
+        entry.mtime_ns, entry.size = stat.st_mtime_ns, stat.st_size
+        if digest == entry.digest:
+            return False
+        entry.digest = digest
+        entry.imports = find_usercode_imports(source.decode(errors="replace"), known)
+        return True
+
+    def __execution_order(self, modules: Dict[str, UsercodeModule], keys: Set[str]) -> List[str]:
+        # imported modules run before the modules importing them, cycles fall back to name order
+        order: List[str] = []
+        visiting: Set[str] = set()
+        def _visit(key: str) -> None:
+            if key in order or key in visiting:
+                return
+            visiting.add(key)
+            for dependency in sorted(modules[key].imports):
+                if dependency in keys:
+                    _visit(dependency)
+            visiting.discard(key)
+            order.append(key)
+        for key in sorted(keys):
+            _visit(key)
+        return order
+
+    def __rollback(self, modules: Dict[str, UsercodeModule], saved: Dict[str, Tuple[int, int, str, Set[str], Optional[ModuleType]]]) -> None:
+        # a failed reload keeps every module on its previous file state, so the next load sees the same
+        # changes again and reruns the dependents that never ran against the new code
+        for key, entry in modules.items():
+            entry.mtime_ns, entry.size, entry.digest, entry.imports, module = saved[key]
+            if module is not None:
+                entry.module = module
+                sys.modules[key] = module
+            else:
+                if hasattr(entry, "module"):
+                    del entry.module
+                sys.modules.pop(key, None)
+
+    def load(self) -> Optional[UsercodeReport]:
+        with self.__lock:
+            report = UsercodeReport()
+            modules = self.__scan()
+            known = set(modules)
+            # __changed records the new file state on the entries, it is only kept once every stale module ran
+            saved = { key: (entry.mtime_ns, entry.size, entry.digest, entry.imports, getattr(entry, "module", None)) for key, entry in modules.items() }
+            changed = { key for key, entry in modules.items() if self.__changed(entry, known) }
+
+            # everything importing a changed module has to run again to pick up the new objects
+            dependents: Dict[str, Set[str]] = {}
+            for key, entry in modules.items():
+                for dependency in entry.imports:
+                    dependents.setdefault(dependency, set()).add(key)
+            stale = set(changed)
+            pending = list(changed)
+            while pending:
+                for dependent in dependents.get(pending.pop(), ()):
+                    if dependent not in stale:
+                        stale.add(dependent)
+                        pending.append(dependent)
+
+            try:
+                for key in self.__execution_order(modules, stale):
+                    entry = modules[key]
+                    module = load_module(entry.name, entry.filepath)
+                    if not module:
+                        self.__rollback(modules, saved)
+                        return None
+                    (report.reloaded if key in self.__modules else report.loaded).append(key)
+                    entry.module = module
+                    sys.modules[key] = module
+            except Exception:
+                self.__rollback(modules, saved)
+                raise
+
+            for key, entry in modules.items():
+                if key not in stale:
+                    report.unchanged += 1
+                    # another world may have put its own module under the same name
+                    sys.modules[key] = entry.module
+            for key in set(self.__modules) - set(modules):
+                report.removed.append(key)
+                sys.modules.pop(key, None)
+            self.__modules = modules
+
+        if report.loaded or report.reloaded or report.removed:
+            info(f"Usercode for {self.world_dirpath}: {report}")
+        else:
+            debug(f"Usercode for {self.world_dirpath} unchanged, {report.unchanged} modules")
+        return report
+
+usercode_loaders: Dict[str, UsercodeLoader] = {}
+usercode_loaders_lock = threading.Lock()
+
+def get_usercode_loader(world_dirpath: str) -> UsercodeLoader:
+    key = os.path.abspath(world_dirpath)
+    with usercode_loaders_lock:
+        if key not in usercode_loaders:
+            usercode_loaders[key] = UsercodeLoader(world_dirpath)
+        return usercode_loaders[key]
@@ -1,11 +1,13 @@
-from typing import Tuple, Optional, List
+from typing import Optional, List, Dict, Any
 import json
 import os
 
-from core.components.struct import Struct, load_struct
+from core.components.struct import Struct, load_structs, load_remaining_structs
 from core.components.generator_info import GeneratorInfo
 from core.components.export_info import dictize
-from core.logger import error
+from core.utils import write_if_changed
+from core.logger import error, debug
+from core.globals import STORAGE_MODE_FILES, STORAGE_MODES, NODE_ENCODING_JSON, NODE_ENCODINGS
 
 class World:
     SETTINGS_FILENAME = "world.json"
@@ -15,12 +17,22 @@ class World:
     # exported values
     struct_paths: List[str]
     generators: List[GeneratorInfo]
+    storage_mode: str = STORAGE_MODE_FILES
+    journal_fsync_interval: float = 1.0
+    node_encoding: str = NODE_ENCODING_JSON    # how the files storage mode writes nodes, see core/components/codec.py
+    llm: Dict[str, Any]     # LLM client settings, see DEFAULT_LLM_SETTINGS in core/components/llm_client.py
+    struct_headers: List[Dict[str, Any]]    # name and parameter count per struct path, for lazy loading
 
     def save(self) -> None:
-        export_list = ["struct_paths", "generators"]
+        if hasattr(self, "structs"):
+            self.struct_headers = [s.header() for s in self.structs]
+        export_list = ["struct_paths", "generators", "storage_mode", "journal_fsync_interval", "node_encoding", "llm", "struct_headers"]
         export_data = { k:dictize(v) for k,v in self.__dict__.items() if k in export_list }
-        with open(f"{self.dirpath}/{World.SETTINGS_FILENAME}", 'w') as f:
-            json.dump(export_data, f)
+        write_if_changed(f"{self.dirpath}/{World.SETTINGS_FILENAME}", json.dumps(export_data))
+
+    def load_remaining_structs(self) -> bool:
+        # finishes structs left as headers by load_world(lazy=True), the executor needs their type files
+        return load_remaining_structs(self.structs)
     
     @staticmethod
     def empty_world(dirpath: str) -> 'World':
@@ -28,12 +40,20 @@ class World:
         world.dirpath = dirpath
         world.struct_paths = []
         world.generators = []
+        world.storage_mode = STORAGE_MODE_FILES
+        world.journal_fsync_interval = World.journal_fsync_interval
+        world.node_encoding = NODE_ENCODING_JSON
+        world.llm = {}
+        world.struct_headers = []
         return world
 
-def load_world(path: str) -> Optional[World]:
+def load_world(path: str, lazy: bool=False) -> Optional[World]:
+    # lazy only reads the struct headers kept in world.json, the rest of each struct is loaded on first use
     world = World()
 
     world.dirpath = path
+    world.llm = {}
+    world.struct_headers = []
     settings_filepath = f"{path}/{World.SETTINGS_FILENAME}"
     if not os.path.exists(settings_filepath):
         error(f"Could not find world {World.SETTINGS_FILENAME} file, searched {settings_filepath}")
@@ -44,13 +64,28 @@ def load_world(path: str) -> Optional[World]:
             if k == "generators":
                 v = [GeneratorInfo.from_dict(i) for i in v]
             setattr(world, k, v)
+    if world.storage_mode not in STORAGE_MODES:
+        error(f"Unknown storage_mode '{world.storage_mode}' in {settings_filepath}, expected one of {STORAGE_MODES}")
+        return None
+    if world.node_encoding not in NODE_ENCODINGS:
+        error(f"Unknown node_encoding '{world.node_encoding}' in {settings_filepath}, expected one of {NODE_ENCODINGS}")
+        return None
+    if not isinstance(world.llm, dict):
+        error(f"Expected 'llm' in {settings_filepath} to be an object of LLM client settings, got {type(world.llm).__name__}")
+        return None
     
-    world.structs = []
-    for struct_path in world.struct_paths:
-        struct = load_struct(struct_path, path)
-        if not struct:
-            return None
-        struct.save()
-        world.structs.append(struct)
+    if lazy and len(world.struct_headers) == len(world.struct_paths):
+        world.structs = [Struct.from_header(p, path, h) for p, h in zip(world.struct_paths, world.struct_headers)]
+        debug(f"Loaded headers of {len(world.structs)} structs, the rest loads on demand")
+        return world
+
+    structs = load_structs(world.struct_paths, path)
+    if structs is None:
+        return None
+    world.structs = structs
+    # keeps the headers in world.json current for the next lazy load. Opening a world whose headers are current
+    # leaves world.json alone, even if it lacks keys save() would add, like llm
+    if [s.header() for s in structs] != world.struct_headers:
+        world.save()
 
     return world
@@ -5,6 +5,14 @@ LOG_DIRNAME = "logs"
 WORLD_DIRNAME = "worlds"
 STRUCT_DIRNAME  = "structs"
 INSTANCES_DIRNAME = "instances"
+STRUCT_SETTINGS_FILENAME = "struct.json"
+SHARD_WIDTH = 2             # id characters per shard directory level
+MAX_SHARD_DEPTH = 3
+SHARD_RECHECK_INTERVAL = 1.0    # seconds a struct's shard layout is trusted before struct.json is checked again
+MANIFEST_FILENAME = "instances.manifest"
+PACK_FILENAME = "instances.pack"
+PACK_RECHECK_INTERVAL = 1.0     # seconds a struct's pack file and tombstones are trusted before checking them again
+INDEXES_DIRNAME = "indexes"
 
 USERCODE_DIRNAME = "usercode"
 USERCODE_TYPES_DIRNAME = "types"
@@ -14,3 +22,24 @@ USERCODE_SUBDIRS = [USERCODE_TYPES_DIRNAME, USERCODE_GENERATORS_DIRNAME, USERCOD
 
 INNER_PADDING = 2
 OUTER_PADDING = 12
+
+STRUCT_LOAD_WORKERS = 16
+
+NODE_CACHE_MAX_ENTRIES = 65536
+NODE_CACHE_MAX_BYTES = 256 * 1024 * 1024
+
+STORAGE_MODE_FILES = "files"
+STORAGE_MODE_JOURNAL = "journal"
+STORAGE_MODE_SQLITE = "sqlite"
+STORAGE_MODES = [STORAGE_MODE_FILES, STORAGE_MODE_JOURNAL, STORAGE_MODE_SQLITE]
+JOURNAL_FILENAME = "journal.log"
+SQLITE_FILENAME = "nodes.sqlite"
+SQLITE_BATCH_SIZE = 500     # ids per IN (...) query, below SQLite's bound parameter limit
+NODE_ENCODING_JSON = "json"
+NODE_ENCODING_BINARY = "binary"
+NODE_ENCODINGS = [NODE_ENCODING_JSON, NODE_ENCODING_BINARY]
+CODECS_FILENAME = "codecs.json"
+
+CACHE_DIRNAME = "cache"
+COMPLETIONS_DIRNAME = "completions"
+COMPLETION_CACHE_MAX_BYTES = 512 * 1024 * 1024
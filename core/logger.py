@@ -1,7 +1,11 @@
-from typing import Dict, List, Callable, Any
+from typing import Dict, List, Callable, Any, Optional, TextIO
+from abc import ABC, abstractmethod
 from enum import Enum
 from datetime import datetime
+import threading
 import inspect
+import atexit
+import queue
 
 class Levels(Enum):
     DEBUG    = "Debug"
@@ -16,24 +20,28 @@ class LogInfo:
     message: str
     level: Levels
     time: str
-    stack: List[inspect.FrameInfo]
-    def __init__(self, message: str, level: Levels, stack_delta: int=3):
+    stack: List[inspect.FrameInfo]  # empty unless an action registered for this level asked for it
+    def __init__(self, message: str, level: Levels, stack_delta: int=3, capture_stack: bool=True):
         self.message = message
         self.level = level
         self.time = datetime.now().strftime("%H:%M:%S")
-        self.stack = inspect.stack()[stack_delta:]
+        self.stack = inspect.stack()[stack_delta:] if capture_stack else []
 
 actions: Dict[Levels, List[Callable[[LogInfo], Any]]] = { }
+levels_needing_stack: Dict[Levels, bool] = { }
 
-def add_action(action: Callable[[LogInfo], Any], levels: List[Levels]):
+def add_action(action: Callable[[LogInfo], Any], levels: List[Levels], stack_levels: Optional[List[Levels]]=None):
+    # walking the stack is expensive, so it is only captured for levels where some action needs info.stack
     for level in levels:
         if level not in actions:
             actions[level] = []
         actions[level].append(action)
+    for level in stack_levels or []:
+        levels_needing_stack[level] = True
 
 def _generic_log(message: str, level: Levels):
     if level in actions:
-        info = LogInfo(message, level)
+        info = LogInfo(message, level, capture_stack=levels_needing_stack.get(level, False))
         for action in actions[level]:
             action(info)
 
@@ -43,3 +51,78 @@ def info(message: str)     -> str: _generic_log(message, Levels.INFO)    ; retur
 def warning(message: str)  -> str: _generic_log(message, Levels.WARNING) ; return message
 def error(message: str)    -> str: _generic_log(message, Levels.ERROR)   ; return message
 def critical(message: str) -> str: _generic_log(message, Levels.CRITICAL); return message
+
+
+class QueuedSink(ABC):
+    # Log action that hands formatted lines to a background thread, which writes them out in batches.
+    # Calling the sink never does I/O, so logging from tight loops stays cheap. Lines are formatted on the
+    # calling thread, where info.stack is still meaningful.
+    __queue: 'queue.SimpleQueue[Optional[str]]'
+    __thread: threading.Thread
+
+    def __init__(self, format: Callable[[LogInfo], str], flush_interval: float=0.5, batch_size: int=1024):
+        self.format = format
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.__queue = queue.SimpleQueue()
+        self.__closed = False
+        self.__thread = threading.Thread(target=self.__run, daemon=True)
+        self.__thread.start()
+        atexit.register(self.close)
+
+    def __call__(self, info: LogInfo) -> None:
+        if not self.__closed:
+            self.__queue.put(self.format(info))
+
+    @abstractmethod
+    def _write(self, text: str) -> None:
+        pass
+
+    def __run(self) -> None:
+        # wakes up as soon as a line is queued, the batch is whatever else is already waiting
+        stopping = False
+        while not stopping:
+            batch: List[str] = []
+            try:
+                line = self.__queue.get(timeout=self.flush_interval)
+                while line is not None:
+                    batch.append(line)
+                    if len(batch) >= self.batch_size:
+                        break
+                    line = self.__queue.get_nowait()
+                stopping = line is None
+            except queue.Empty:
+                pass
+            if batch:
+                self._write("".join(batch))
+
+    def close(self) -> None:
+        if self.__closed:
+            return
+        self.__closed = True
+        self.__queue.put(None)
+        self.__thread.join()
+
+class QueuedFileSink(QueuedSink):
+    # appends to a log file, opened per batch
+    filepath: str
+
+    def __init__(self, filepath: str, format: Callable[[LogInfo], str], flush_interval: float=0.5, batch_size: int=1024):
+        self.filepath = filepath
+        super().__init__(format, flush_interval, batch_size)
+
+    def _write(self, text: str) -> None:
+        with open(self.filepath, "a") as f:
+            f.write(text)
+
+class QueuedStreamSink(QueuedSink):
+    # console output, a slow or blocked terminal no longer holds up the thread that logs
+    stream: TextIO
+
+    def __init__(self, stream: TextIO, format: Callable[[LogInfo], str], flush_interval: float=0.5, batch_size: int=1024):
+        self.stream = stream
+        super().__init__(format, flush_interval, batch_size)
+
+    def _write(self, text: str) -> None:
+        self.stream.write(text)
+        self.stream.flush()
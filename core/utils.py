@@ -1,4 +1,5 @@
 import re
+import os
 
 from core.logger import error
 
@@ -16,3 +17,19 @@ def check_name(name: str) -> bool:
         error("filename must start with a letter")
         return False
     return True
+
+def write_atomic(filepath: str, text: str) -> None:
+    # readers in other processes see either the old or the new file, never a half written one
+    tmp_filepath = f"{filepath}.{os.getpid()}.tmp"
+    with open(tmp_filepath, "w") as f:
+        f.write(text)
+    os.replace(tmp_filepath, filepath)
+
+def write_if_changed(filepath: str, text: str) -> bool:
+    # skips the write, and so keeps the mtime, when the file already holds exactly this text
+    if os.path.isfile(filepath):
+        with open(filepath) as f:
+            if f.read() == text:
+                return False
+    write_atomic(filepath, text)
+    return True
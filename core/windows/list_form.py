@@ -5,6 +5,7 @@ from typing import Tuple, Optional, Type, List, Any, Dict, Callable
 from functools import partial
 
 from core.components.export_info import ExportInfo, Parameter
+from core.components.index import INDEX_KINDS
 from core.windows.clusters import make_control_buttons, confirm_action
 from core.logger import debug, info, error, critical
 from core.globals import INNER_PADDING, OUTER_PADDING
@@ -16,6 +17,8 @@ type_to_name: Dict[Type, str] = {
 }
 name_to_type: Dict[str, Type] = { n: t for t, n in type_to_name.items() }
 name_list: List[str] = [ n for n in name_to_type ]
+NO_INDEX_NAME = "no index"
+index_name_list: List[str] = [ NO_INDEX_NAME, *INDEX_KINDS ]
 
 class ListFormHolder:
     type_: Type
@@ -51,7 +54,11 @@ class ListFormHolder:
             w['variable'].set(type_to_name[value.type_])
             w['type_drop'] = tk.OptionMenu(self.frame, w['variable'], *name_list)
             w['type_drop'].grid(row=self.index, column=1, sticky='ew', padx=padx)
-            width = 2
+            w['index_variable'] = tk.StringVar(self.frame)
+            w['index_variable'].set(value.index or NO_INDEX_NAME)
+            w['index_drop'] = tk.OptionMenu(self.frame, w['index_variable'], *index_name_list)
+            w['index_drop'].grid(row=self.index, column=2, sticky='ew', padx=padx)
+            width = 3
         elif self.type_ is str:
             w['variable'] = tk.StringVar(self.frame, value)
             if 'options' in self.type_data:
@@ -76,6 +83,7 @@ class ListFormHolder:
         for i in range(index, len(self.datas) - 1):
             if self.type_ is Parameter:
                 self.datas[i]['variable'].set(self.datas[i+1]['variable'].get())
+                self.datas[i]['index_variable'].set(self.datas[i+1]['index_variable'].get())
                 e: tk.Entry = self.datas[i]['name_entry']
                 e.delete(0, len(e.get()))
                 e.insert(0, self.datas[i+1]['name_entry'].get())
@@ -86,7 +94,7 @@ class ListFormHolder:
                 return
         
         for key in self.datas[-1]:
-            if key in ['variable']:
+            if key in ['variable', 'index_variable']:
                 continue
             self.datas[-1][key].destroy()
         
@@ -97,8 +105,10 @@ class ListFormHolder:
         l = []
         for w in self.datas:
             if self.type_ is Parameter:
+                index = w['index_variable'].get()
                 l.append(Parameter(w['name_entry'].get(),
-                                   name_to_type[w['variable'].get()]))
+                                   name_to_type[w['variable'].get()],
+                                   None if index == NO_INDEX_NAME else index))
             elif self.type_ is str:
                 l.append(w['variable'].get())
             else:
@@ -4,18 +4,24 @@ from tkinter import ttk
 
 from enum import IntEnum, auto
 import threading
+import time
 
 from core.components.executor import create_executor
+from core.components.parallel_executor import create_parallel_executor, WORKER_THREAD, WORKER_PROCESS
+from core.components.metrics import RunMetrics
+from core.components.profiler import create_profiler, PROFILE_MODES, PROFILE_OFF
 from core.logger import info, error, critical
-from core.globals import OUTER_PADDING, INNER_PADDING
+from core.globals import OUTER_PADDING, INNER_PADDING, LOG_DIRNAME
 from .shared import GlobalState, LockGlobalState
 
+METRICS_REFRESH_SECONDS = 0.25
+
 class ExecuteType(IntEnum):
     SINGLE_SHOT = auto()
     SET_AMOUNT  = auto()
     UNLIMITED   = auto()
 
-def _start_executor(global_state: GlobalState, execute_type: tk.IntVar, set_amount_count: tk.Entry):
+def _start_executor(global_state: GlobalState, execute_type: tk.IntVar, set_amount_count: tk.Entry, worker_count_entry: tk.Entry, use_processes: tk.BooleanVar, concurrency_entry: tk.Entry, save_metrics: tk.BooleanVar, profile_mode: tk.StringVar):
     if not global_state.world:
         error("Cannot start executor wiht no world loaded")
         return
@@ -56,8 +62,32 @@ def _start_executor(global_state: GlobalState, execute_type: tk.IntVar, set_amou
         critical(f"Got unsupported ExecuteType {ex_type}")
         return
 
+    # figure out how many workers should share the run
+    worker_string = worker_count_entry.get()
+    if not worker_string.isdigit() or int(worker_string) <= 0:
+        error(f"Worker count must be a number >= 1, got '{worker_string}'")
+        return
+    worker_count = int(worker_string)
+    concurrency_string = concurrency_entry.get()
+    if not concurrency_string.isdigit() or int(concurrency_string) <= 0:
+        error(f"Async concurrency must be a number >= 1, got '{concurrency_string}'")
+        return
+    concurrency = int(concurrency_string)
+
+    metrics = RunMetrics(generator_name)
+    global_state.execute_metrics = metrics
+    profiler = create_profiler(profile_mode.get(), generator_name)
+    last_metrics_refresh = 0.0
+    def _refresh_metrics() -> None:
+        nonlocal last_metrics_refresh
+        last_metrics_refresh = time.perf_counter()
+        if global_state.execute_metrics_label:
+            global_state.execute_metrics_label.config(text=metrics.format_line())
+
     try:
         def _on_update(progress: float) -> None:
+            if time.perf_counter() - last_metrics_refresh >= METRICS_REFRESH_SECONDS:
+                _refresh_metrics()
             if global_state.execute_bar and progress is not None:
                 if progress == -1:
                     global_state.execute_bar['mode'] = 'indeterminate'
@@ -67,7 +97,11 @@ def _start_executor(global_state: GlobalState, execute_type: tk.IntVar, set_amou
                     global_state.execute_bar.stop()
                     global_state.execute_bar['value'] = progress * 100
 
-        thread, event = create_executor(execute_count, global_state.world, generator_name, global_state.module_cache, global_state.node_cache, _on_update)
+        if worker_count == 1:
+            thread, event = create_executor(execute_count, global_state.world, generator_name, global_state.module_cache, global_state.node_cache, _on_update, concurrency=concurrency, metrics=metrics, profiler=profiler)
+        else:
+            worker_type = WORKER_PROCESS if use_processes.get() else WORKER_THREAD
+            thread, event = create_parallel_executor(execute_count, global_state.world, generator_name, global_state.node_cache, worker_count, worker_type, _on_update, metrics=metrics, profiler=profiler)
         if not thread or not event:
             return
         global_state.execute_event = event
@@ -78,6 +112,11 @@ def _start_executor(global_state: GlobalState, execute_type: tk.IntVar, set_amou
             with LockGlobalState(global_state, "Executing Generator"):
                 thread.start()
                 thread.join()
+                _refresh_metrics()
+                if save_metrics.get():
+                    metrics.dump(LOG_DIRNAME)
+                if profiler:
+                    profiler.save(LOG_DIRNAME)
                 if global_state.execute_label:
                     global_state.execute_label.config(text=f"Finished executing {generator_name}")
                 if global_state.execute_bar:
@@ -135,10 +174,33 @@ def make_execute_tab(root: tk.Frame, global_state: GlobalState):
     tk.Radiobutton(execute_type_frame, text="Unlimited", variable=execute_type, value=ExecuteType.UNLIMITED.value).grid(row=2, column=0, sticky='w', pady=(0,INNER_PADDING))
     execute_type_frame.pack()
 
+    # add widgets for running the generator on several workers
+    workers_frame = tk.Frame(root)
+    tk.Label(workers_frame, text="Workers").grid(row=0, column=0, padx=(0,INNER_PADDING))
+    worker_count_entry = tk.Entry(workers_frame, width=6)
+    worker_count_entry.insert(0, "1")
+    worker_count_entry.grid(row=0, column=1, padx=(0,INNER_PADDING))
+    use_processes = tk.BooleanVar(root, value=False)
+    tk.Checkbutton(workers_frame, text="Use processes", variable=use_processes).grid(row=0, column=2, padx=(0,INNER_PADDING))
+    tk.Label(workers_frame, text="Async concurrency").grid(row=0, column=3, padx=(0,INNER_PADDING))
+    concurrency_entry = tk.Entry(workers_frame, width=6)
+    concurrency_entry.insert(0, "1")
+    concurrency_entry.grid(row=0, column=4)
+    workers_frame.pack(pady=(0,INNER_PADDING))
+
+    # add widgets for profiling the run, the profile is written to the logs directory
+    profile_frame = tk.Frame(root)
+    tk.Label(profile_frame, text="Profile").grid(row=0, column=0, padx=(0,INNER_PADDING))
+    profile_mode = tk.StringVar(root, PROFILE_OFF)
+    tk.OptionMenu(profile_frame, profile_mode, *PROFILE_MODES).grid(row=0, column=1)
+    profile_frame.pack(pady=(0,INNER_PADDING))
+
     # add widgets for starting and stopping execution
     control_frame = tk.Frame(root)
-    tk.Button(control_frame, text="Start Executor", command=lambda: _start_executor(global_state, execute_type, set_amount_count)).grid(row=0, column=0, padx=(0,INNER_PADDING))
-    tk.Button(control_frame, text="Stop Executor", command=lambda: _stop_executor(global_state)).grid(row=0, column=1)
+    save_metrics = tk.BooleanVar(root, value=True)
+    tk.Button(control_frame, text="Start Executor", command=lambda: _start_executor(global_state, execute_type, set_amount_count, worker_count_entry, use_processes, concurrency_entry, save_metrics, profile_mode)).grid(row=0, column=0, padx=(0,INNER_PADDING))
+    tk.Button(control_frame, text="Stop Executor", command=lambda: _stop_executor(global_state)).grid(row=0, column=1, padx=(0,INNER_PADDING))
+    tk.Checkbutton(control_frame, text="Save metrics to logs", variable=save_metrics).grid(row=0, column=2)
     control_frame.pack()
 
     # add widgets for displaying the execution state
@@ -146,6 +208,8 @@ def make_execute_tab(root: tk.Frame, global_state: GlobalState):
     global_state.execute_label.pack(pady=(OUTER_PADDING,INNER_PADDING))
     global_state.execute_bar = ttk.Progressbar(root, length=500, mode="determinate")
     global_state.execute_bar.pack(padx=OUTER_PADDING)
+    global_state.execute_metrics_label = tk.Label(root, text="")
+    global_state.execute_metrics_label.pack(pady=(INNER_PADDING,0))
 
 def update_execute_options(global_state: GlobalState):
     if not global_state.world or not global_state.execute_options or not global_state.execute_selection:
@@ -12,8 +12,8 @@ from .generator_tab import make_generator_table, update_generator_table
 from .execute_tab import make_execute_tab, update_execute_options
 from .shared import GlobalState
 
-def _try_load_world_state(global_state: GlobalState, root_path: str):
-    world = load_world(root_path)
+def _try_load_world_state(global_state: GlobalState, root_path: str, lazy: bool=False):
+    world = load_world(root_path, lazy)
     if not world:
         return
 
@@ -56,7 +56,7 @@ def _create_project(global_state: GlobalState):
     except Exception as ex:
         error(f"Exception occured creating World:\n{ex}")
 
-def _load_project(global_state: GlobalState):
+def _load_project(global_state: GlobalState, lazy_structs: tk.BooleanVar):
     if global_state.lock:
         error(f"Cannot load projects when global state is locked for '{global_state.lock}'")
         return
@@ -67,7 +67,7 @@ def _load_project(global_state: GlobalState):
     if not folder_path:
         return
     
-    _try_load_world_state(global_state, folder_path)
+    _try_load_world_state(global_state, folder_path, lazy_structs.get())
 
 def make_menu_bar(root: tk.Tk, global_state: GlobalState) -> None:
     menu_bar = tk.Menu(root)
@@ -75,7 +75,10 @@ def make_menu_bar(root: tk.Tk, global_state: GlobalState) -> None:
     file_menu = tk.Menu(menu_bar, tearoff=0)
     menu_bar.add_cascade(label="File", menu=file_menu)
     file_menu.add_command(label="New world",  command=lambda: _create_project(global_state))
-    file_menu.add_command(label="Load world", command=lambda: _load_project(global_state))
+    # only struct names and parameter counts are read up front, each struct loads fully when first needed
+    lazy_structs = tk.BooleanVar(root, value=False)
+    file_menu.add_command(label="Load world", command=lambda: _load_project(global_state, lazy_structs))
+    file_menu.add_checkbutton(label="Load struct headers only", variable=lazy_structs)
 
     root.config(menu=menu_bar)
 
@@ -1,12 +1,14 @@
 import tkinter as tk
 from tkinter import ttk
 
-from typing import Optional, Dict, Iterator
+from typing import Optional, Dict, Any
 import threading
 
 from core.components.world import World
 from core.components.node import NodeCache
+from core.components.metrics import RunMetrics
 from core.logger import error
+from core.globals import NODE_CACHE_MAX_ENTRIES, NODE_CACHE_MAX_BYTES
 
 class GlobalState:
     status_label: tk.Label
@@ -24,8 +26,10 @@ class GlobalState:
     execute_event: Optional[threading.Event] = None
     execute_label: Optional[tk.Label]
     execute_bar: Optional[ttk.Progressbar]
-    module_cache: Dict[str, Iterator[Optional[float]]] = {}
-    node_cache: NodeCache = NodeCache(16)
+    execute_metrics_label: Optional[tk.Label] = None
+    execute_metrics: Optional[RunMetrics] = None        # metrics of the current or last run
+    module_cache: Dict[str, Any] = {}     # sync generator iterators or AsyncGeneratorRun objects
+    node_cache: NodeCache = NodeCache(NODE_CACHE_MAX_ENTRIES, NODE_CACHE_MAX_BYTES)
 
 class LockGlobalState:
     def __init__(self, global_state: GlobalState, reason: str):
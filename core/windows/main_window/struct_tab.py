@@ -6,6 +6,8 @@ import os
 
 from core.windows.generic_form import prompt_edit_form
 from core.components.struct import Struct
+from core.components.manifest import get_manifest
+from core.components.storage import open_storage
 from core.globals import OUTER_PADDING, INSTANCES_DIRNAME
 from core.logger import error, critical
 from core import globals
@@ -86,7 +88,10 @@ def update_struct_table(global_state: GlobalState) -> None:
     if global_state.struct_tree and global_state.world:
         for item in global_state.struct_tree.get_children():
             global_state.struct_tree.delete(item)
-        for struct in global_state.world.structs:
+        world = global_state.world
+        # count with the world's backend, a FileStorage manifest would list the wrong instances for sqlite and journal worlds
+        storage = open_storage(world.dirpath, world.storage_mode, world.journal_fsync_interval, world.node_encoding)
+        for struct in world.structs:
             inst_dirpath = f"{struct.dirpath}/{INSTANCES_DIRNAME}"
             if not os.path.isdir(inst_dirpath):
                 inst_count = 0
@@ -94,5 +99,5 @@ def update_struct_table(global_state: GlobalState) -> None:
                 if response:
                     os.mkdir(inst_dirpath)
             else:
-                inst_count = len([f for f in os.listdir() if f.endswith(".json")])
-            global_state.struct_tree.insert("", "end", values=(struct.name, len(struct.parameters), inst_count, struct.dirpath.replace(global_state.world.dirpath, "")))
+                inst_count = get_manifest(struct.dirpath, storage).count()
+            global_state.struct_tree.insert("", "end", values=(struct.name, struct.parameter_count, inst_count, struct.dirpath.replace(world.dirpath, "")))
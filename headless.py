@@ -0,0 +1,137 @@
+import argparse
+import datetime
+import signal
+import json
+import time
+import sys
+import os
+
+from core.components.world import load_world
+from core.components.node import NodeCache
+from core.components.executor import create_executor
+from core.components.completion_cache import open_completion_cache
+from core.components.llm_client import open_llm_client
+from core.components.metrics import RunMetrics
+from core.components.profiler import create_profiler, PROFILE_MODES, PROFILE_OFF
+from core.components.parallel_executor import create_parallel_executor, WORKER_THREAD, WORKER_PROCESS
+from core.globals import LOG_DIRNAME, NODE_CACHE_MAX_ENTRIES, NODE_CACHE_MAX_BYTES
+from core import logger
+
+# Runs a generator without the GUI, for servers, cron and batch schedulers.
+#   python headless.py <world_dirpath> <generator> [--count N | --unlimited] [--workers N [--processes]] [--concurrency K] [--profile MODE] [--json]
+
+
+#########################
+#   Set up the logger   #
+#########################
+
+def format_log(info: logger.LogInfo) -> str:
+    return f"[{info.time}] {info.level.value.upper()}: {info.message}\n"
+
+def setup_logger(quiet: bool) -> None:
+    if not os.path.exists(LOG_DIRNAME):
+        os.mkdir(LOG_DIRNAME)
+    log_filepath = os.path.join(LOG_DIRNAME, datetime.datetime.now().strftime("%Y-%m-%d_%H-%M-%S_headless.log"))
+    logger.add_action(logger.QueuedFileSink(log_filepath, format_log), levels=logger.ALL_LEVELS)
+    print_levels = [logger.Levels.WARNING, logger.Levels.ERROR, logger.Levels.CRITICAL] if quiet else logger.ALL_LEVELS
+    logger.add_action(logger.QueuedStreamSink(sys.stderr, format_log), levels=print_levels)
+
+
+##########################
+#    Run the executor    #
+##########################
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Run a World Controller generator without the GUI")
+    parser.add_argument("world", help="path to the world root directory")
+    parser.add_argument("generator", help="filename of the generator to run, without .py")
+    amount = parser.add_mutually_exclusive_group()
+    amount.add_argument("--count", type=int, default=1, help="number of generator steps to run (default 1, single shot)")
+    amount.add_argument("--unlimited", action="store_true", help="run until the generator yields None")
+    parser.add_argument("--workers", type=int, default=1, help="number of parallel workers, each gets a shard of the inputs")
+    parser.add_argument("--processes", action="store_true", help="use processes instead of threads for parallel workers")
+    parser.add_argument("--concurrency", type=int, default=1, help="copies of an async generator to run at once on one event loop")
+    parser.add_argument("--profile", choices=PROFILE_MODES, default=PROFILE_OFF, help="profile the generator steps and write the profile to logs/")
+    parser.add_argument("--json", action="store_true", help="print the run report as JSON")
+    parser.add_argument("--quiet", action="store_true", help="only print warnings and errors to stderr")
+    return parser.parse_args()
+
+def run(args: argparse.Namespace) -> int:
+    execute_count = -1 if args.unlimited else args.count
+    if execute_count == 0 or execute_count < -1:
+        logger.error(f"--count must be >= 1, got {execute_count}")
+        return 2
+
+    world = load_world(args.world)
+    if not world:
+        return 1
+    node_cache = NodeCache(NODE_CACHE_MAX_ENTRIES, NODE_CACHE_MAX_BYTES)
+    metrics = RunMetrics(args.generator)
+    profiler = create_profiler(args.profile, args.generator)
+
+    # steps are counted by metrics, on_update also fires when parallel workers finish and skips the last yield
+    last_progress = 0.0
+    def _on_update(progress: float) -> None:
+        nonlocal last_progress
+        last_progress = progress
+
+    if args.workers > 1:
+        worker_type = WORKER_PROCESS if args.processes else WORKER_THREAD
+        thread, event = create_parallel_executor(execute_count, world, args.generator, node_cache, args.workers, worker_type, _on_update, metrics=metrics, profiler=profiler)
+    else:
+        thread, event = create_executor(execute_count, world, args.generator, {}, node_cache, _on_update, concurrency=args.concurrency, metrics=metrics, profiler=profiler)
+    if not thread or not event:
+        return 1
+
+    # Ctrl+C asks the generator to stop at its next yield, like the Stop Executor button
+    signal.signal(signal.SIGINT, lambda *_: event.set())
+
+    wall_start = time.perf_counter()
+    cpu_start = time.process_time()
+    thread.start()
+    while thread.is_alive():
+        thread.join(0.2)
+    wall_time = time.perf_counter() - wall_start
+    cpu_time = time.process_time() - cpu_start
+
+    stats = node_cache.stats()
+    snapshot = metrics.snapshot()
+    yields = snapshot['yields']
+    completion_cache = open_completion_cache(world.dirpath)
+    llm_client = open_llm_client(world.dirpath, world.llm, completion_cache)
+    report = {
+        'world': world.dirpath,
+        'generator': args.generator,
+        'workers': args.workers,
+        'stopped': event.is_set(),
+        'yields': yields,
+        'last_progress': last_progress,
+        'wall_time': wall_time,
+        'cpu_time': cpu_time,
+        'yields_per_sec': yields / wall_time if wall_time > 0 else 0.0,
+        # from metrics, which include process workers, a node is counted once however often it was written
+        'nodes_created': snapshot['node_creates'],
+        'nodes_modified': snapshot['nodes_modified'],
+        'node_cache': stats,
+        'completion_cache': completion_cache.stats(),
+        'llm_client': llm_client.stats() if llm_client else None,
+        'metrics': snapshot,
+        'metrics_file': metrics.dump(LOG_DIRNAME),
+        'profile_files': profiler.save(LOG_DIRNAME) if profiler else [],
+    }
+    if args.json:
+        print(json.dumps(report))
+    else:
+        print(f"Ran {args.generator} on {world.dirpath}: {yields} yields in {wall_time:.3f}s wall / {cpu_time:.3f}s cpu ({report['yields_per_sec']:.2f} yields/sec)")
+        print(f"Nodes created: {report['nodes_created']}, nodes modified: {report['nodes_modified']}, cache hit rate: {stats['hit_rate']:.1%}")
+        print(f"Metrics: {metrics.format_line()}")
+        if report['profile_files']:
+            print(f"Profile: {', '.join(report['profile_files'])}")
+        if args.processes and args.workers > 1:
+            print("The cache hit rate only covers the parent process when using process workers")
+    return 0
+
+if __name__ == "__main__":
+    args = parse_args()
+    setup_logger(args.quiet or args.json)
+    sys.exit(run(args))
@@ -0,0 +1,57 @@
+import json
+
+import pytest
+
+from core import logger
+from core.components.codec import compile_codec, compiled_codecs, remember_codec, decode_node, BINARY_MAGIC
+
+FIELDS = [("name", str), ("stage", int)]
+
+def test_binary_round_trip(tmp_path):
+    codec = compile_codec("codec_round_trip", FIELDS)
+    for data in [
+        { 'name': "Ada", 'stage': 3 },
+        { 'name': "", 'stage': -(1 << 63) },
+        { 'name': "Zoë 名前", 'stage': (1 << 63) - 1, 'notes': ["unknown keys", 1] },
+        { 'stage': 0 },
+        {},
+    ]:
+        raw = codec.encode_binary(data)
+        assert raw.startswith(BINARY_MAGIC)
+        assert codec.decode_binary(raw) == data
+        assert decode_node(raw, str(tmp_path)) == data
+
+def test_mismatched_values_go_to_the_trailing_json(monkeypatch):
+    warnings = []
+    monkeypatch.setattr(logger, "actions", {})
+    logger.add_action(lambda info: warnings.append(info.message), [logger.Levels.WARNING])
+    codec = compile_codec("codec_mismatch", FIELDS)
+
+    for data in [
+        { 'name': 7, 'stage': "seven" },
+        { 'name': ["a"], 'stage': 1 << 70 },
+        { 'name': "Ada", 'stage': 2.5 },
+    ]:
+        assert codec.decode_binary(codec.encode_binary(data)) == data
+    # once per attribute, a value out of i64 range is an int and not a mismatch
+    assert len(warnings) == 2
+
+def test_older_schemas_decode_from_codecs_json(tmp_path, monkeypatch):
+    old = compile_codec("codec_history", FIELDS)
+    remember_codec(str(tmp_path), old)
+    raw = old.encode_binary({ 'name': "Ada", 'stage': 3 })
+    # the struct gained a parameter and this process never compiled the old schema
+    compile_codec("codec_history", FIELDS + [("age", int)])
+    monkeypatch.delitem(compiled_codecs, old.stamp)
+
+    assert decode_node(raw, str(tmp_path)) == { 'name': "Ada", 'stage': 3 }
+    assert decode_node(json.dumps({ 'stage': 1 }).encode(), str(tmp_path)) == { 'stage': 1 }
+
+def test_unknown_schema_and_parameter_types_raise(tmp_path, monkeypatch):
+    codec = compile_codec("codec_unknown", FIELDS)
+    raw = codec.encode_binary({ 'stage': 1 })
+    monkeypatch.delitem(compiled_codecs, codec.stamp)
+    with pytest.raises(ValueError):
+        decode_node(raw, str(tmp_path / "other"))
+    with pytest.raises(ValueError):
+        compile_codec("codec_float", [("weight", float)])
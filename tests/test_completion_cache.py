@@ -0,0 +1,76 @@
+import asyncio
+import json
+import os
+import threading
+
+from core.components.completion_cache import CompletionCache
+from core.components.llm_client import LLMClient
+from core.components.standin_model import StandinModelServer, standin_completion
+
+def test_hits_and_misses_against_the_standin(tmp_path):
+    server = StandinModelServer().start()
+    cache = CompletionCache(str(tmp_path / "completions"))
+    client = LLMClient({ 'base_url': server.base_url, 'model': "standin" }, cache)
+    try:
+        assert client.complete("hello", temperature=0) == standin_completion("standin", "hello")
+        assert client.complete("hello", temperature=0) == standin_completion("standin", "hello")
+        assert server.request_count == 1
+        client.complete("hello", temperature=1)
+        client.complete("hello", model="other", temperature=0)
+        assert server.request_count == 3
+        stats = cache.stats()
+        assert (stats['hits'], stats['misses'], stats['entries']) == (1, 3, 3)
+
+        # a new cache on the same directory serves what the old one stored
+        reopened = CompletionCache(str(tmp_path / "completions"))
+        assert reopened.get("standin", "hello", temperature=0) == standin_completion("standin", "hello")
+    finally:
+        client.close()
+        server.stop()
+
+def test_keys_do_not_depend_on_param_order(tmp_path):
+    assert CompletionCache.make_key("m", "p", { 'a': 1, 'b': [1, 2] }) == CompletionCache.make_key("m", "p", { 'b': [1, 2], 'a': 1 })
+    assert CompletionCache.make_key("m", "p", { 'a': 1 }) != CompletionCache.make_key("m", "p", { 'a': 2 })
+    cache = CompletionCache(str(tmp_path / "completions"))
+    cache.put("m", "p", "text", top_p=1, temperature=0)
+    assert cache.get("m", "p", temperature=0, top_p=1) == "text"
+
+def test_cached_none_is_a_hit(tmp_path):
+    cache = CompletionCache(str(tmp_path / "completions"))
+    calls = []
+    def _compute():
+        calls.append(1)
+        return None
+    async def _compute_async():
+        calls.append(1)
+        return None
+    assert cache.complete("m", "p", _compute) is None
+    assert cache.complete("m", "p", _compute) is None
+    assert asyncio.run(cache.complete_async("m", "p", _compute_async)) is None
+    assert len(calls) == 1
+    assert cache.stats()['hits'] == 2
+
+def test_concurrent_writers_to_the_same_key(tmp_path):
+    dirpath = str(tmp_path / "completions")
+    # two caches on one directory stand in for two processes sharing a world
+    caches = [CompletionCache(dirpath), CompletionCache(dirpath)]
+    errors = []
+    def _write(cache, writer):
+        try:
+            for i in range(50):
+                cache.put("m", "p", f"{writer}-{i}")
+        except Exception as ex:
+            errors.append(ex)
+    threads = [threading.Thread(target=_write, args=(caches[i % 2], i)) for i in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert errors == []
+
+    key = CompletionCache.make_key("m", "p", {})
+    files = [f for _, _, names in os.walk(dirpath) for f in names]
+    assert files == [f"{key}.json"]
+    with open(f"{dirpath}/{key[:2]}/{key}.json") as f:
+        assert json.load(f)['completion'].endswith("-49")
+    assert CompletionCache(dirpath).get("m", "p").endswith("-49")
@@ -0,0 +1,58 @@
+import pytest
+
+from benchmarks.synthetic_world import build_world
+from core import logger
+from core.components.world import load_world
+from core.components.node import NodeCache
+from core.components.executor import create_executor
+
+# every copy yields five times at its own pace, then ends
+ASYNC_GENERATOR = """
+import asyncio
+
+async def generate(create_args, **structs):
+    index = create_args.get('shard', (0, 1))[0]
+    for i in range(5):
+        await asyncio.sleep(0.001 * (index + 1))
+        yield (i + 1) / 6
+    yield None
+""".lstrip()
+
+FAILING_GENERATOR = """
+def generate(create_args, **structs):
+    yield 0.5
+    raise RuntimeError("usercode failed")
+""".lstrip()
+
+def _world(tmp_path, source):
+    dirpath = str(tmp_path / "world")
+    world = build_world(dirpath, 1, 2, 4, 8)
+    generator = world.generators[0]
+    with open(generator.get_filepath(dirpath), "w") as f:
+        f.write(source)
+    return load_world(dirpath), generator.filename
+
+def _run(world, name, module_cache, execute_count, concurrency=1):
+    steps = []
+    thread, _ = create_executor(execute_count, world, name, module_cache, NodeCache(100), on_update=steps.append, concurrency=concurrency)
+    thread.start()
+    thread.join()
+    return len(steps)
+
+@pytest.mark.parametrize("execute_count, expected", [(1, 1), (4, 4), (7, 7), (0, 15), (100, 15)])
+def test_async_copies_share_the_execute_count(tmp_path, execute_count, expected):
+    world, name = _world(tmp_path, ASYNC_GENERATOR)
+    assert _run(world, name, {}, execute_count, concurrency=3) == expected
+
+def test_async_runs_continue_where_they_stopped(tmp_path):
+    world, name = _world(tmp_path, ASYNC_GENERATOR)
+    module_cache = {}
+    assert [_run(world, name, module_cache, 4, concurrency=3) for _ in range(5)] == [4, 4, 4, 3, 0]
+
+def test_sync_generator_exceptions_are_logged(tmp_path, monkeypatch):
+    world, name = _world(tmp_path, FAILING_GENERATOR)
+    logged = []
+    monkeypatch.setattr(logger, "actions", {})
+    logger.add_action(lambda info: logged.append(info.message), [logger.Levels.ERROR])
+    assert _run(world, name, {}, 0) == 1
+    assert any("usercode failed" in message for message in logged)
@@ -0,0 +1,52 @@
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+from benchmarks.synthetic_world import build_world, struct_name
+from core.utils import file_to_class_name
+
+REPO_DIRPATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# writes every input node in each of three steps and creates one node per step
+GENERATOR = """
+from usercode.types.<file_name> import <class_name>
+
+def generate(create_args, <file_name>s):
+    nodes = list(<file_name>s)
+    for step in range(3):
+        for node in nodes:
+            node.set_param_1(step)
+        <class_name>.create(create_args).set_param_1(step)
+        yield (step + 1) / 4
+    yield None
+""".lstrip()
+
+REPORT_KEYS = {
+    'world', 'generator', 'workers', 'stopped', 'yields', 'last_progress', 'wall_time', 'cpu_time', 'yields_per_sec',
+    'nodes_created', 'nodes_modified', 'node_cache', 'completion_cache', 'llm_client', 'metrics', 'metrics_file', 'profile_files',
+}
+
+@pytest.mark.parametrize("workers", [[], ["--workers", "2"], ["--workers", "2", "--processes"]])
+def test_json_report(tmp_path, workers):
+    dirpath = str(tmp_path / "world")
+    world = build_world(dirpath, 1, 2, 4, 8)
+    generator = world.generators[0]
+    with open(generator.get_filepath(dirpath), "w") as f:
+        f.write(GENERATOR.replace("<file_name>", struct_name(0)).replace("<class_name>", file_to_class_name(struct_name(0))))
+
+    result = subprocess.run(
+        [sys.executable, f"{REPO_DIRPATH}/headless.py", dirpath, generator.filename, "--unlimited", "--json", "--quiet", *workers],
+        cwd=str(tmp_path), env={ **os.environ, 'PYTHONPATH': REPO_DIRPATH }, capture_output=True, text=True, timeout=120,
+    )
+    assert result.returncode == 0, result.stderr
+    report = json.loads(result.stdout.strip().splitlines()[-1])
+    assert REPORT_KEYS <= set(report)
+    copies = 2 if workers else 1
+    assert report['yields'] == report['metrics']['yields'] == 4 * copies
+    assert report['nodes_created'] == 3 * copies
+    # every existing node was written three times, and counts once
+    assert report['nodes_modified'] == 4
+    assert not report['stopped']
@@ -0,0 +1,53 @@
+import pytest
+
+from core.components.index import AttributeIndex, INDEX_HASH, INDEX_SORTED
+
+def test_sorted_index_orders_numbers_before_strings(tmp_path):
+    index = AttributeIndex(str(tmp_path), "stage", INDEX_SORTED)
+    index.build([("a", 3), ("b", "x"), ("c", 1.5), ("d", None), ("e", [1, 2]), ("f", 3)])
+    assert index.range() == ["c", "a", "f", "b"]
+    assert index.range(1, 3) == ["c", "a", "f"]
+    assert sorted(index.equal(3)) == ["a", "f"]
+    assert index.equal("x") == ["b"]
+    # None and the list value can not be ordered, equal() hands back the missing set as candidates
+    assert sorted(index.equal(None)) == ["d", "e"]
+    with pytest.raises(ValueError):
+        index.range([1], None)
+
+def test_mixed_updates_never_fail_the_write(tmp_path):
+    index = AttributeIndex(str(tmp_path), "stage", INDEX_SORTED)
+    index.build([("a", 1)])
+    index.add("b", "text")
+    index.update("a", 1, {"nested": True})
+    index.update("b", "text", 2)
+    assert index.range() == ["b"]
+    assert index.equal({"nested": True}) == ["a"]
+    index.remove("a", {"nested": True})
+    assert index.equal(None) == []
+
+def test_hash_index_keeps_unhashable_values_as_missing(tmp_path):
+    index = AttributeIndex(str(tmp_path), "name", INDEX_HASH)
+    index.build([("a", "x"), ("b", ["x"]), ("c", None)])
+    assert index.holds("x") and not index.holds(["x"])
+    assert index.equal("x") == ["a"]
+    assert sorted(index.equal(["x"])) == ["b", "c"]
+    index.update("b", ["x"], "x")
+    assert sorted(index.equal("x")) == ["a", "b"]
+
+@pytest.mark.parametrize("kind", [INDEX_HASH, INDEX_SORTED])
+def test_persisted_index_round_trips(tmp_path, kind):
+    index = AttributeIndex(str(tmp_path), "stage", kind)
+    index.build([("a", 2), ("b", "y"), ("c", None), ("d", 2)])
+    loaded = AttributeIndex(str(tmp_path), "stage", kind)
+    assert loaded.load()
+    for value in [2, "y", None]:
+        assert sorted(loaded.equal(value)) == sorted(index.equal(value))
+
+def test_unsaved_changes_force_a_rebuild(tmp_path):
+    index = AttributeIndex(str(tmp_path), "stage", INDEX_SORTED)
+    index.build([("a", 1)])
+    index.add("b", 2)
+    # crashed before persist(), the file only says it is unclean
+    assert not AttributeIndex(str(tmp_path), "stage", INDEX_SORTED).load()
+    index.persist()
+    assert AttributeIndex(str(tmp_path), "stage", INDEX_SORTED).load()
@@ -0,0 +1,50 @@
+import json
+import os
+
+from core.components.journal import Journal
+from core.globals import JOURNAL_FILENAME
+
+def _record(relpath, data):
+    return f'{{"p": {json.dumps(relpath)}, "d": {json.dumps(data)}}}\n'.encode()
+
+def _world(tmp_path):
+    os.makedirs(tmp_path / "structs" / "person" / "instances")
+    return str(tmp_path)
+
+def test_round_trip_compacts_into_instance_files(tmp_path):
+    world = _world(tmp_path)
+    path = f"{world}/structs/person/instances/a.json"
+    journal = Journal(world)
+    journal.append(path, {"stage": 1})
+    journal.append(path, {"stage": 2})
+    assert journal.lookup(path) == {"stage": 2}
+    journal.close()
+    with open(path) as f:
+        assert json.load(f) == {"stage": 2}
+
+def test_replay_restores_pending_nodes_and_deletes(tmp_path):
+    world = _world(tmp_path)
+    with open(f"{world}/{JOURNAL_FILENAME}", "wb") as f:
+        f.write(_record("structs/person/instances/a.json", {"stage": 1}))
+        f.write(_record("structs/person/instances/b.json", {"stage": 2}))
+        f.write(b'{"p": "structs/person/instances/a.json", "x": true}\n')
+    journal = Journal(world)
+    assert journal.is_deleted(f"{world}/structs/person/instances/a.json")
+    assert journal.lookup(f"{world}/structs/person/instances/b.json") == {"stage": 2}
+    journal.close()
+
+def test_torn_tail_does_not_swallow_the_next_record(tmp_path):
+    world = _world(tmp_path)
+    filepath = f"{world}/{JOURNAL_FILENAME}"
+    with open(filepath, "wb") as f:
+        f.write(_record("structs/person/instances/a.json", {"stage": 1}))
+        f.write(b'{"p": "structs/person/instances/b.json", "d": {"sta')
+    journal = Journal(world)
+    assert os.path.getsize(filepath) == len(_record("structs/person/instances/a.json", {"stage": 1}))
+    journal.append(f"{world}/structs/person/instances/c.json", {"stage": 3})
+    journal.commit(fsync=True)
+
+    with open(filepath, "rb") as f:
+        records = [json.loads(line) for line in f]
+    assert [r['p'] for r in records] == ["structs/person/instances/a.json", "structs/person/instances/c.json"]
+    journal.close()
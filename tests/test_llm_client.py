@@ -0,0 +1,104 @@
+import threading
+import time
+
+import pytest
+
+from core.components.llm_client import LLMClient, LLMError, TokenBucket
+from core.components.standin_model import StandinModelServer, standin_completion
+
+def _client(server, **settings):
+    return LLMClient({ 'base_url': server.base_url, 'model': "standin", 'backoff': 0.02, **settings })
+
+@pytest.mark.parametrize("status", [429, 503])
+def test_retries_with_backoff(status):
+    server = StandinModelServer(fail_first=2, fail_status=status).start()
+    client = _client(server)
+    try:
+        started = time.monotonic()
+        assert client.complete("hello") == standin_completion("standin", "hello")
+        # 0.02 * (1 + 2) at the smallest jitter of 0.5
+        assert time.monotonic() - started >= 0.03
+        assert server.request_count == 3
+        assert client.stats()['retries'] == 2
+    finally:
+        client.close()
+        server.stop()
+
+def test_gives_up_after_max_retries():
+    server = StandinModelServer(fail_first=10, fail_status=500).start()
+    client = _client(server, max_retries=1)
+    try:
+        with pytest.raises(LLMError):
+            client.complete("hello")
+        assert server.request_count == 2
+        assert client.stats()['failures'] == 1
+    finally:
+        client.close()
+        server.stop()
+
+def test_reuses_connections():
+    server = StandinModelServer().start()
+    client = _client(server)
+    try:
+        for i in range(10):
+            assert client.complete(f"prompt {i}") == standin_completion("standin", f"prompt {i}")
+        assert client.stats()['connections_opened'] == 1
+    finally:
+        client.close()
+        server.stop()
+
+def test_batches_concurrent_prompts():
+    server = StandinModelServer().start()
+    client = _client(server, batch_size=4, batch_wait=0.5)
+    prompts = [f"prompt {i}" for i in range(4)]
+    results = {}
+    barrier = threading.Barrier(len(prompts))
+    def _complete(prompt):
+        barrier.wait()
+        results[prompt] = client.complete(prompt)
+    try:
+        threads = [threading.Thread(target=_complete, args=(p,)) for p in prompts]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert results == { p: standin_completion("standin", p) for p in prompts }
+        assert server.batch_sizes == [4]
+        assert client.stats()['requests'] == 1
+    finally:
+        client.close()
+        server.stop()
+
+def test_token_bucket_charges_requests_larger_than_its_capacity():
+    bucket = TokenBucket(100, 10)
+    assert bucket.acquire(50) == 0.0
+    # the first request left the bucket 40 short, the next one waits for that and its own token
+    assert bucket.acquire(1) >= 0.4
+
+def test_tokens_per_minute_holds_for_large_prompts():
+    server = StandinModelServer().start()
+    # 100 tokens per second with a capacity of 100, every call is estimated at 150 tokens
+    client = _client(server, tokens_per_minute=6000)
+    try:
+        assert LLMClient.estimate_tokens(["hi"], { 'max_tokens': 149 }) == 150
+        started = time.monotonic()
+        client.complete("hi", max_tokens=149)
+        client.complete("hi", max_tokens=149)
+        assert time.monotonic() - started >= 1.4
+        assert client.stats()['throttle_time'] >= 1.4
+    finally:
+        client.close()
+        server.stop()
+
+def test_requests_per_minute():
+    server = StandinModelServer().start()
+    client = _client(server, requests_per_minute=120)
+    try:
+        started = time.monotonic()
+        for i in range(4):
+            client.complete(f"prompt {i}")
+        # two fit in the bucket, the other two wait half a second each
+        assert time.monotonic() - started >= 0.9
+    finally:
+        client.close()
+        server.stop()
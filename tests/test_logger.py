@@ -0,0 +1,40 @@
+import io
+import threading
+import time
+
+from core import logger
+
+class BlockedStream(io.StringIO):
+    # a terminal nobody reads from, writes wait until it is released
+    def __init__(self):
+        super().__init__()
+        self.released = threading.Event()
+
+    def write(self, text):
+        self.released.wait()
+        return super().write(text)
+
+def test_stream_sink_does_not_block_the_caller(monkeypatch):
+    stream = BlockedStream()
+    sink = logger.QueuedStreamSink(stream, lambda info: f"{info.level.value}: {info.message}\n")
+    monkeypatch.setattr(logger, "actions", {})
+    logger.add_action(sink, logger.ALL_LEVELS)
+
+    started = time.monotonic()
+    for i in range(100):
+        logger.info(f"line {i}")
+    assert time.monotonic() - started < 1.0
+    assert stream.getvalue() == ""
+
+    stream.released.set()
+    sink.close()
+    assert stream.getvalue() == "".join(f"Info: line {i}\n" for i in range(100))
+
+def test_file_sink_writes_everything_on_close(tmp_path):
+    filepath = str(tmp_path / "run.log")
+    sink = logger.QueuedFileSink(filepath, lambda info: f"{info.message}\n", batch_size=7)
+    for i in range(50):
+        sink(logger.LogInfo(f"line {i}", logger.Levels.DEBUG, capture_stack=False))
+    sink.close()
+    with open(filepath) as f:
+        assert f.read() == "".join(f"line {i}\n" for i in range(50))
@@ -0,0 +1,88 @@
+import multiprocessing
+import os
+import uuid
+
+from core.components.manifest import InstanceManifest, MANIFEST_FILENAME
+from core.globals import INSTANCES_DIRNAME
+
+def _struct(tmp_path, count=0):
+    struct_dirpath = str(tmp_path / "person")
+    os.makedirs(f"{struct_dirpath}/{INSTANCES_DIRNAME}")
+    for _ in range(count):
+        _write_instance(struct_dirpath, uuid.uuid4().hex)
+    return struct_dirpath
+
+def _write_instance(struct_dirpath, node_id):
+    with open(f"{struct_dirpath}/{INSTANCES_DIRNAME}/{node_id}.json", "w") as f:
+        f.write("{}")
+
+def _create(manifest, struct_dirpath):
+    # what Node.create does
+    node_id = uuid.uuid4().hex
+    with manifest.locked():
+        manifest.ensure_fresh()
+        _write_instance(struct_dirpath, node_id)
+        manifest.add([node_id])
+    return node_id
+
+def _delete(manifest, struct_dirpath, node_id):
+    with manifest.locked():
+        manifest.ensure_fresh()
+        os.remove(f"{struct_dirpath}/{INSTANCES_DIRNAME}/{node_id}.json")
+        manifest.remove([node_id])
+
+def test_round_trip_keeps_creation_order(tmp_path):
+    struct_dirpath = _struct(tmp_path)
+    manifest = InstanceManifest(struct_dirpath)
+    created = [_create(manifest, struct_dirpath) for _ in range(5)]
+    _delete(manifest, struct_dirpath, created[1])
+    expected = [created[0]] + created[2:]
+    assert manifest.ids() == expected
+    assert manifest.id_at(1) == created[2]
+    # a new process reads the same manifest from disk
+    reopened = InstanceManifest(struct_dirpath)
+    assert reopened.count() == 4
+    assert reopened.ids() == expected
+
+def test_own_changes_do_not_rebuild(tmp_path, monkeypatch):
+    struct_dirpath = _struct(tmp_path, 10)
+    manifest = InstanceManifest(struct_dirpath)
+    ids = manifest.ids()
+    rebuilds = []
+    monkeypatch.setattr(manifest.storage, "list", lambda *args: rebuilds.append(args) or [])
+    for node_id in ids:
+        _delete(manifest, struct_dirpath, node_id)
+    _create(manifest, struct_dirpath)
+    assert rebuilds == []
+    assert manifest.count() == 1
+
+def test_files_changed_behind_its_back_are_found(tmp_path):
+    struct_dirpath = _struct(tmp_path, 3)
+    manifest = InstanceManifest(struct_dirpath)
+    assert manifest.count() == 3
+    _write_instance(struct_dirpath, uuid.uuid4().hex)
+    os.utime(f"{struct_dirpath}/{INSTANCES_DIRNAME}", ns=(1, 1))
+    assert manifest.count() == 4
+
+def test_corrupt_manifest_is_rebuilt(tmp_path):
+    struct_dirpath = _struct(tmp_path, 3)
+    with open(f"{struct_dirpath}/{MANIFEST_FILENAME}", "wb") as f:
+        f.write(b"garbage")
+    assert InstanceManifest(struct_dirpath).count() == 3
+
+def _create_and_delete(struct_dirpath):
+    manifest = InstanceManifest(struct_dirpath)
+    created = [_create(manifest, struct_dirpath) for _ in range(30)]
+    for node_id in created[::3]:
+        _delete(manifest, struct_dirpath, node_id)
+
+def test_concurrent_processes_keep_an_exact_count(tmp_path):
+    struct_dirpath = _struct(tmp_path, 10)
+    InstanceManifest(struct_dirpath).ensure_fresh()
+    with multiprocessing.get_context("spawn").Pool(4) as pool:
+        pool.map(_create_and_delete, [struct_dirpath] * 4)
+    # read the header as written, a rebuild would hide a wrong count
+    with open(f"{struct_dirpath}/{MANIFEST_FILENAME}", "rb") as f:
+        header_count = int(f.readline().split()[1])
+    assert header_count == 10 + 4 * 20
+    assert sorted(InstanceManifest(struct_dirpath).ids()) == sorted(n[:-len(".json")] for n in os.listdir(f"{struct_dirpath}/{INSTANCES_DIRNAME}"))
@@ -0,0 +1,92 @@
+import json
+import os
+
+from core.components.node import NodeCache, CachePolicy
+from core.components.storage import FileStorage
+
+def _cache(tmp_path, max_size, max_bytes=0, policy=CachePolicy.LRU):
+    os.makedirs(tmp_path / "instances", exist_ok=True)
+    return NodeCache(max_size, max_bytes, policy)
+
+def _path(tmp_path, name):
+    return str(tmp_path / "instances" / f"{name}.json")
+
+def _read(path):
+    with open(path) as f:
+        return json.load(f)
+
+def test_lru_evicts_the_least_recently_used(tmp_path):
+    cache = _cache(tmp_path, 3)
+    a, b, c, d = (_path(tmp_path, n) for n in "abcd")
+    for path in (a, b, c):
+        cache.store(path, {})
+    cache.get(a)
+    cache.store(d, {})
+    assert [cache.contains(p) for p in (a, b, c, d)] == [True, False, True, True]
+
+def test_lfu_evicts_the_least_frequently_used(tmp_path):
+    cache = _cache(tmp_path, 3, policy=CachePolicy.LFU)
+    a, b, c, d, e = (_path(tmp_path, n) for n in "abcde")
+    for path in (a, b, c):
+        cache.store(path, {})
+    cache.get(a)
+    cache.get(a)
+    cache.get(c)
+    cache.store(d, {})
+    assert not cache.contains(b)
+    # d was only used once, c twice
+    cache.store(e, {})
+    assert [cache.contains(p) for p in (a, c, d, e)] == [True, True, False, True]
+
+def test_byte_budget(tmp_path):
+    cache = _cache(tmp_path, 100, max_bytes=100)
+    paths = [_path(tmp_path, n) for n in "abcd"]
+    for path in paths:
+        cache.store(path, {}, size=40)
+    assert [cache.contains(p) for p in paths] == [False, False, True, True]
+    stats = cache.stats()
+    assert stats['bytes'] == 80 and stats['evictions'] == 2
+
+def test_dirty_victims_are_written_out(tmp_path):
+    cache = _cache(tmp_path, 2)
+    a, b, c = (_path(tmp_path, n) for n in "abc")
+    cache.store(a, { 'stage': 1 }, dirty=True)
+    cache.store(b, { 'stage': 2 })
+    cache.store(c, { 'stage': 3 })
+    assert _read(a) == { 'stage': 1 }
+    # clean victims are dropped without a write
+    cache.store(a, { 'stage': 1 })
+    assert not os.path.exists(b)
+    assert cache.stats()['writes'] == 1
+
+def test_stats_counters(tmp_path):
+    cache = _cache(tmp_path, 2)
+    a, b = _path(tmp_path, "a"), _path(tmp_path, "b")
+    cache.write_through(a, { 'stage': 1 })
+    assert cache.get(a) == { 'stage': 1 }
+    assert cache.get(b) is None
+    cache.store(b, { 'stage': 2 }, dirty=True)
+    stats = cache.stats()
+    assert (stats['hits'], stats['misses'], stats['writes'], stats['dirty'], stats['entries']) == (1, 1, 1, 1, 2)
+    assert stats['hit_rate'] == 0.5
+    assert cache.flush() == 1
+    assert cache.stats()['dirty'] == 0 and _read(b) == { 'stage': 2 }
+
+def test_a_stale_read_does_not_replace_a_pending_write(tmp_path):
+    cache = _cache(tmp_path, 4)
+    path = _path(tmp_path, "a")
+    cache.write_through(path, { 'stage': 1 })
+    cache.remove(path)
+
+    class RacingStorage(FileStorage):
+        # another thread writes the node back between the storage read and the store
+        def get(self, path_on_disk):
+            loaded = super().get(path_on_disk)
+            cache.store(path_on_disk, { 'stage': 2 }, dirty=True)
+            return loaded
+    cache.storage = RacingStorage()
+
+    assert cache.read_through(path) == { 'stage': 2 }
+    assert cache.is_dirty(path)
+    cache.flush()
+    assert _read(path) == { 'stage': 2 }
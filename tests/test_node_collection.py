@@ -0,0 +1,40 @@
+import os
+
+from core.components.node import Node, NodeCache
+from core.components.node_collection import NodeCollection
+from core.globals import STRUCT_DIRNAME, INSTANCES_DIRNAME
+
+class Person(Node):
+    NAME = "person"
+    ATTRS = []
+
+def _collection(tmp_path, count):
+    world_dirpath = str(tmp_path)
+    os.makedirs(f"{world_dirpath}/{STRUCT_DIRNAME}/person/{INSTANCES_DIRNAME}")
+    cache = NodeCache(100)
+    create_args = { 'world_dirpath': world_dirpath, 'global_cache': cache }
+    collection = NodeCollection(Person, f"{world_dirpath}/{STRUCT_DIRNAME}/person", cache)
+    for _ in range(count):
+        Person.create(create_args)
+    return collection, create_args
+
+def test_iterating_while_creating_nodes_ends(tmp_path):
+    collection, create_args = _collection(tmp_path, 3)
+    visited = []
+    for node in collection:
+        visited.append(node.get_id())
+        Person.create(create_args)
+    # the 3 nodes from the start, then the 3 created while walking them, the 3 created in that pass wait
+    assert len(visited) == len(set(visited)) == 6
+    assert len(collection) == 9
+
+def test_nodes_created_while_iterating_are_picked_up_once(tmp_path):
+    collection, create_args = _collection(tmp_path, 2)
+    created = []
+    visited = []
+    for node in collection:
+        visited.append(node.get_id())
+        if len(created) < 1:
+            created.append(Person.create(create_args).get_id())
+    assert visited[2:] == created
+    assert sorted(visited) == sorted(collection.ids())
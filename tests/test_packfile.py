@@ -0,0 +1,77 @@
+import json
+import os
+import uuid
+
+from core.components.packfile import PackFile, write_pack, repack, get_pack, tombstone_filepath
+from core.components.shards import shard_path
+from core.globals import INSTANCES_DIRNAME
+
+def _struct(tmp_path):
+    path = str(tmp_path / "person")
+    os.makedirs(f"{path}/{INSTANCES_DIRNAME}")
+    return path
+
+def _write_loose(filepath, data):
+    os.makedirs(os.path.dirname(filepath), exist_ok=True)
+    with open(filepath, "w") as f:
+        json.dump(data, f)
+
+def _files(dirpath):
+    return [f for _, _, files in os.walk(dirpath) for f in files]
+
+def test_round_trip_finds_every_record(tmp_path):
+    filepath = str(tmp_path / "instances.pack")
+    records = [(uuid.uuid4().hex, json.dumps({ 'stage': i }).encode()) for i in range(600)]
+    assert write_pack(filepath, records) == 600
+
+    pack = PackFile(filepath)
+    try:
+        assert pack.count == 600
+        assert pack.verify()
+        for node_id, data in records:
+            assert pack.read(node_id) == data
+        assert pack.read(uuid.uuid4().hex) is None
+        # records come back in the order they were written, not in index order
+        assert pack.ids() == [node_id for node_id, _ in records]
+        assert list(pack.scan()) == records
+    finally:
+        pack.close()
+    assert os.listdir(tmp_path) == ["instances.pack"]
+
+def test_verify_detects_a_damaged_record(tmp_path):
+    filepath = str(tmp_path / "instances.pack")
+    write_pack(filepath, [(uuid.uuid4().hex, b'{"stage": 1}')])
+    with open(filepath, "r+b") as f:
+        f.seek(12)
+        f.write(b"9")
+    pack = PackFile(filepath)
+    try:
+        assert not pack.verify()
+    finally:
+        pack.close()
+
+def test_repack_folds_in_loose_files_and_tombstones(tmp_path):
+    struct_dirpath = _struct(tmp_path)
+    a, b, c, d = (uuid.uuid4().hex for _ in range(4))
+    _write_loose(shard_path(struct_dirpath, a, 0), { 'stage': 1 })
+    _write_loose(shard_path(struct_dirpath, b, 0), { 'stage': 2 })
+    # repack finds loose files in shard directories too
+    _write_loose(shard_path(struct_dirpath, c, 2), { 'stage': 3 })
+    assert repack(struct_dirpath) == 3
+    assert sorted(get_pack(struct_dirpath, recheck=True).ids()) == sorted([a, b, c])
+    assert _files(f"{struct_dirpath}/{INSTANCES_DIRNAME}") == []
+
+    # a deleted packed node, a loose file shadowing a packed one and a new node
+    open(tombstone_filepath(struct_dirpath, a), "w").close()
+    _write_loose(shard_path(struct_dirpath, b, 0), { 'stage': 20 })
+    _write_loose(shard_path(struct_dirpath, d, 0), { 'stage': 4 })
+    assert get_pack(struct_dirpath, recheck=True).tombstones == { a }
+
+    assert repack(struct_dirpath) == 3
+    pack = get_pack(struct_dirpath, recheck=True)
+    assert sorted(pack.ids()) == sorted([b, c, d])
+    assert pack.tombstones == set()
+    assert json.loads(pack.read(b)) == { 'stage': 20 }
+    assert json.loads(pack.read(d)) == { 'stage': 4 }
+    assert pack.verify()
+    assert _files(f"{struct_dirpath}/{INSTANCES_DIRNAME}") == []
@@ -0,0 +1,44 @@
+import os
+
+import pytest
+
+from benchmarks.synthetic_world import build_world, struct_name, param_name
+from core.components.world import load_world
+from core.components.node import NodeCache
+from core.components.manifest import get_manifest
+from core.components.parallel_executor import create_parallel_executor, WORKER_THREAD, WORKER_PROCESS
+from core.utils import file_to_class_name
+from core.globals import STRUCT_DIRNAME, INSTANCES_DIRNAME, MANIFEST_FILENAME
+
+# every worker creates nodes and deletes some of them again, the manifest has to account for all of it
+CREATE_GENERATOR = """
+from usercode.types.<file_name> import <class_name>
+
+def generate(create_args, <file_name>s):
+    for i in range(30):
+        node = <class_name>.create(create_args)
+        node.set_<param>(i)
+        if i % 3 == 0:
+            node.delete()
+        yield (i + 1) / 31
+    yield None
+""".lstrip()
+
+@pytest.mark.parametrize("worker_type", [WORKER_THREAD, WORKER_PROCESS])
+def test_workers_creating_nodes_keep_the_manifest_exact(tmp_path, worker_type):
+    dirpath = str(tmp_path / "world")
+    world = build_world(dirpath, 1, 2, 10, 8)
+    generator = world.generators[0]
+    with open(generator.get_filepath(dirpath), "w") as f:
+        f.write(CREATE_GENERATOR.replace("<file_name>", struct_name(0)).replace("<class_name>", file_to_class_name(struct_name(0))).replace("<param>", param_name(1)))
+    world = load_world(dirpath)
+    thread, _ = create_parallel_executor(100, world, generator.filename, NodeCache(1000), 4, worker_type)
+    thread.start()
+    thread.join()
+
+    struct_dirpath = f"{dirpath}/{STRUCT_DIRNAME}/{struct_name(0)}"
+    files = sorted(n[:-len(".json")] for n in os.listdir(f"{struct_dirpath}/{INSTANCES_DIRNAME}"))
+    assert len(files) == 10 + 4 * 20
+    with open(f"{struct_dirpath}/{MANIFEST_FILENAME}", "rb") as f:
+        assert int(f.readline().split()[1]) == len(files)
+    assert sorted(get_manifest(struct_dirpath).ids()) == files
@@ -0,0 +1,129 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+from benchmarks.synthetic_world import build_world, struct_name
+from core.components import shards
+from core.components.shards import reshard, shard_path, write_shard_settings, scan_instances
+from core.components.storage import FileStorage
+from core.globals import STRUCT_DIRNAME, INSTANCES_DIRNAME
+
+REPO_DIRPATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def _struct(tmp_path, count=12, shard_depth=0):
+    dirpath = str(tmp_path / "world")
+    build_world(dirpath, 1, 2, count, 8, shard_depth=shard_depth)
+    return dirpath, f"{dirpath}/{STRUCT_DIRNAME}/{struct_name(0)}"
+
+def _path(struct_dirpath, node_id):
+    # node paths keep the flat form whatever the layout
+    return f"{struct_dirpath}/{INSTANCES_DIRNAME}/{node_id}.json"
+
+def _snapshot(storage, struct_dirpath):
+    return { node_id: storage.get(_path(struct_dirpath, node_id))[0] for node_id in storage.list(struct_dirpath) }
+
+def _at_depth(struct_dirpath, ids, depth):
+    return all(os.path.exists(shard_path(struct_dirpath, node_id, depth)) for node_id in ids)
+
+def _fast_layout_checks(monkeypatch):
+    monkeypatch.setattr(shards, "SHARD_RECHECK_INTERVAL", 0.01)
+
+def test_sharded_create_lookup_and_enumeration(tmp_path):
+    _, struct_dirpath = _struct(tmp_path, shard_depth=2)
+    storage = FileStorage()
+    ids = storage.list(struct_dirpath)
+    assert len(ids) == 12
+    assert _at_depth(struct_dirpath, ids, 2)
+    assert not [e for e in os.scandir(f"{struct_dirpath}/{INSTANCES_DIRNAME}") if e.is_file()]
+    for node_id in ids:
+        assert storage.exists(_path(struct_dirpath, node_id))
+        assert set(storage.get(_path(struct_dirpath, node_id))[0]) == { "param_0", "param_1" }
+
+def test_reshard_there_and_back(tmp_path, monkeypatch):
+    _fast_layout_checks(monkeypatch)
+    _, struct_dirpath = _struct(tmp_path)
+    storage = FileStorage()
+    before = _snapshot(storage, struct_dirpath)
+
+    assert reshard(struct_dirpath, 2) == 12
+    assert _at_depth(struct_dirpath, before, 2)
+    assert _snapshot(storage, struct_dirpath) == before
+    assert reshard(struct_dirpath, 2) == 0
+
+    assert reshard(struct_dirpath, 0) == 12
+    assert _at_depth(struct_dirpath, before, 0)
+    assert _snapshot(storage, struct_dirpath) == before
+    # emptied shard directories are removed
+    assert not [e for e in os.scandir(f"{struct_dirpath}/{INSTANCES_DIRNAME}") if e.is_dir()]
+
+def test_lookups_during_a_migration(tmp_path, monkeypatch):
+    _fast_layout_checks(monkeypatch)
+    _, struct_dirpath = _struct(tmp_path)
+    storage = FileStorage()
+    before = _snapshot(storage, struct_dirpath)
+    ids = sorted(before)
+
+    # what a reshard to depth 2 that stopped halfway leaves behind
+    write_shard_settings(struct_dirpath, { "shard_depth": 2, "reshard_from": 0 })
+    for node_id in ids[:6]:
+        target = shard_path(struct_dirpath, node_id, 2)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        os.rename(shard_path(struct_dirpath, node_id, 0), target)
+    assert _snapshot(storage, struct_dirpath) == before
+
+    # a write lands in the new layout and drops the copy in the old one
+    storage.put(_path(struct_dirpath, ids[-1]), { "param_1": 7 })
+    assert not os.path.exists(shard_path(struct_dirpath, ids[-1], 0))
+    assert storage.get(_path(struct_dirpath, ids[-1]))[0] == { "param_1": 7 }
+
+    with pytest.raises(ValueError):
+        reshard(struct_dirpath, 1)
+    # running the same reshard again finishes it
+    assert reshard(struct_dirpath, 2) == 5
+    assert _at_depth(struct_dirpath, ids, 2)
+    assert shards.read_layout(struct_dirpath) == (2, None)
+
+def test_nodes_written_during_a_reshard_survive(tmp_path, monkeypatch):
+    _fast_layout_checks(monkeypatch)
+    _, struct_dirpath = _struct(tmp_path)
+    storage = FileStorage()
+    before = _snapshot(storage, struct_dirpath)
+    ids = sorted(before)
+
+    # one node is written once every process sees the new layout, another after the reshard listed the old files
+    sleep = shards.time.sleep
+    def _sleep(seconds):
+        sleep(seconds)
+        storage.put(_path(struct_dirpath, ids[0]), { "param_1": 1 })
+    def _scan(struct_dirpath):
+        entries = list(scan_instances(struct_dirpath))
+        storage.put(_path(struct_dirpath, ids[1]), { "param_1": 2 })
+        return entries
+    monkeypatch.setattr(shards.time, "sleep", _sleep)
+    monkeypatch.setattr(shards, "scan_instances", _scan)
+
+    reshard(struct_dirpath, 2)
+    assert _at_depth(struct_dirpath, ids, 2)
+    after = _snapshot(storage, struct_dirpath)
+    assert after[ids[0]] == { "param_1": 1 }
+    assert after[ids[1]] == { "param_1": 2 }
+    assert { k: v for k, v in after.items() if k not in ids[:2] } == { k: v for k, v in before.items() if k not in ids[:2] }
+
+def test_cli(tmp_path):
+    dirpath, struct_dirpath = _struct(tmp_path)
+    ids = FileStorage().list(struct_dirpath)
+    result = subprocess.run(
+        [sys.executable, "-m", "core.components.shards", "reshard", dirpath, "--depth", "1"],
+        cwd=REPO_DIRPATH, capture_output=True, text=True, timeout=60,
+    )
+    assert result.returncode == 0, result.stderr
+    assert f"{struct_name(0)}: moved 12 files" in result.stdout
+    assert _at_depth(struct_dirpath, ids, 1)
+
+    result = subprocess.run(
+        [sys.executable, "-m", "core.components.shards", "reshard", dirpath, "--depth", str(shards.MAX_SHARD_DEPTH + 1)],
+        cwd=REPO_DIRPATH, capture_output=True, text=True, timeout=60,
+    )
+    assert result.returncode == 1
@@ -0,0 +1,58 @@
+import json
+import os
+
+import pytest
+
+from core.components.sqlite_storage import SqliteStorage
+from core.components.manifest import InstanceManifest
+from core.components.export_info import type_to_int
+from core.globals import INSTANCES_DIRNAME, STRUCT_SETTINGS_FILENAME
+
+def _struct(tmp_path):
+    struct_dirpath = str(tmp_path / "structs" / "person")
+    os.makedirs(struct_dirpath)
+    with open(f"{struct_dirpath}/{STRUCT_SETTINGS_FILENAME}", "w") as f:
+        json.dump({ 'name': "person", 'parameters': [{ 'name': "name", 'type': type_to_int[str] }, { 'name': "stage", 'type': type_to_int[int] }] }, f)
+    return struct_dirpath
+
+def _path(struct_dirpath, node_id):
+    return f"{struct_dirpath}/{INSTANCES_DIRNAME}/{node_id}.json"
+
+def test_round_trip_keeps_mismatched_and_undeclared_values(tmp_path):
+    struct_dirpath = _struct(tmp_path)
+    storage = SqliteStorage(str(tmp_path))
+    data = { 'name': "a", 'stage': "not an int", 'tags': [1, 2] }
+    storage.create(_path(struct_dirpath, "a"), data)
+    storage.put(_path(struct_dirpath, "b"), { 'stage': 3 })
+    assert storage.get(_path(struct_dirpath, "a"))[0] == data
+    assert storage.get(_path(struct_dirpath, "b"))[0] == { 'stage': 3 }
+    assert storage.list(struct_dirpath) == ["a", "b"]
+    with pytest.raises(RuntimeError):
+        storage.create(_path(struct_dirpath, "a"), {})
+    storage.close()
+
+def test_change_stamp_only_moves_on_creates_and_deletes(tmp_path):
+    struct_dirpath = _struct(tmp_path)
+    storage = SqliteStorage(str(tmp_path))
+    storage.create(_path(struct_dirpath, "a"), {})
+    stamp = storage.change_stamp(struct_dirpath)
+    storage.put(_path(struct_dirpath, "a"), { 'stage': 1 })
+    storage.put_many([(_path(struct_dirpath, "a"), { 'stage': 2 })])
+    assert storage.change_stamp(struct_dirpath) == stamp
+    storage.delete(_path(struct_dirpath, "a"))
+    assert storage.change_stamp(struct_dirpath) == stamp + 1
+    storage.close()
+
+def test_manifest_sees_nodes_created_through_another_connection(tmp_path):
+    struct_dirpath = _struct(tmp_path)
+    ours, theirs = SqliteStorage(str(tmp_path)), SqliteStorage(str(tmp_path))
+    ours.create_many([(_path(struct_dirpath, f"a{i}"), {}) for i in range(20)])
+    manifest = InstanceManifest(struct_dirpath)
+    manifest.storage = ours
+    assert manifest.count() == 20
+    theirs.create_many([(_path(struct_dirpath, f"b{i}"), {}) for i in range(5)])
+    assert manifest.count() == 25
+    theirs.delete(_path(struct_dirpath, "a0"))
+    assert "a0" not in manifest.ids()
+    ours.close()
+    theirs.close()
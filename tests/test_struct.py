@@ -0,0 +1,35 @@
+import json
+import os
+import threading
+
+from core import logger
+from core.components.struct import load_structs, load_remaining_structs, Struct
+from core.globals import STRUCT_SETTINGS_FILENAME
+
+def _struct_dirs(tmp_path, names):
+    paths = []
+    for name in names:
+        path = str(tmp_path / "structs" / name)
+        os.makedirs(path)
+        with open(f"{path}/{STRUCT_SETTINGS_FILENAME}", "w") as f:
+            json.dump({ 'name': name, 'parameters': [] }, f)
+        paths.append(path)
+    os.makedirs(tmp_path / "usercode" / "types")
+    return paths
+
+def test_load_failures_are_logged_on_the_calling_thread(tmp_path, monkeypatch):
+    paths = _struct_dirs(tmp_path, ["a", "b", "c"])
+    os.remove(f"{paths[1]}/{STRUCT_SETTINGS_FILENAME}")
+    logged = []
+    monkeypatch.setattr(logger, "actions", {})
+    logger.add_action(lambda info: logged.append((threading.current_thread(), info.message)), [logger.Levels.ERROR])
+
+    assert load_structs(paths, str(tmp_path)) is None
+    assert [thread for thread, _ in logged] == [threading.current_thread()]
+    assert paths[1] in logged[0][1]
+
+    lazy = [Struct.from_header(p, str(tmp_path), { 'name': os.path.basename(p), 'parameter_count': 0 }) for p in paths]
+    logged.clear()
+    assert not load_remaining_structs(lazy)
+    assert [thread for thread, _ in logged] == [threading.current_thread()]
+    assert lazy[0].is_loaded() and not lazy[1].is_loaded()
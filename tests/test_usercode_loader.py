@@ -0,0 +1,40 @@
+import os
+import sys
+
+import pytest
+
+from core.components.usercode_loader import UsercodeLoader
+
+def _write(path, source):
+    with open(path, "w") as f:
+        f.write(source)
+
+def test_failed_reload_keeps_dependents_stale(tmp_path, monkeypatch):
+    common = tmp_path / "usercode" / "common"
+    types = tmp_path / "usercode" / "types"
+    os.makedirs(common)
+    os.makedirs(types)
+    _write(common / "base.py", "VALUE = 1\n")
+    _write(common / "zbroken.py", "READY = True\n")
+    _write(types / "person.py", "from usercode.common import base\nVALUE = base.VALUE\n")
+    monkeypatch.syspath_prepend(str(tmp_path))
+    try:
+        loader = UsercodeLoader(str(tmp_path))
+        assert loader.load() is not None
+        assert sys.modules["usercode.types.person"].VALUE == 1
+
+        # base runs again before zbroken raises, person never gets to run
+        _write(common / "base.py", "VALUE = 22\n")
+        _write(common / "zbroken.py", "raise RuntimeError('broken')\n")
+        with pytest.raises(RuntimeError):
+            loader.load()
+        assert sys.modules["usercode.common.base"].VALUE == 1
+
+        _write(common / "zbroken.py", "READY = False\n")
+        report = loader.load()
+        assert report is not None
+        assert sorted(report.reloaded) == ["usercode.common.base", "usercode.common.zbroken", "usercode.types.person"]
+        assert sys.modules["usercode.types.person"].VALUE == 22
+    finally:
+        for key in [key for key in sys.modules if key == "usercode" or key.startswith("usercode.")]:
+            sys.modules.pop(key)
@@ -0,0 +1,39 @@
+import json
+
+from benchmarks.synthetic_world import build_world
+from core.components.world import load_world, World
+
+def _settings_filepath(dirpath):
+    return f"{dirpath}/{World.SETTINGS_FILENAME}"
+
+def test_loading_a_current_world_does_not_write(tmp_path):
+    dirpath = str(tmp_path / "world")
+    build_world(dirpath, 2, 2, 1, 8)
+    with open(_settings_filepath(dirpath)) as f:
+        data = json.load(f)
+    # written by hand or by an older version, without the llm settings
+    del data['llm']
+    text = json.dumps(data, indent=4)
+    with open(_settings_filepath(dirpath), "w") as f:
+        f.write(text)
+
+    assert load_world(dirpath) is not None
+    assert load_world(dirpath, lazy=True) is not None
+    with open(_settings_filepath(dirpath)) as f:
+        assert f.read() == text
+
+def test_loading_writes_stale_struct_headers(tmp_path):
+    dirpath = str(tmp_path / "world")
+    build_world(dirpath, 2, 2, 1, 8)
+    with open(_settings_filepath(dirpath)) as f:
+        data = json.load(f)
+    headers = data.pop('struct_headers')
+    with open(_settings_filepath(dirpath), "w") as f:
+        json.dump(data, f)
+
+    world = load_world(dirpath)
+    assert world is not None
+    with open(_settings_filepath(dirpath)) as f:
+        assert json.load(f)['struct_headers'] == headers
+    lazy = load_world(dirpath, lazy=True)
+    assert lazy is not None and [s.name for s in lazy.structs] == [s.name for s in world.structs]